@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Warm-up of the VSD object cache at startup.
+
+After a restart the cache is empty and the first binds pay for the lookups of
+the enterprise, domain templates, domains, zones and subnets. The warm-up walks
+the tree of the Gluon enterprise once, fetching the zones of the domains and the
+subnets of the zones with a bounded number of parallel fetches, and caches every
+object under the key NUSplitActivation looks it up with.
+"""
+
+import logging
+import Queue
+import threading
+import time
+
+from nuage.reconciler import default_page_size, fetch_all
+
+logger = logging.getLogger(__name__)
+
+default_concurrency = 8
+
+
+class CacheWarmup(object):
+    """load the VSD objects of an enterprise into a VSDObjectCache"""
+
+    def __init__(self, cache, open_session, concurrency=default_concurrency, page_size=default_page_size):
+        """
+        :param open_session: function returning a context manager making a started VSD session the current one of
+                             the thread, called for each fetch
+        """
+        self.cache = cache
+        self.open_session = open_session
+        self.concurrency = concurrency
+        self.page_size = page_size
+
+        self.loaded = 0
+        self.failures = 0
+        self.duration = 0
+
+        self._lock = threading.Lock()
+        self._tasks = Queue.Queue()
+
+    def run(self, enterprise_name):
+        """walk the tree of the enterprise, return the number of objects cached"""
+        start = time.time()
+
+        with self.open_session() as session:
+            enterprise = session.user.enterprises.get_first(filter='name == "%s"' % enterprise_name)
+
+            if enterprise is None:
+                logger.error("enterprise %s not found in VSD, nothing to warm up" % enterprise_name)
+                return 0
+
+            self._put('enterprise', enterprise_name, enterprise)
+
+            for template in fetch_all(enterprise.domain_templates, self.page_size):
+                self._put('domain_template', (enterprise.id, template.name), template)
+
+            domains = fetch_all(enterprise.domains, self.page_size)
+
+        for domain in domains:
+            self._put('domain', (enterprise.id, domain.route_distinguisher, domain.route_target), domain)
+            self._tasks.put((self._load_zones, domain))
+
+        fetchers = [threading.Thread(target=self._run, name='cache-warmup-%d' % index)
+                    for index in range(min(self.concurrency, len(domains)))]
+
+        for fetcher in fetchers:
+            fetcher.setDaemon(True)
+            fetcher.start()
+
+        self._tasks.join()
+
+        for fetcher in fetchers:
+            self._tasks.put(None)
+
+        self.duration = time.time() - start
+
+        logger.info("warmed up the VSD cache with %d objects of %d domains in %.1fs, %d fetches failed" % (
+            self.loaded, len(domains), self.duration, self.failures))
+
+        return self.loaded
+
+    def _load_zones(self, domain):
+        for zone in fetch_all(domain.zones, self.page_size):
+            self._put('zone', (domain.id, zone.name), zone)
+            self._tasks.put((self._load_subnets, zone))
+
+    def _load_subnets(self, zone):
+        for subnet in fetch_all(zone.subnets, self.page_size):
+            self._put('subnet', (zone.id, subnet.address, subnet.netmask), subnet)
+
+    def _put(self, kind, key, value):
+        self.cache.put(kind, key, value)
+
+        with self._lock:
+            self.loaded += 1
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+
+            if task is None:
+                return
+
+            function, parent = task
+
+            try:
+                with self.open_session():
+                    function(parent)
+
+            except Exception, e:
+                # the objects not cached are looked up by the binds
+                logger.error("warming up the VSD cache under %s failed: %s" % (parent.id, str(e)))
+
+                with self._lock:
+                    self.failures += 1
+
+            finally:
+                self._tasks.task_done()
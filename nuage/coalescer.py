@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+FIFO queue merging the pending items of a key.
+
+An item put for a key that still has an item waiting in the queue is offered to
+the merge function together with that item. When they can be merged, the waiting
+item is replaced by the merged one and keeps its place in the queue, otherwise the
+new item is appended as usual. Items that were never merged come out in the order
+they were put, like with Queue.Queue.
+"""
+
+import threading
+import time
+
+from collections import deque
+
+
+class CoalescingQueue(object):
+    """queue keeping at most the latest mergeable item per key"""
+
+    def __init__(self, merge=None):
+        """
+        :param merge: function(waiting, new) returning the merged item, or None when the two items
+                      must be processed one after the other. Without it nothing is merged.
+        """
+        self.merge = merge
+        self.merged = 0
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._all_tasks_done = threading.Condition(self._lock)
+
+        self._entries = deque()
+        self._last = {}
+        self._unfinished = 0
+
+    def put(self, key, item):
+        with self._lock:
+            entry = self._last.get(key) if self.merge is not None and key else None
+
+            if entry is not None:
+                merged = self.merge(entry[1], item)
+
+                if merged is not None:
+                    entry[1] = merged
+                    self.merged += 1
+                    return
+
+            entry = [key, item, time.time()]
+            self._entries.append(entry)
+            self._last[key] = entry
+            self._unfinished += 1
+            self._not_empty.notify()
+
+    def get(self):
+        with self._lock:
+            while not self._entries:
+                self._not_empty.wait()
+
+            entry = self._entries.popleft()
+
+            if self._last.get(entry[0]) is entry:
+                del self._last[entry[0]]
+
+            return entry[1]
+
+    def task_done(self):
+        with self._lock:
+            self._unfinished -= 1
+
+            if self._unfinished <= 0:
+                self._all_tasks_done.notify_all()
+
+    def join(self):
+        with self._lock:
+            while self._unfinished:
+                self._all_tasks_done.wait()
+
+    def qsize(self):
+        return len(self._entries)
+
+    def oldest_age(self):
+        """return the number of seconds the oldest item has been waiting, 0 if the queue is empty"""
+        try:
+            return time.time() - self._entries[0][2]
+
+        except IndexError:
+            return 0
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Pool of etcd clients, shared by the shim watcher, workers and status writers.
+
+A watch is a long poll that can stay open for an hour, so each watching thread
+gets its own client, and the short reads and writes are served by a pool of keep-alive
+clients, one thread at a time per client. Several etcd cluster members can be
+given: all clients talk to the same member, and when a request cannot reach it
+the pool fails over to the next member and retries the request there.
+"""
+
+import logging
+import threading
+
+from contextlib import contextmanager
+
+import etcd
+
+logger = logging.getLogger(__name__)
+
+default_port = 2379
+
+# seconds a short request may take, the watch uses its own timeout
+default_read_timeout = 60
+default_watch_timeout = 3600
+
+
+def parse_hosts(hosts, port=default_port):
+    """parse a comma separated list of host[:port] into a list of (host, port)"""
+    members = []
+
+    for member in hosts.split(','):
+        member = member.strip()
+
+        if not member:
+            continue
+
+        if ':' in member:
+            host, member_port = member.rsplit(':', 1)
+            members.append((host, int(member_port)))
+
+        else:
+            members.append((member, int(port)))
+
+    if not members:
+        raise ValueError("no etcd host in %r" % hosts)
+
+    return members
+
+
+def read_dir_keys(client, key):
+    """return the names of the keys in the etcd directory key and the etcd index of the read"""
+    result = client.read(key, recursive=True)
+    prefix = key.rstrip('/') + '/'
+    names = set(node.key[len(prefix):] for node in result.leaves if node.key.startswith(prefix) and not node.dir)
+
+    return names, result.etcd_index
+
+
+class EtcdClientPool(object):
+    """hand out etcd clients of the current cluster member, failing over to the next one"""
+
+    def __init__(self, members, size, read_timeout=default_read_timeout, watch_timeout=default_watch_timeout):
+        if size < 1:
+            raise ValueError("etcd client pool size must be at least 1, got %s" % size)
+
+        self.members = list(members)
+        self.size = size
+        self.read_timeout = read_timeout
+        self.watch_timeout = watch_timeout
+
+        self.created = 0
+        self.failovers = 0
+
+        self._lock = threading.Lock()
+        self._available = threading.Semaphore(size)
+        self._idle = {}
+        self._current = 0
+
+        # each watching thread long polls on its own client
+        self._watch = threading.local()
+
+    def get_member(self):
+        with self._lock:
+            return self.members[self._current]
+
+    def in_use(self):
+        with self._lock:
+            return self.created - sum(len(idle) for idle in self._idle.values())
+
+    @contextmanager
+    def client(self):
+        """context manager checking out a client of the current member and returning it to the pool"""
+        member, client = self.acquire()
+
+        try:
+            yield client
+
+        finally:
+            self.release(member, client)
+
+    def acquire(self):
+        """return the current member and one of its idle clients, blocking while all clients are in use"""
+        self._available.acquire()
+
+        with self._lock:
+            member = self.members[self._current]
+            idle = self._idle.setdefault(member, [])
+            client = idle.pop() if idle else None
+
+            if client is None:
+                self.created += 1
+
+        if client is None:
+            client = self._connect(member, self.read_timeout)
+
+        return member, client
+
+    def release(self, member, client):
+        with self._lock:
+            if member == self.members[self._current]:
+                self._idle.setdefault(member, []).append(client)
+
+            else:
+                # the pool failed over while the client was in use
+                self.created -= 1
+
+        self._available.release()
+
+    def read(self, key, **kwargs):
+        return self._execute('read', key, **kwargs)
+
+    def get(self, key):
+        return self._execute('get', key)
+
+    def write(self, key, value, **kwargs):
+        return self._execute('write', key, value, **kwargs)
+
+    def delete(self, key, **kwargs):
+        return self._execute('delete', key, **kwargs)
+
+    def watch(self, key, **kwargs):
+        """long poll the changes of key on the watch client of the calling thread"""
+        for attempt in range(len(self.members)):
+            member = self.get_member()
+
+            if getattr(self._watch, 'member', None) != member:
+                self._watch.client = self._connect(member, self.watch_timeout)
+                self._watch.member = member
+
+            client = self._watch.client
+
+            try:
+                return client.read(key, wait=True, **kwargs)
+
+            except etcd.EtcdWatchTimedOut:
+                raise
+
+            except etcd.EtcdConnectionFailed, e:
+                self._fail(member, e)
+
+        raise etcd.EtcdConnectionFailed("no etcd member reachable in %s" % self.members)
+
+    def _execute(self, method, *args, **kwargs):
+        for attempt in range(len(self.members)):
+            member, client = self.acquire()
+
+            try:
+                return getattr(client, method)(*args, **kwargs)
+
+            except etcd.EtcdWatchTimedOut:
+                raise
+
+            except etcd.EtcdConnectionFailed, e:
+                self._fail(member, e)
+
+            finally:
+                self.release(member, client)
+
+        raise etcd.EtcdConnectionFailed("no etcd member reachable in %s" % self.members)
+
+    def _connect(self, member, read_timeout):
+        host, port = member
+        # one connection per client, kept alive between requests
+        return etcd.Client(host=host, port=port, read_timeout=read_timeout, per_host_pool_size=1)
+
+    def _fail(self, member, e):
+        """move to the next member, unless another thread already did it"""
+        with self._lock:
+            if member != self.members[self._current]:
+                return
+
+            self._current = (self._current + 1) % len(self.members)
+            self.created -= len(self._idle.pop(member, []))
+            self.failovers += 1
+            next_member = self.members[self._current]
+
+        logger.warning("etcd member %s:%d unreachable (%s), failing over to %s:%d" % (
+            member[0], member[1], str(e), next_member[0], next_member[1]))
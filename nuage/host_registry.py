@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Registry of the compute hosts managed by the shim.
+
+The ports of a host are bound only when the host is in the registry. The hosts
+are read from a file, one host id per line, or from an etcd directory holding
+one key per host id, e.g.
+
+    etcdctl set /controller/nuage-hosts/cbserver5 ''
+
+and are reloaded live: the file is polled for changes and the etcd directory is
+watched. Every reload reports the added and removed hosts to a callback.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import etcd
+
+from nuage.etcd_pool import read_dir_keys
+
+logger = logging.getLogger(__name__)
+
+default_hosts_key = '/controller/nuage-hosts'
+
+# seconds between two checks of the hosts file
+default_poll_interval = 10
+
+
+class HostRegistry(object):
+    """set of the managed compute host ids"""
+
+    def __init__(self, hosts=()):
+        self.reloads = 0
+        self._hosts = frozenset(hosts)
+
+    def __contains__(self, host_id):
+        return host_id in self._hosts
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def get_hosts(self):
+        return self._hosts
+
+    def update(self, hosts):
+        """replace the managed hosts, return the (added, removed) host sets"""
+        hosts = frozenset(hosts)
+        added = hosts - self._hosts
+        removed = self._hosts - hosts
+
+        # the set is swapped, never modified, so the workers can read it without a lock
+        self._hosts = hosts
+        self.reloads += 1
+
+        if added or removed:
+            logger.info("managed hosts: %s, added: %s, removed: %s" % (
+                ', '.join(sorted(hosts)), ', '.join(sorted(added)), ', '.join(sorted(removed))))
+
+        return added, removed
+
+
+def read_hosts_file(path):
+    """return the host ids listed in path, ignoring blank lines and # comments"""
+    hosts = set()
+
+    with open(path) as f:
+        for line in f:
+            host = line.split('#', 1)[0].strip()
+
+            if host:
+                hosts.add(host)
+
+    return hosts
+
+
+class HostFileWatcher(threading.Thread):
+    """reload the registry when the hosts file changes"""
+
+    def __init__(self, registry, path, on_change, interval=default_poll_interval):
+        threading.Thread.__init__(self, name='host-file-watcher')
+        self.setDaemon(True)
+
+        self.registry = registry
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.mtime = None
+
+    def load(self):
+        """load the hosts file if it changed since the last load"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+
+            if mtime == self.mtime:
+                return
+
+            hosts = read_hosts_file(self.path)
+            self.mtime = mtime
+
+        except (IOError, OSError), e:
+            logger.error("reading hosts file %s failed: %s" % (self.path, str(e)))
+            return
+
+        added, removed = self.registry.update(hosts)
+
+        if added or removed:
+            self.on_change(added, removed)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.load()
+
+
+class HostDirWatcher(threading.Thread):
+    """reload the registry from an etcd directory whenever one of its keys changes"""
+
+    def __init__(self, registry, client, key, on_change):
+        threading.Thread.__init__(self, name='host-dir-watcher')
+        self.setDaemon(True)
+
+        self.registry = registry
+        self.client = client
+        self.key = key
+        self.on_change = on_change
+        self.etcd_index = 0
+
+    def load(self):
+        """read the hosts directory, keeping the current hosts while it does not exist"""
+        try:
+            hosts, self.etcd_index = read_dir_keys(self.client, self.key)
+
+        except etcd.EtcdKeyNotFound, e:
+            self.etcd_index = (e.payload or {}).get('index', self.etcd_index)
+            logger.info("%s does not exist, keeping the managed hosts %s" % (
+                self.key, ', '.join(sorted(self.registry.get_hosts()))))
+            return
+
+        added, removed = self.registry.update(hosts)
+
+        if added or removed:
+            self.on_change(added, removed)
+
+    def run(self):
+        while True:
+            try:
+                self.client.watch(self.key, recursive=True, waitIndex=self.etcd_index + 1)
+
+                # the directory is small, read it again rather than applying the event
+                self.load()
+
+            except etcd.EtcdWatchTimedOut:
+                pass
+
+            except etcd.EtcdEventIndexCleared:
+                self.load()
+
+            except etcd.EtcdException, e:
+                logger.error("watching %s failed: %s, retrying in 5 seconds" % (self.key, str(e)))
+                time.sleep(5)
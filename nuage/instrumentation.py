@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Per step timing of the VM activations.
+
+Each activation run by NUSplitActivation records an ActivationTrace: the duration of
+its steps (enterprise, domain, zone, subnet, vport, vm lookups and creations) and of
+every VSD request made during them. Finished traces are handed to the registered
+sinks. Without sinks no trace is recorded at all.
+"""
+
+import logging
+import time
+
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+sinks = []
+
+
+def add_sink(sink):
+    sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    sinks.remove(sink)
+
+
+def start_trace(name, port=None):
+    """return a new trace, or None when there is no sink to send it to"""
+    if not sinks:
+        return None
+
+    return ActivationTrace(name, port)
+
+
+def finish_trace(trace, succeeded):
+    """close the trace and send it to the sinks"""
+    if trace is None:
+        return
+
+    trace.finish(succeeded)
+
+    for sink in list(sinks):
+        try:
+            sink.emit(trace)
+
+        except Exception, e:
+            logger.error("activation trace sink %s failed: %s" % (sink.__class__.__name__, str(e)))
+
+
+class ActivationTrace(object):
+    """timings of the steps and VSD requests of one activation"""
+
+    def __init__(self, name, port=None):
+        self.name = name
+        self.port = port
+        self.succeeded = None
+        self.duration = None
+
+        # list of (step, seconds) and of (step, object type, operation, seconds, failed)
+        self.steps = []
+        self.calls = []
+
+        self._current = None
+        self._start = time.time()
+
+    @contextmanager
+    def step(self, name):
+        previous = self._current
+        self._current = name
+        start = time.time()
+
+        try:
+            yield
+
+        finally:
+            self.steps.append((name, time.time() - start))
+            self._current = previous
+
+    def record_call(self, object_type, operation, seconds, failed):
+        self.calls.append((self._current, object_type, operation, seconds, failed))
+
+    def finish(self, succeeded):
+        self.succeeded = succeeded
+        self.duration = time.time() - self._start
+
+    def get_step_totals(self):
+        """return a list of (step, seconds, VSD requests) in the order the steps first ran"""
+        totals = {}
+        order = []
+
+        for name, seconds in self.steps:
+            if name not in totals:
+                totals[name] = [0.0, 0]
+                order.append(name)
+
+            totals[name][0] += seconds
+
+        for name, object_type, operation, seconds, failed in self.calls:
+            if name in totals:
+                totals[name][1] += 1
+
+        return [(name, totals[name][0], totals[name][1]) for name in order]
+
+
+class LogSink(object):
+    """log one line per activation"""
+
+    def __init__(self, log=logger, level=logging.INFO):
+        self.log = log
+        self.level = level
+
+    def emit(self, trace):
+        steps = ' '.join('%s=%.3fs/%d' % step for step in trace.get_step_totals())
+
+        self.log.log(self.level, "%s %s %s in %.3fs, %d VSD requests: %s" % (
+            trace.name, trace.port, 'succeeded' if trace.succeeded else 'failed', trace.duration,
+            len(trace.calls), steps))
+
+
+class MetricsSink(object):
+    """record the traces in a metrics registry"""
+
+    def __init__(self, registry):
+        self.activation_seconds = registry.histogram(
+            'nuage_shim_activation_duration_seconds', 'duration of the activations', ('activation', 'result'))
+        self.step_seconds = registry.histogram(
+            'nuage_shim_activation_step_duration_seconds', 'duration of the activation steps', ('activation', 'step'))
+        self.requests_per_activation = registry.histogram(
+            'nuage_shim_activation_vsd_requests', 'VSD requests made per activation', ('activation',),
+            buckets=(1, 2, 4, 6, 8, 10, 12, 16, 24, 32, 64))
+        self.requests_total = registry.counter(
+            'nuage_shim_vsd_requests_total', 'VSD requests made by the activations',
+            ('object_type', 'operation', 'result'))
+        self.request_seconds = registry.histogram(
+            'nuage_shim_vsd_request_duration_seconds', 'duration of the VSD requests', ('object_type', 'operation'))
+
+    def emit(self, trace):
+        self.activation_seconds.observe(trace.duration, activation=trace.name,
+                                        result='ok' if trace.succeeded else 'failed')
+        self.requests_per_activation.observe(len(trace.calls), activation=trace.name)
+
+        for name, seconds in trace.steps:
+            self.step_seconds.observe(seconds, activation=trace.name, step=name)
+
+        for name, object_type, operation, seconds, failed in trace.calls:
+            self.requests_total.inc(object_type=object_type, operation=operation, result='failed' if failed else 'ok')
+            self.request_seconds.observe(seconds, object_type=object_type, operation=operation)
+
+
+class CallbackSink(object):
+    """call function(trace) for each activation"""
+
+    def __init__(self, function):
+        self.function = function
+
+    def emit(self, trace):
+        self.function(trace)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Leader lock of an active/standby pair of shims.
+
+The lock is an etcd key written with a TTL by the leader and refreshed every
+third of the TTL. Its value names the leader and carries the etcd index up to
+which the leader processed every event, e.g.
+
+    {"leader": "node-1-4242", "etcd_index": 10230}
+
+A standby waits on the key and takes the lock as soon as it is deleted or
+expires, then resumes from the last index published by the previous leader.
+"""
+
+import json
+import logging
+import threading
+import time
+
+import etcd
+
+logger = logging.getLogger(__name__)
+
+default_leader_key = '/controller/nuage-leader'
+
+# seconds the lock lives without being refreshed, i.e. the longest failover
+default_leader_ttl = 6
+
+delete_actions = ('delete', 'expire', 'compareAndDelete')
+
+
+class LeaderLock(object):
+    """etcd lock held by the active shim"""
+
+    def __init__(self, client, key, name, ttl=default_leader_ttl, get_index=None, on_lost=None):
+        """
+        :param get_index: function returning the etcd index published with the lock
+        :param on_lost: function called when the lock is lost while being held
+        """
+        self.client = client
+        self.key = key
+        self.name = name
+        self.ttl = ttl
+        self.get_index = get_index
+        self.on_lost = on_lost
+
+        # last leader seen and the etcd index it published
+        self.leader = None
+        self.leader_index = 0
+
+        self.modified_index = None
+        self.refreshed = 0
+
+    def is_leader(self):
+        return self.leader == self.name
+
+    def acquire(self):
+        """block until this instance holds the lock"""
+        while True:
+            try:
+                result = self.client.write(self.key, self._value(), ttl=self.ttl, prevExist=False)
+                self.modified_index = result.modifiedIndex
+                self.refreshed = time.time()
+
+                logger.info("%s is the leader, previous leader %s published etcd index %d" % (
+                    self.name, self.leader or 'none', self.leader_index))
+                self.leader = self.name
+                return
+
+            except etcd.EtcdAlreadyExist:
+                self._wait_for_release()
+
+            except etcd.EtcdException, e:
+                logger.error("acquiring %s failed: %s, retrying in 1 second" % (self.key, str(e)))
+                time.sleep(1)
+
+    def start(self):
+        """start refreshing the lock"""
+        refresher = threading.Thread(target=self._refresh, name='leader-refresh')
+        refresher.setDaemon(True)
+        refresher.start()
+
+        return self
+
+    def release(self):
+        """publish the last etcd index and release the lock, for the standby to take over right away"""
+        if not self.is_leader():
+            return
+
+        try:
+            result = self.client.write(self.key, self._value(), ttl=self.ttl, prevIndex=self.modified_index)
+            self.client.delete(self.key, prevIndex=result.modifiedIndex)
+
+        except etcd.EtcdException, e:
+            logger.error("releasing %s failed: %s" % (self.key, str(e)))
+
+        self.leader = None
+
+    def _value(self, etcd_index=None):
+        if etcd_index is None:
+            etcd_index = self.get_index() if self.get_index is not None else 0
+
+        return json.dumps({'leader': self.name, 'etcd_index': etcd_index})
+
+    def _observe(self, value):
+        try:
+            value = json.loads(value)
+            self.leader = value.get('leader')
+            self.leader_index = value.get('etcd_index') or self.leader_index
+
+        except (AttributeError, TypeError, ValueError):
+            logger.error("invalid value of %s: %r" % (self.key, value))
+
+    def _wait_for_release(self):
+        """follow the lock until it is deleted or expires"""
+        try:
+            result = self.client.get(self.key)
+
+        except etcd.EtcdKeyNotFound:
+            return
+
+        self._observe(result.value)
+        wait_index = result.modifiedIndex + 1
+
+        while True:
+            try:
+                result = self.client.watch(self.key, waitIndex=wait_index)
+
+            except etcd.EtcdWatchTimedOut:
+                continue
+
+            except etcd.EtcdEventIndexCleared:
+                return
+
+            if result.action in delete_actions:
+                logger.info("leader %s is gone" % self.leader)
+                return
+
+            self._observe(result.value)
+            wait_index = result.modifiedIndex + 1
+
+    def refresh(self):
+        """refresh the lock and publish the etcd index, return False once the lock is lost"""
+        etcd_index = self.get_index() if self.get_index is not None else 0
+
+        try:
+            result = self.client.write(self.key, self._value(etcd_index), ttl=self.ttl, prevIndex=self.modified_index)
+            self.modified_index = result.modifiedIndex
+            self.leader_index = etcd_index
+            self.refreshed = time.time()
+
+        except (etcd.EtcdCompareFailed, etcd.EtcdKeyNotFound):
+            self._lost("the lock was taken over")
+            return False
+
+        except etcd.EtcdException, e:
+            logger.error("refreshing %s failed: %s" % (self.key, str(e)))
+
+            if time.time() - self.refreshed >= self.ttl:
+                self._lost("the lock expired")
+                return False
+
+        return True
+
+    def _refresh(self):
+        while True:
+            time.sleep(self.ttl / 3.0)
+
+            if not self.refresh():
+                return
+
+    def _lost(self, reason):
+        logger.error("%s lost the leadership: %s" % (self.name, reason))
+        self.leader = None
+
+        if self.on_lost is not None:
+            self.on_lost()
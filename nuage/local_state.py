@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+On-disk snapshot of the shim state for fast restarts.
+
+The snapshot holds the bind status of the ports, the known Proton ports, the VPN
+table mirror and the committed etcd index: the index up to which every event was
+processed. On startup the shim loads it and resumes watching right after that
+index, so only the changes made since the snapshot are processed again. When etcd
+no longer has those events the watch falls back to a resync against the snapshot.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+state_version = 1
+
+
+class ProgressTracker(object):
+    """highest etcd index up to which every dispatched event has been processed"""
+
+    def __init__(self, index=0):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_keys = {}
+        self._seen = index
+
+    def add(self, index, key=None):
+        """record an event of key dispatched to the workers, without key the index is only held back from commit"""
+        with self._lock:
+            self._increment(self._pending, index)
+
+            if key is not None:
+                self._increment(self._pending_keys, key)
+
+            if index > self._seen:
+                self._seen = index
+
+    def done(self, index, key=None):
+        """record an event of key processed, or merged into a later one"""
+        with self._lock:
+            self._decrement(self._pending, index)
+
+            if key is not None:
+                self._decrement(self._pending_keys, key)
+
+    def advance(self, index):
+        """record that everything up to index was seen, e.g. after a resync"""
+        with self._lock:
+            if index > self._seen:
+                self._seen = index
+
+    def committed(self):
+        with self._lock:
+            if self._pending:
+                return min(self._pending) - 1
+
+            return self._seen
+
+    def get_pending_keys(self):
+        """return the keys having events not processed yet"""
+        with self._lock:
+            return set(self._pending_keys)
+
+    def has_pending(self, key):
+        """return True if key has events not processed yet"""
+        with self._lock:
+            return key in self._pending_keys
+
+    def _increment(self, counts, key):
+        counts[key] = counts.get(key, 0) + 1
+
+    def _decrement(self, counts, key):
+        count = counts.get(key, 0) - 1
+
+        if count > 0:
+            counts[key] = count
+
+        else:
+            counts.pop(key, None)
+
+
+def save_state(path, etcd_index, vm_status, ports, vpn_tables, pending=()):
+    """atomically replace the snapshot at path
+
+    Ports modified after etcd_index or still pending are saved with an unknown (0) modified
+    index, a resync from the snapshot then processes them again.
+    """
+    state = {
+        'version': state_version,
+        'etcd_index': etcd_index,
+        'vm_status': vm_status,
+        'ports': dict((uuid, (key, modified_index if modified_index <= etcd_index and uuid not in pending else 0,
+                              value))
+                      for uuid, (key, modified_index, value) in ports.items()),
+        'vpn_tables': vpn_tables,
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.nuage-state-', dir=directory)
+
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump(state, temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+        os.rename(temp_path, path)
+
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+    logger.info("saved state of %d ports at etcd index %d" % (len(ports), etcd_index))
+
+
+def load_state(path):
+    """return the snapshot at path, or None if there is no usable snapshot"""
+    try:
+        with open(path) as state_file:
+            state = json.load(state_file)
+
+    except IOError, e:
+        logger.info("no state snapshot at %s: %s" % (path, str(e)))
+        return None
+
+    except ValueError, e:
+        logger.error("ignoring corrupt state snapshot %s: %s" % (path, str(e)))
+        return None
+
+    if state.get('version') != state_version:
+        logger.error("ignoring state snapshot %s of version %s" % (path, state.get('version')))
+        return None
+
+    state['ports'] = dict((uuid, tuple(port)) for uuid, port in state['ports'].items())
+
+    return state
@@ -35,26 +35,94 @@ import argparse
 import time
 import string
 import ntpath
+import socket
+import threading
 
 import logging
 
-from Queue import Queue
-from threading import Thread
-
+from nuage import instrumentation
+from nuage.cache_warmup import CacheWarmup, default_concurrency as default_warmup_concurrency
+from nuage.etcd_pool import EtcdClientPool, parse_hosts
+from nuage.host_registry import HostDirWatcher, HostFileWatcher, HostRegistry, default_hosts_key
+from nuage.instrumentation import LogSink, MetricsSink
+from nuage.leader import LeaderLock, default_leader_key, default_leader_ttl
+from nuage.local_state import ProgressTracker, load_state, save_state
+from nuage.metrics import MetricsRegistry, start_http_server
+from nuage.partition import Membership, default_member_ttl, default_members_key
+from nuage.port_event import PortEvent, decode_event, decode_value, port_table
+from nuage.reconciler import Reconciler, default_interval as default_reconcile_interval, read_vsd_ports
 from nuage.vm_split_activation import NUSplitActivation
+from nuage.resync import ResyncEngine
+from nuage.retry import RetryScheduler, default_base_delay, default_max_attempts, default_max_delay
+from nuage.status_writer import StatusWriter, default_num_writers
+from nuage.vpn_mirror import VPNTableMirror
+from nuage.vsd_cache import VSDObjectCache, default_ttl
+from nuage.vsd_session import VSDSessionManager
+from nuage.warm_pool import WarmPool, default_batch_size as default_warm_pool_batch
+from nuage.worker_pool import ShardedWorkerPool
 
 vsd_api_url = 'https://127.0.0.1:8443'
 etcd_default_port = 2379
 etcd_nuage_path = '/controller/nuage/'
+default_num_workers = 4
+runtimes = ('threaded', 'gevent')
+stats_interval = 300
+default_state_interval = 60
 
 client = None
+worker_pool = None
+vsd_sessions = None
+vsd_cache = None
+vpn_mirror = None
+resync_engine = None
+vsd_calls = None
+progress = None
+status_writer = None
+membership = None
+leader_lock = None
+retry_scheduler = None
+reconciler = None
+warm_pool = None
+cache_warmup = None
+state_file = None
 prev_mod_index = 0
 vm_status = {}
 
-valid_host_ids = ('cbserver5', 'node-23.opnfvericsson.ca')
+# managed hosts until they are loaded from the hosts file or the etcd hosts directory
+default_host_ids = ('cbserver5', 'node-23.opnfvericsson.ca')
+valid_host_ids = HostRegistry(default_host_ids)
 
 proton_etcd_dir = '/net-l3vpn/proton'
 
+# etcd keeps the last 1000 events, resync before the watch falls out of that window
+resync_lag = 900
+
+# seconds a watch of the standby lasts, its followers stop within that delay once it takes over
+standby_watch_timeout = 5
+
+# stop watching above this number of waiting events, resume below half of it. Only the watch is paused: the resyncs,
+# host rescans, rebalances, requeues and retries queue at most one event per known port, merged with the waiting one
+default_queue_high_water = 10000
+queue_high_water = default_queue_high_water
+dropped_events = 0
+throttled = 0
+bind_errors = 0
+
+# etcd index of the last watch response and highest modifiedIndex processed by the workers
+watch_etcd_index = 0
+processed_index = 0
+processed_lock = threading.Lock()
+
+# serializes the dispatch of the events with the retries fired, a retry is never queued behind a newer event
+retry_lock = threading.Lock()
+
+metrics = MetricsRegistry()
+events_total = metrics.counter('nuage_shim_events_total', 'etcd events received by the watch', ('table', 'action'))
+binding_seconds = metrics.histogram('nuage_shim_binding_duration_seconds', 'duration of the port binds and unbinds',
+                                    ('operation',))
+etcd_write_seconds = metrics.histogram('nuage_shim_etcd_write_duration_seconds', 'duration of the etcd status writes',
+                                       ('path',))
+
 
 def notify_proton_vif(proton, uuid, vif_type):
     path = proton + '/controller/host/' + uuid
@@ -65,37 +133,73 @@ def notify_proton_vif(proton, uuid, vif_type):
 def notify_proton_status(proton, uuid, status):
     path = proton + '/controller/port/' + uuid
     data = {"status": status}
-    client.write(path, json.dumps(data))
 
+    with etcd_write_seconds.time(path='port_status'):
+        client.write(path, json.dumps(data))
 
-def save_bind_status(uuid, status):
-    """ save the vm status both in etcd and in-memory dictionary
-    """
+
+def write_bind_status(uuid, status):
+    """write the vm status in etcd, removing it once unbound"""
 
     path = etcd_nuage_path + uuid
     data = {"status": status}
 
-    try:
+    with etcd_write_seconds.time(path='bind_status'):
         if status == 'unbound':
-            client.delete(path)
-            del vm_status[uuid]
+            try:
+                client.delete(path)
+
+            except etcd.EtcdKeyNotFound:
+                pass
 
         else:
             client.write(path, json.dumps(data))
-            vm_status[uuid] = status
+
+
+def set_bind_status(uuid, status):
+    """set the vm status in the in-memory dictionary"""
+    if status == 'unbound':
+        vm_status.pop(uuid, None)
+
+    else:
+        vm_status[uuid] = status
+
+
+def save_bind_status(uuid, status):
+    """ save the vm status both in etcd and in-memory dictionary
+    """
+
+    try:
+        write_bind_status(uuid, status)
+        set_bind_status(uuid, status)
 
     except Exception, e:
         logging.error("saving bind status failed %s" % str(e))
 
 
+def write_port_status(proton, uuid, status):
+    """write both etcd statuses of a port, called by the status writer"""
+    notify_proton_status(proton, uuid, status)
+    write_bind_status(uuid, status)
+
+
 def update_bind_status(proton, uuid, status):
     """wrapper function to call status update of the bind operation"""
-    notify_proton_status(proton, uuid, status)
-    save_bind_status(uuid,status)
+    if status_writer is None:
+        notify_proton_status(proton, uuid, status)
+        save_bind_status(uuid,status)
+        return
+
+    # the next events of the port depend on the in-memory status, only the etcd writes are deferred
+    set_bind_status(uuid, status)
+    status_writer.put(proton, uuid, status)
 
 
 def restore_bind_status():
-    """restore the bind status from etcd to in-memory dict, typically called during program startup"""
+    """restore the bind status from etcd to in-memory dict, typically called during program startup
+
+    return the etcd index following the read, None when it failed
+    """
 
     global vm_status
 
@@ -109,17 +213,179 @@ def restore_bind_status():
                 vm_status[ntpath.basename(status.key)] = val["status"]
         logging.info("vm_status = %s", vm_status)
 
+        return statuses.etcd_index + 1
+
+    except etcd.EtcdKeyNotFound, e:
+        logging.error("reading keys failed %s" % str(e))
+        return (e.payload or {}).get('index', -1) + 1
+
     except Exception, e:
         logging.error("reading keys failed %s" % str(e))
         return
 
 
-def initialize_worker_thread(messages_queue):
-    worker = Thread(target=process_queue, args=(messages_queue,))
-    worker.setDaemon(True)
-    worker.start()
+def initialize_runtime(runtime):
+    """check that the modules were patched for the gevent runtime when it is selected
+
+    gevent patches the socket and threading modules, so the etcd watch, the worker pool and the VSD
+    requests all run as greenlets in a single event loop. The patching is done by the nuage.server
+    entry point, before this module creates its locks and imports etcd.
+    """
+    if runtime != 'gevent':
+        return
+
+    try:
+        from gevent import monkey
+
+    except ImportError:
+        logging.critical("the gevent runtime requires the gevent package")
+        exit(1)
+
+    if not monkey.is_module_patched('socket'):
+        logging.critical("the gevent runtime is set up by nuage-shim-server, before the shim is imported")
+        exit(1)
+
+    logging.info("running with the gevent runtime")
+
+
+def initialize_worker_pool(num_workers):
+    """start the pool of workers processing etcd messages"""
+    pool = ShardedWorkerPool(num_workers, handle_message, merge=coalesce_events)
+    return pool.start()
+
+
+def get_watch_lag():
+    """return the number of etcd events between the last watch response and the last processed event"""
+    return max(0, watch_etcd_index - processed_index)
+
+
+def initialize_metrics(port):
+    """register the metrics of the running components and serve them on port, if one is given"""
+    metrics.gauge('nuage_shim_queue_depth', 'events waiting for a worker', callback=worker_pool.depth)
+    metrics.gauge('nuage_shim_queue_oldest_age_seconds', 'age of the oldest waiting event',
+                  callback=worker_pool.oldest_age)
+    metrics.counter('nuage_shim_queue_merged_total', 'events merged into a waiting event of the same port',
+                    callback=lambda: sum(stats['merged'] for stats in worker_pool.get_stats()))
+    metrics.counter('nuage_shim_worker_errors_total', 'events that failed in a worker',
+                    callback=lambda: sum(stats['errors'] for stats in worker_pool.get_stats()))
+    metrics.counter('nuage_shim_dropped_events_total', 'events dropped while the watch was throttled',
+                    callback=lambda: dropped_events)
+    metrics.counter('nuage_shim_throttles_total', 'times the watch was paused', callback=lambda: throttled)
+    metrics.counter('nuage_shim_resyncs_total', 'snapshot resyncs', callback=lambda: resync_engine.resyncs)
+    metrics.gauge('nuage_shim_managed_hosts', 'compute hosts whose ports are bound',
+                  callback=lambda: len(valid_host_ids))
+    metrics.counter('nuage_shim_host_reloads_total', 'reloads of the managed hosts',
+                    callback=lambda: valid_host_ids.reloads)
+    metrics.gauge('nuage_shim_bind_retries_waiting', 'failed binds waiting to be retried',
+                  callback=retry_scheduler.depth)
+    metrics.counter('nuage_shim_bind_retries_total', 'retries of failed binds', callback=lambda: retry_scheduler.fired)
+    metrics.counter('nuage_shim_bind_errors_total', 'binds given up after all their retries',
+                    callback=lambda: bind_errors)
+
+    if reconciler is not None:
+        metrics.gauge('nuage_shim_drift_ports', 'ports drifted from VSD at the last reconciliation', ('kind',),
+                      callback=lambda: dict(((kind,), count) for kind, count in reconciler.drift.items()))
+        metrics.counter('nuage_shim_reconciliations_total', 'reconciliations with VSD',
+                        callback=lambda: reconciler.passes)
+        metrics.counter('nuage_shim_reconciled_ports_total', 'drifted ports queued by the reconciliations',
+                        callback=lambda: reconciler.requeued)
+        metrics.gauge('nuage_shim_reconciliation_duration_seconds', 'duration of the last reconciliation',
+                      callback=lambda: reconciler.duration)
+
+    if cache_warmup is not None:
+        metrics.gauge('nuage_shim_cache_warmup_seconds', 'duration of the VSD cache warm-up at startup',
+                      callback=lambda: cache_warmup.duration)
+        metrics.gauge('nuage_shim_cache_warmup_objects', 'VSD objects cached by the warm-up at startup',
+                      callback=lambda: cache_warmup.loaded)
+
+    if warm_pool is not None:
+        metrics.gauge('nuage_shim_warm_pool_vports', 'vports provisioned ahead of their bind',
+                      callback=warm_pool.depth)
+        metrics.gauge('nuage_shim_warm_pool_expected', 'ports waiting for their vport to be provisioned',
+                      callback=warm_pool.expected)
+        metrics.counter('nuage_shim_warm_pool_provisioned_total', 'vports provisioned by the warm pool',
+                        callback=lambda: warm_pool.provisioned)
+        metrics.counter('nuage_shim_warm_pool_released_total', 'vports of the warm pool deleted unclaimed',
+                        callback=lambda: warm_pool.released)
+        metrics.counter('nuage_shim_warm_pool_claims_total', 'binds claiming a vport of the warm pool', ('result',),
+                        callback=lambda: {('hit',): warm_pool.hits, ('miss',): warm_pool.misses})
+
+    if membership is not None:
+        metrics.gauge('nuage_shim_members', 'shim instances sharing the ports',
+                      callback=lambda: len(membership.ring.members))
+        metrics.counter('nuage_shim_rebalances_total', 'changes of the shim instances',
+                        callback=lambda: membership.rebalances)
+
+    metrics.gauge('nuage_shim_etcd_clients_in_use', 'etcd clients checked out of the pool', callback=client.in_use)
+    metrics.counter('nuage_shim_etcd_failovers_total', 'failovers to another etcd member',
+                    callback=lambda: client.failovers)
+    metrics.gauge('nuage_shim_watch_etcd_index', 'etcd index of the last watch response',
+                  callback=lambda: watch_etcd_index)
+    metrics.gauge('nuage_shim_processed_index', 'highest modifiedIndex processed by the workers',
+                  callback=lambda: processed_index)
+    metrics.gauge('nuage_shim_watch_lag', 'etcd index minus the last processed modifiedIndex', callback=get_watch_lag)
+    metrics.counter('nuage_shim_vsd_cache_hits_total', 'VSD object cache hits', ('kind',),
+                    callback=lambda: get_cache_stats('hits'))
+    metrics.counter('nuage_shim_vsd_cache_misses_total', 'VSD object cache misses', ('kind',),
+                    callback=lambda: get_cache_stats('misses'))
+
+    if status_writer is not None:
+        metrics.gauge('nuage_shim_status_queue_depth', 'port statuses waiting to be written',
+                      callback=status_writer.depth)
+        metrics.counter('nuage_shim_status_writes_total', 'port statuses written', callback=lambda: status_writer.written)
+        metrics.counter('nuage_shim_status_superseded_total', 'port statuses replaced by a newer one before being written',
+                        callback=status_writer.superseded)
+        metrics.counter('nuage_shim_status_retries_total', 'retried port status writes',
+                        callback=lambda: status_writer.retries)
+        metrics.counter('nuage_shim_status_failures_total', 'port statuses given up after all retries',
+                        callback=lambda: status_writer.failures)
+
+    # per step timings and VSD requests of the activations
+    instrumentation.add_sink(MetricsSink(metrics))
+
+    if port:
+        start_http_server(metrics, port)
+
+
+def get_cache_stats(name):
+    return dict(((kind,), stats[name]) for kind, stats in vsd_cache.get_stats().items())
+
+
+def log_stats():
+    worker_pool.log_stats()
+    logging.info("queue: depth=%d oldest=%.1fs throttled=%d dropped=%d resyncs=%d" % (
+        worker_pool.depth(), worker_pool.oldest_age(), throttled, dropped_events, resync_engine.resyncs))
+
+    if status_writer is not None:
+        logging.info("status writer: depth=%d written=%d superseded=%d retries=%d failures=%d" % (
+            status_writer.depth(), status_writer.written, status_writer.superseded(), status_writer.retries,
+            status_writer.failures))
+
+    logging.info("bind retries: waiting=%d fired=%d cancelled=%d errors=%d" % (
+        retry_scheduler.depth(), retry_scheduler.fired, retry_scheduler.cancelled, bind_errors))
+
+    if warm_pool is not None:
+        claims = warm_pool.hits + warm_pool.misses
+        logging.info("warm pool: vports=%d expected=%d provisioned=%d released=%d hit rate=%.2f" % (
+            warm_pool.depth(), warm_pool.expected(), warm_pool.provisioned, warm_pool.released,
+            float(warm_pool.hits) / claims if claims else 0))
+
+    for kind, stats in sorted(vsd_cache.get_stats().items()):
+        logging.info("vsd cache %s: size=%d hits=%d misses=%d" % (kind, stats['size'], stats['hits'], stats['misses']))
+
+
+def report_stats():
+    while True:
+        time.sleep(stats_interval)
+        log_stats()
+
+
+def initialize_stats_thread():
+    reporter = threading.Thread(target=report_stats)
+    reporter.setDaemon(True)
+    reporter.start()
 
-    return worker
+    return reporter
 
 
 def compute_network_addr(ip, prefix):
@@ -158,7 +424,8 @@ def compute_netmask(prefix):
     return  ret
 
 
-def bind_vm(data, vpn_info):
+def get_bind_config(data, vpn_info):
+    """return the NUSplitActivation config binding the port data in its VPN"""
 
     subnet_name =  'Subnet' + str(time.clock())
     subnet_name = string.replace(subnet_name, '.', '-')
@@ -188,8 +455,31 @@ def bind_vm(data, vpn_info):
         'domain_template_name': 'GluonDomainTemplate'
     }
 
-    sa = NUSplitActivation(config)
-    return sa.activate()
+    return config
+
+
+def get_vport_location(config):
+    """return what identifies the subnet of the vport of a bind config"""
+    return config['route_distinguisher'], config['route_target'], config['network_address'], config['netmask']
+
+
+def bind_vm(data, vpn_info):
+    config = get_bind_config(data, vpn_info)
+    vport = None
+
+    if warm_pool is not None:
+        vport = warm_pool.claim(config['vport_name'], get_vport_location(config))
+
+    try:
+        with binding_seconds.time(operation='bind'), vsd_calls, \
+                vsd_sessions.session(vsd_api_url, config['enterprise'], config['username'],
+                                     config['password']) as session:
+            sa = NUSplitActivation(config, session, vsd_cache)
+            return sa.activate(vport)
+
+    except Exception, e:
+        logging.error("creating VSD session failed with error %s" % str(e))
+        return False
 
 
 def unbind_vm(data, vpn_info):
@@ -205,8 +495,105 @@ def unbind_vm(data, vpn_info):
         'vport_name': data.get('id', '')
     }
 
-    sa = NUSplitActivation(config)
-    return sa.deactivate()
+    try:
+        with binding_seconds.time(operation='unbind'), vsd_calls, \
+                vsd_sessions.session(vsd_api_url, config['enterprise'], config['username'],
+                                     config['password']) as session:
+            sa = NUSplitActivation(config, session)
+            return sa.deactivate()
+
+    except Exception, e:
+        logging.error("creating VSD session failed with error %s" % str(e))
+        return False
+
+
+def provision_vports(items):
+    """create the vports of a batch of (uuid, port data) for the warm pool, return a dict of uuid to (location, vport)"""
+    configs = []
+
+    for uuid, data in items:
+        vpn_info = lookup_vpn_info(uuid)
+
+        if vpn_info:
+            configs.append(get_bind_config(data, vpn_info))
+
+    if not configs:
+        return {}
+
+    with vsd_calls, vsd_sessions.session(vsd_api_url, 'csp', 'csproot', 'csproot') as session:
+        vports = NUSplitActivation(configs[0], session, vsd_cache).provision_many(configs)
+
+    return dict((config['vport_name'], (get_vport_location(config), vports[config['vport_name']]))
+                for config in configs if config['vport_name'] in vports)
+
+
+def release_vports(vports):
+    """delete vports of the warm pool never claimed"""
+    with vsd_calls, vsd_sessions.session(vsd_api_url, 'csp', 'csproot', 'csproot') as session:
+        return NUSplitActivation({}, session).release_vports(vports)
+
+
+def expect_port(event):
+    """provision ahead the vport of a port waiting for its bind"""
+    if event.table != port_table:
+        return
+
+    if event.action in ('set', 'update'):
+        host_id = get_host_id(event.value)
+
+        # a port unbound from its host is usually about to be deleted
+        if event.value is not None and not host_id and not get_host_id(event.prev_value):
+            warm_pool.expect(event.uuid, event.value)
+
+        elif host_id and host_id not in valid_host_ids:
+            # bound by another controller, the vport is never claimed
+            warm_pool.forget(event.uuid)
+
+    else:
+        warm_pool.forget(event.uuid)
+
+
+def expect_vpn_port(message):
+    """expect again a port waiting for its bind once its VPN is known, the pool skips the ports without one"""
+    event = decode_event(message, ('VPNPort',))
+
+    if event is None or event.action not in ('set', 'update') or not owned(event.uuid):
+        return
+
+    port = resync_engine.get_port(event.uuid)
+    value = decode_value(port[2]) if port is not None else None
+
+    if value is not None and not get_host_id(value):
+        warm_pool.expect(event.uuid, value)
+
+
+def warm_up_cache(concurrency):
+    """fill the VSD object cache before the first binds"""
+    global cache_warmup
+
+    cache_warmup = CacheWarmup(vsd_cache, lambda: vsd_sessions.session(vsd_api_url, 'csp', 'csproot', 'csproot'),
+                               concurrency)
+
+    try:
+        cache_warmup.run('Gluon')
+
+    except Exception, e:
+        logging.error("warming up the VSD cache failed, the binds will fill it: %s" % str(e))
+
+
+def initialize_warm_pool(size, batch_size):
+    """start provisioning the vports of the known ports waiting for a bind"""
+    global warm_pool
+
+    warm_pool = WarmPool(provision_vports, release_vports, size, batch_size)
+
+    for uuid, (key, modified_index, value) in resync_engine.get_ports().items():
+        port = decode_value(value)
+
+        if port is not None and not get_host_id(port) and owned(uuid):
+            warm_pool.expect(uuid, port)
+
+    return warm_pool.start()
 
 
 def get_vpn_info(client, uuid):
@@ -244,50 +631,85 @@ def get_vpn_info(client, uuid):
     return vpn_info
 
 
-def process_base_port_model(message, uuid, proton_name):
+def lookup_vpn_info(uuid):
+    """resolve the VPN of a port from the VPN table mirror, reading etcd only on a miss"""
+
+    if vpn_mirror is not None and vpn_mirror.ready:
+        vpn_info = vpn_mirror.get_vpn_info(uuid)
+
+        if vpn_info:
+            return vpn_info
+
+        logging.info("VPN of port %s is not in the mirror, reading it from etcd" % uuid)
+
+    return get_vpn_info(client, uuid)
+
+
+def process_base_port_model(event):
     global client
     global valid_host_ids
 
-    action = message.action
+    action = event.action
+    uuid = event.uuid
+    proton_name = event.proton_name
 
     if action == 'set' or action == 'update':
-        message_value = json.loads(message.value)
+        message_value = event.value
+
+        if message_value is None:
+            logging.error("port %s has no valid value, ignoring" % uuid)
+            return
 
-        if message_value['host_id'] is None or message_value['host_id'] == '':
+        if message_value.get('host_id') is None or message_value['host_id'] == '':
             logging.info("host id is empty")
 
-            if vm_status.get(uuid, '') == 'up' or vm_status.get(uuid, '') == 'pending':
+            if vm_status.get(uuid, '') in ('up', 'pending', 'error'):
                 logging.info("Port is bound,  need to unbind")
-                if not hasattr(message, '_prev_node'):
-                    logging.info("_prev_node is not available")
-                    return
-                vpn_info = get_vpn_info(client, uuid)
-                unbind_vm(json.loads(message._prev_node.value), vpn_info)
+                if event.prev_value is None:
+                    logging.info("previous value is not available")
+                    # nothing is left in VSD to unbind once the bind gave up, only its status
+                    if vm_status.get(uuid, '') != 'error':
+                        return
+                else:
+                    vpn_info = lookup_vpn_info(uuid)
+                    unbind_vm(event.prev_value, vpn_info)
                 update_bind_status(proton_name, uuid, 'unbound')
                 return
 
         if not message_value['host_id'] in valid_host_ids:
             logging.info("host id %s is not recognized", message_value['host_id'])
-            return
 
-        if uuid in vm_status and vm_status[uuid] == 'pending':
+            if vm_status.get(uuid, '') == 'error':
+                # the port is no longer ours to bind, its failed bind is not reported anymore
+                update_bind_status(proton_name, uuid, 'unbound')
             return
 
+        # a port left pending by a failed bind is bound again, its retry still waiting was cancelled on dispatch
         update_bind_status(proton_name, uuid, 'pending')
 
-        vpn_info = get_vpn_info(client, uuid)
+        vpn_info = lookup_vpn_info(uuid)
 
-        if bind_vm(json.loads(message.value), vpn_info):
+        if bind_vm(message_value, vpn_info):
             update_bind_status(proton_name, uuid, 'up')
             return
         else:
             logging.error("failed activating vm")
+            retry_bind(event)
             return
 
+    elif action == 'reconcile':
+        reconcile_port(event)
+
     elif action == 'delete':
-        if vm_status[uuid] == 'up':
-            vpn_info = get_vpn_info(client, uuid)
-            unbind_vm(json.loads(message.value), vpn_info)
+        if vm_status.get(uuid, '') == 'up':
+            vpn_info = lookup_vpn_info(uuid)
+            # the deleted value is in the previous node, etcd delete events have no value
+            unbind_vm(event.prev_value or event.value, vpn_info)
+            update_bind_status(proton_name, uuid, 'unbound')
+            return
+
+        if vm_status.get(uuid, '') in ('pending', 'error'):
+            # the bind of the port failed, its retry was cancelled on dispatch
             update_bind_status(proton_name, uuid, 'unbound')
             return
 
@@ -295,62 +717,688 @@ def process_base_port_model(message, uuid, proton_name):
         logging.error('unknown action %s' % action)
 
 
-def process_queue(messages_queue):
-    logging.info("processing queue")
+def retry_bind(event):
+    """schedule the retry of a failed bind, or give up with the error status once its attempts are spent"""
+    global bind_errors
 
-    while True:
-        item = messages_queue.get()
-        process_message(item)
-        messages_queue.task_done()
+    if retry_scheduler is None:
+        return
+
+    # the event is done as far as the etcd progress goes, its retry is tracked by the scheduler
+    mark_done(event)
+    event.commit_index = None
+
+    if progress is not None and progress.has_pending(event.uuid):
+        logging.info("port %s has a newer event, its bind is not retried" % event.uuid)
+        return
+
+    event.attempt += 1
+
+    delay = retry_scheduler.schedule(event.uuid, event, event.attempt)
+
+    if delay is None:
+        logging.error("giving up binding port %s after %d attempts" % (event.uuid, event.attempt))
+        bind_errors += 1
+        update_bind_status(event.proton_name, event.uuid, 'error')
+        return
+
+    logging.info("retrying the bind of port %s in %.1fs, retry %d" % (event.uuid, delay, event.attempt))
 
 
-def process_message(message):
+def fire_retry(event):
+    """queue a retry that is due on the worker of its port, unless a newer event of the port is in flight"""
+    with retry_lock:
+        if progress is not None and progress.has_pending(event.uuid):
+            logging.info("port %s has a newer event, dropping the retry of its bind" % event.uuid)
+            return
+
+        worker_pool.put(event.uuid, event)
 
-    logging.info("msg =  %s" % message)
-    #logging.info("msg.key =  %s" % message.key)
-    #logging.info("msg.value =  %s" % message.value)
-    #logging.info("msg.action =  %s" % message.action)
 
+def get_message_table(message):
     path = message.key.split('/')
 
-    if len(path) < 5:
-        logging.error("unknown message %s, ignoring" % message)
+    if len(path) < 4:
+        return None
+
+    return path[3]
+
+
+def get_host_id(value):
+    try:
+        return value.get('host_id')
+
+    except AttributeError:
+        return None
+
+
+def unbinds_port(event):
+    """return True if the event clears the host id of a port that had one"""
+    if get_host_id(event.value):
+        return False
+
+    return bool(get_host_id(event.prev_value))
+
+
+def coalesce_events(waiting, event):
+    """merge event into the event of the same port still waiting in the queue
+
+    Only updates of a ProtonBasePort are merged, the merged event carries the latest value and
+    the previous value of the waiting event. Deletes are never merged, so a delete followed by
+    a re-create is still processed as an unbind followed by a bind, and neither is anything
+    merged into an event clearing the host id of the port, which has to unbind it first.
+    A retry never replaces the event waiting, which is newer. Returns None when the events must be
+    processed one after the other.
+    """
+    if event.attempt:
+        return None
+
+    for queued in (waiting, event):
+        if queued.action not in ('set', 'update') or queued.table != port_table:
+            return None
+
+    if unbinds_port(waiting):
+        return None
+
+    event.prev_value = waiting.prev_value
+
+    # the waiting event will never be processed on its own
+    mark_done(waiting)
+
+    return event
+
+
+def dispatch_message(message, commit_index=None):
+    """decode the message and queue it on the worker owning its port, keeping per-port order
+
+    commit_index is the etcd index covered once the message is processed, its modifiedIndex by default.
+    The messages of the tables that are not monitored and of the ports owned by other instances are dropped here.
+    """
+    commit_index = commit_index or message.modifiedIndex
+    event = decode_event(message)
+
+    if event is None or (membership is not None and not membership.owns(event.uuid)):
+        if progress is not None:
+            progress.advance(commit_index)
+
         return
 
-    proton_name = path[1]
-    table = path[3]
-    uuid = path[4]
+    event.commit_index = commit_index
+
+    if warm_pool is not None:
+        expect_port(event)
+
+    with retry_lock:
+        # a newer event of the port supersedes its retry still waiting
+        if retry_scheduler is not None:
+            retry_scheduler.cancel(event.uuid)
+
+        if progress is not None:
+            progress.add(commit_index, event.uuid)
+
+        worker_pool.put(event.uuid, event)
+
+
+def mark_done(event):
+    if progress is None or event.commit_index is None:
+        return
+
+    if status_writer is None:
+        progress.done(event.commit_index, event.uuid)
+        return
+
+    # the event of the port is done, its index is only committed once the statuses it queued are written
+    index = event.commit_index
+    progress.add(index)
+    progress.done(index, event.uuid)
+    status_writer.when_written(event.uuid, lambda: progress.done(index))
+
 
-    if table == 'ProtonBasePort':
-        process_base_port_model(message, uuid, proton_name)
+def record_processed(index):
+    global processed_index
+
+    with processed_lock:
+        if index > processed_index:
+            processed_index = index
+
+
+def handle_message(event):
+    """worker entry point, process the event and record its index as processed"""
+    try:
+        process_message(event)
+
+    finally:
+        if event.modified_index:
+            record_processed(event.modified_index)
+
+        mark_done(event)
+
+
+def process_message(event):
+
+    logging.info("event = %s" % event)
+
+    if event.table == port_table:
+        process_base_port_model(event)
 
     else:
-        logging.info('table %s is not monitored' % table)
+        logging.info('table %s is not monitored' % event.table)
         return
 
 
+def throttle():
+    """pause the watch until the workers caught up, then resync instead of replaying the backlog
+
+    Called by the watch loop only, the events queued by the resync itself are not bounded by queue_high_water.
+    """
+    global throttled
+
+    throttled += 1
+    start = time.time()
+    logging.warning("%d events waiting, pausing the watch" % worker_pool.depth())
+
+    while worker_pool.depth() > queue_high_water / 2:
+        time.sleep(1)
+
+    logging.info("queue drained after %.1fs, resuming the watch" % (time.time() - start))
+
+    return resync()
+
+
+def load_proton_tables():
+    """cold load the Proton ports and VPN tables, return the etcd index to start watching from"""
+
+    while True:
+        try:
+            return resync_engine.load(client) + 1
+
+        except etcd.EtcdKeyNotFound, e:
+            logging.info("%s does not exist yet, VPN info will be read from etcd" % proton_etcd_dir)
+            return (e.payload or {}).get('index', -1) + 1
+
+        except etcd.EtcdException:
+            logging.error("Cannot load Proton tables from etcd, make sure that etcd is running. Trying in 5 seconds")
+            time.sleep(5)
+
+
+def resync():
+    """catch up with a snapshot of the Proton tables, return the etcd index to resume watching from"""
+
+    while True:
+        try:
+            etcd_index, events = resync_engine.resync(client)
+            break
+
+        except etcd.EtcdKeyNotFound, e:
+            return (e.payload or {}).get('index', -1) + 1
+
+        except etcd.EtcdException:
+            logging.error("Cannot resync with etcd, make sure that etcd is running. Trying in 5 seconds")
+            time.sleep(5)
+
+    for event in events:
+        dispatch_message(event, etcd_index)
+
+    if progress is not None:
+        progress.advance(etcd_index)
+
+    set_watch_index(etcd_index)
+
+    if not events:
+        # nothing left to process up to the snapshot
+        record_processed(etcd_index)
+
+    return etcd_index + 1
+
+
+def rescan_hosts(added, removed):
+    """dispatch the known ports of the added hosts, their events were ignored until now"""
+    if removed:
+        logging.info("ports of the removed hosts %s are not bound any more, bound ones are left as is" % (
+            ', '.join(sorted(removed))))
+
+    if not added:
+        return
+
+    rescanned = 0
+
+    for uuid, (key, modified_index, value) in resync_engine.get_ports().items():
+        if uuid in vm_status or get_host_id(decode_value(value)) not in added:
+            continue
+
+        event = etcd.EtcdResult('update', node={'key': key, 'value': value, 'modifiedIndex': modified_index})
+        dispatch_message(event, watch_etcd_index)
+        rescanned += 1
+
+    logging.info("rescanning %d ports of the added hosts %s" % (rescanned, ', '.join(sorted(added))))
+
+
+def read_bind_status(uuid):
+    """return the bind status of a port saved in etcd, None when it is not bound"""
+    try:
+        return json.loads(client.get(etcd_nuage_path + uuid).value).get('status')
+
+    except etcd.EtcdKeyNotFound:
+        return None
+
+
+def rebalance_ports(old_ring, new_ring):
+    """take over the ports moved to this instance and forget the ones moved away"""
+    instance_id = membership.instance_id
+    gained = 0
+    lost = 0
+
+    for uuid, (key, modified_index, value) in resync_engine.get_ports().items():
+        owned = new_ring.owner(uuid) == instance_id
+
+        if owned == (old_ring.owner(uuid) == instance_id):
+            continue
+
+        if not owned:
+            vm_status.pop(uuid, None)
+
+            if warm_pool is not None:
+                # the events of the port are dropped from now on, the vport would never be claimed
+                warm_pool.forget(uuid)
+
+            lost += 1
+            continue
+
+        gained += 1
+
+        try:
+            # the previous owner saved the bind status of the port
+            status = read_bind_status(uuid)
+
+        except etcd.EtcdException, e:
+            logging.error("reading the bind status of port %s failed: %s" % (uuid, str(e)))
+            status = None
+
+        if status == 'up':
+            vm_status[uuid] = status
+            continue
+
+        # not bound, or the previous owner left in the middle of the bind
+        vm_status.pop(uuid, None)
+        event = etcd.EtcdResult('update', node={'key': key, 'value': value, 'modifiedIndex': modified_index})
+        dispatch_message(event, watch_etcd_index)
+
+    logging.info("members changed, %d ports moved to this instance and %d moved away" % (gained, lost))
+
+
+def initialize_membership(instance_id, members_key, ttl):
+    """register this instance and start following the other members"""
+    global membership
+
+    membership = Membership(client, instance_id, members_key, ttl, on_change=rebalance_ports)
+
+    while True:
+        try:
+            membership.join()
+            break
+
+        except etcd.EtcdException:
+            logging.error("Cannot join %s, make sure that etcd is running. Trying in 5 seconds" % members_key)
+            time.sleep(5)
+
+    return membership.start()
+
+
+def owned(uuid):
+    return membership is None or membership.owns(uuid)
+
+
+def read_port_intent():
+    """return the ports to bind with their VM, the ports having a host and the ports bound, for the reconciler"""
+    intent = {}
+    assigned = set()
+
+    for uuid, (key, modified_index, value) in resync_engine.get_ports().items():
+        port = decode_value(value)
+        host_id = get_host_id(port)
+
+        if not host_id or not owned(uuid):
+            continue
+
+        assigned.add(uuid)
+
+        if host_id in valid_host_ids:
+            intent[uuid] = port.get('device_id')
+
+    records = set(uuid for uuid, status in vm_status.items() if status == 'up' and owned(uuid))
+
+    return intent, assigned, records
+
+
+def read_vsd_state():
+    """return the vports of the Gluon enterprise in VSD owned by this instance and the VMs attached to them"""
+    with vsd_calls, vsd_sessions.session(vsd_api_url, 'csp', 'csproot', 'csproot') as session:
+        vports, attached = read_vsd_ports(session, 'Gluon')
+
+    if membership is not None:
+        vports = set(name for name in vports if owned(name))
+
+    if warm_pool is not None:
+        # provisioned ahead for ports not bound yet
+        vports -= warm_pool.get_keys()
+
+    return vports, attached
+
+
+def get_busy_ports():
+    """return the ports with events or retries in flight"""
+    busy = progress.get_pending_keys() | retry_scheduler.get_keys()
+    busy.update(uuid for uuid, status in vm_status.items() if status == 'pending')
+
+    return busy
+
+
+def requeue_port(uuid, vm_uuid):
+    """queue the reconciliation of a drifted port on its worker"""
+    # the port may be gone from Proton, the VM attached to its vport in VSD is enough to unbind it
+    prev_value = {'id': uuid, 'device_id': vm_uuid} if vm_uuid else None
+    worker_pool.put(uuid, PortEvent(port_table, proton_etcd_dir.split('/')[1], uuid, 'reconcile', 0, None,
+                                    prev_value))
+
+
+def reconcile_port(event):
+    """bind or unbind a port found drifted from VSD, following its current Proton value"""
+    uuid = event.uuid
+
+    if vm_status.get(uuid) == 'pending':
+        # the port is being bound since the reconciler looked at it
+        return
+
+    port = resync_engine.get_port(uuid)
+    value = decode_value(port[2]) if port is not None else None
+    host_id = get_host_id(value)
+
+    if host_id in valid_host_ids:
+        # activating only creates what is missing in VSD
+        event.action = 'update'
+        event.value = value
+        event.prev_value = None
+        process_base_port_model(event)
+        return
+
+    if host_id:
+        # moved to a host not managed by the shim, left as is like on a host removal, only the record of its
+        # vport gone from VSD is cleared, the next passes would find it stale again
+        if uuid in vm_status:
+            update_bind_status(event.proton_name, uuid, 'unbound')
+
+        return
+
+    if event.prev_value is not None:
+        # the VPN of a deleted port may be gone, the unbind does not need it
+        unbind_vm(event.prev_value, lookup_vpn_info(uuid) or {'name': None})
+
+    if uuid in vm_status:
+        update_bind_status(event.proton_name, uuid, 'unbound')
+
+
+def follow_proton_tables(wait_index, stop):
+    """on the standby, keep the VPN mirror and the known ports up to date until stop is set"""
+    while not stop.is_set():
+        try:
+            message = client.watch(proton_etcd_dir, recursive=True, waitIndex=wait_index,
+                                   timeout=standby_watch_timeout)
+            vpn_mirror.apply(message)
+            resync_engine.observe(message)
+            wait_index = message.modifiedIndex + 1
+
+        except etcd.EtcdWatchTimedOut:
+            pass
+
+        except etcd.EtcdEventIndexCleared:
+            wait_index = load_proton_tables()
+
+        except etcd.EtcdException, e:
+            logging.error("following %s failed: %s, retrying in 5 seconds" % (proton_etcd_dir, str(e)))
+            stop.wait(5)
+
+
+def follow_bind_status(stop):
+    """on the standby, keep the bind statuses written by the leader up to date until stop is set"""
+    wait_index = None
+
+    while not stop.is_set():
+        if wait_index is None:
+            # only the standby threads touch the statuses, they can be reloaded in place
+            vm_status.clear()
+            wait_index = restore_bind_status()
+
+            if wait_index is None:
+                stop.wait(5)
+                continue
+
+        try:
+            message = client.watch(etcd_nuage_path, recursive=True, waitIndex=wait_index,
+                                   timeout=standby_watch_timeout)
+            uuid = ntpath.basename(message.key)
+
+            if message.action in ('delete', 'expire', 'compareAndDelete'):
+                vm_status.pop(uuid, None)
+
+            else:
+                vm_status[uuid] = json.loads(message.value)['status']
+
+            wait_index = message.modifiedIndex + 1
+
+        except etcd.EtcdWatchTimedOut:
+            pass
+
+        except etcd.EtcdEventIndexCleared:
+            wait_index = None
+
+        except etcd.EtcdException, e:
+            logging.error("following %s failed: %s, retrying in 5 seconds" % (etcd_nuage_path, str(e)))
+            stop.wait(5)
+
+
+def leadership_lost():
+    # another instance is the leader now, stop before both bind the same ports
+    logging.error("leadership lost, exiting")
+    os._exit(1)
+
+
+def wait_for_leadership(leader_key, ttl, wait_index):
+    """stay a warm standby until this instance holds the leader lock
+
+    return the etcd index to resume watching from, the one published by the previous leader if any
+    """
+    global leader_lock
+
+    name = '%s-%d' % (socket.gethostname(), os.getpid())
+    leader_lock = LeaderLock(client, leader_key, name, ttl, get_index=progress.committed, on_lost=leadership_lost)
+    stop = threading.Event()
+    followers = []
+
+    for target, args in ((follow_proton_tables, (wait_index, stop)), (follow_bind_status, (stop,))):
+        follower = threading.Thread(target=target, args=args, name=target.__name__)
+        follower.setDaemon(True)
+        follower.start()
+        followers.append(follower)
+
+    logging.info("%s is standby" % name)
+    leader_lock.acquire()
+    stop.set()
+
+    # the followers must not touch the mirror, the known ports or the statuses once this instance processes events
+    for follower in followers:
+        follower.join()
+
+    leader_lock.start()
+
+    if not leader_lock.leader_index:
+        return wait_index
+
+    # the previous leader may have left binds in the middle, they are processed again
+    for uuid, status in vm_status.items():
+        if status == 'pending':
+            del vm_status[uuid]
+
+    return leader_lock.leader_index + 1
+
+
+def initialize_host_registry(hosts_file, hosts_key):
+    """load the managed hosts and start reloading them live"""
+    if hosts_file:
+        watcher = HostFileWatcher(valid_host_ids, hosts_file, rescan_hosts)
+
+    else:
+        watcher = HostDirWatcher(valid_host_ids, client, hosts_key, rescan_hosts)
+
+    watcher.load()
+    watcher.start()
+
+    return watcher
+
+
+def set_watch_index(etcd_index):
+    global watch_etcd_index
+
+    if etcd_index > watch_etcd_index:
+        watch_etcd_index = etcd_index
+
+
+def restore_local_state(path):
+    """load the state snapshot at path, return the etcd index to resume watching from, or None without snapshot"""
+    state = load_state(path)
+
+    if state is None:
+        return None
+
+    vm_status.update(state['vm_status'])
+    resync_engine.restore(state['ports'])
+    vpn_mirror.restore(state['vpn_tables'], state['etcd_index'])
+
+    logging.info("restored state of %d ports from %s, resuming at etcd index %d" % (
+        len(state['ports']), path, state['etcd_index'] + 1))
+
+    unknown = len([port for port in state['ports'].values() if not port[1]])
+
+    if unknown:
+        # their events may be older than the index resumed from, only a resync finds them
+        logging.info("%d ports were being processed when the snapshot was saved, resyncing" % unknown)
+        return resync()
+
+    return state['etcd_index'] + 1
+
+
+def save_local_state():
+    # the state copied after the committed index is at least as recent as that index
+    etcd_index = progress.committed()
+
+    try:
+        save_state(state_file, etcd_index, dict(vm_status), resync_engine.get_ports(), vpn_mirror.get_tables(),
+                   progress.get_pending_keys() | retry_scheduler.get_keys())
+
+    except Exception, e:
+        logging.error("saving state to %s failed: %s" % (state_file, str(e)))
+
+
+def persist_state(interval):
+    while True:
+        time.sleep(interval)
+        save_local_state()
+
+
+def initialize_state_thread(interval):
+    persister = threading.Thread(target=persist_state, args=(interval,))
+    persister.setDaemon(True)
+    persister.start()
+
+    return persister
+
+
 def getargs():
     parser = argparse.ArgumentParser(description='Start Shim Layer')
 
     parser.add_argument('-d', '--debug', required=False, help='Enable debug output', dest='debug',
                         action='store_true')
-    parser.add_argument('-H', '--host-name', required=False, help='etcd hostname or ip, default to localhost',
+    parser.add_argument('-H', '--host-name', required=False, help='etcd hostname or ip, default to localhost, or a '
+                        'comma separated list of host[:port] of the cluster members to fail over between',
                         dest='etcd_host', type=str)
     parser.add_argument('-p', '--port', required=False, help='etcd port number, default to 2379', dest='etcd_port',
                         type=str)
     parser.add_argument('-v', '--vsd-ip', required=False, help='Nuage vsd ip address, default to 127.0.0.1', dest='vsd_ip',
                         type=str)
+    parser.add_argument('-w', '--workers', required=False, help='number of worker threads, default to %d' % default_num_workers,
+                        dest='workers', type=int, default=default_num_workers)
+    parser.add_argument('--cache-ttl', required=False, help='seconds VSD objects are cached, default to %d' % default_ttl,
+                        dest='cache_ttl', type=int, default=default_ttl)
+    parser.add_argument('--queue-high-water', required=False, help='number of waiting events above which the watch '
+                        'is paused, the resyncs and retries still queue theirs, default to %d' %
+                        default_queue_high_water, dest='queue_high_water', type=int, default=default_queue_high_water)
+    parser.add_argument('--runtime', required=False, help='threaded or gevent, default to threaded',
+                        dest='runtime', choices=runtimes, default='threaded')
+    parser.add_argument('--hosts-file', required=False, help='file listing the managed compute hosts, one per line, '
+                        'reloaded when it changes', dest='hosts_file', type=str)
+    parser.add_argument('--hosts-key', required=False, help='etcd directory with one key per managed compute host, '
+                        'watched for changes, default to %s' % default_hosts_key, dest='hosts_key', type=str,
+                        default=default_hosts_key)
+    parser.add_argument('--instance-id', required=False, help='name of this instance, to share the ports with the '
+                        'other instances registered under --members-key, all ports are handled by default',
+                        dest='instance_id', type=str)
+    parser.add_argument('--members-key', required=False, help='etcd directory of the shim instances, default to %s'
+                        % default_members_key, dest='members_key', type=str, default=default_members_key)
+    parser.add_argument('--member-ttl', required=False, help='seconds the key of an instance lives without being '
+                        'refreshed, default to %d' % default_member_ttl, dest='member_ttl', type=int,
+                        default=default_member_ttl)
+    parser.add_argument('--ha', required=False, help='active/standby mode, only the instance holding the leader '
+                        'lock processes the events', dest='ha', action='store_true')
+    parser.add_argument('--leader-key', required=False, help='etcd key of the leader lock, default to %s'
+                        % default_leader_key, dest='leader_key', type=str, default=default_leader_key)
+    parser.add_argument('--leader-ttl', required=False, help='seconds the leader lock lives without being refreshed, '
+                        'default to %d' % default_leader_ttl, dest='leader_ttl', type=int, default=default_leader_ttl)
+    parser.add_argument('--metrics-port', required=False, help='port serving the metrics in the Prometheus text '
+                        'format, disabled by default', dest='metrics_port', type=int)
+    parser.add_argument('--retry-attempts', required=False, help='retries of a failed bind before the port is set '
+                        'in error, default to %d' % default_max_attempts, dest='retry_attempts', type=int,
+                        default=default_max_attempts)
+    parser.add_argument('--retry-delay', required=False, help='seconds before the first retry of a failed bind, '
+                        'doubled at each retry, default to %d' % default_base_delay, dest='retry_delay', type=float,
+                        default=default_base_delay)
+    parser.add_argument('--retry-max-delay', required=False, help='maximum seconds between two retries of a bind, '
+                        'default to %d' % default_max_delay, dest='retry_max_delay', type=float,
+                        default=default_max_delay)
+    parser.add_argument('--reconcile-interval', required=False, help='seconds between two reconciliations of the '
+                        'ports with VSD, 0 to disable, default to %d' % default_reconcile_interval,
+                        dest='reconcile_interval', type=int, default=default_reconcile_interval)
+    parser.add_argument('--warmup-concurrency', required=False, help='parallel VSD fetches warming up the VSD cache '
+                        'at startup, 0 to disable, default to %d' % default_warmup_concurrency,
+                        dest='warmup_concurrency', type=int, default=default_warmup_concurrency)
+    parser.add_argument('--warm-pool-size', required=False, help='vports of the ports waiting for a bind provisioned '
+                        'ahead, default to 0 (disabled)', dest='warm_pool_size', type=int, default=0)
+    parser.add_argument('--warm-pool-batch', required=False, help='vports provisioned at once by the warm pool, '
+                        'default to %d' % default_warm_pool_batch, dest='warm_pool_batch', type=int,
+                        default=default_warm_pool_batch)
+    parser.add_argument('--status-writers', required=False, help='number of threads writing the port statuses to '
+                        'etcd, 0 to write them from the workers, default to %d' % default_num_writers,
+                        dest='status_writers', type=int, default=default_num_writers)
+    parser.add_argument('--state-file', required=False, help='local snapshot of the bind state, to resume from '
+                        'where the shim stopped instead of reloading everything', dest='state_file', type=str)
+    parser.add_argument('--state-interval', required=False, help='seconds between two state snapshots, default to %d'
+                        % default_state_interval, dest='state_interval', type=int, default=default_state_interval)
+    parser.add_argument('--trace-activations', required=False, help='log the duration of each step and the number '
+                        'of VSD requests of every bind and unbind', dest='trace_activations', action='store_true')
+    parser.add_argument('--vsd-concurrency', required=False, help='maximum number of binds and unbinds talking to '
+                        'VSD at the same time, default to the number of workers', dest='vsd_concurrency', type=int)
 
     args = parser.parse_args()
     return args
 
 
 def main():
-    global client, vsd_api_url
+    global client, vsd_api_url, worker_pool, vsd_sessions, vsd_cache, vpn_mirror, vsd_calls, resync_engine
+    global queue_high_water, dropped_events, progress, state_file, status_writer, retry_scheduler, reconciler
     logging.basicConfig(level=logging.DEBUG)
     logging.info('Starting server in PID %s' % os.getpid())
+    started = time.time()
 
     args = getargs()
+    initialize_runtime(args.runtime)
 
     if args.etcd_host:
         etcd_host = args.etcd_host
@@ -358,7 +1406,7 @@ def main():
     else:
         etcd_host = 'localhost'
 
-    if args.etcd_host:
+    if args.etcd_port:
         etcd_port = int(args.etcd_port)
 
     else:
@@ -367,12 +1415,62 @@ def main():
     if args.vsd_ip:
         vsd_api_url = 'https://' + args.vsd_ip + ':8443'
 
-    messages_queue = Queue()
-    initialize_worker_thread(messages_queue)
-    client = etcd.Client(host=etcd_host, port=etcd_port, read_timeout=3600)
-    restore_bind_status()
+    queue_high_water = args.queue_high_water
+    vsd_calls = threading.BoundedSemaphore(args.vsd_concurrency or args.workers)
+    vsd_sessions = VSDSessionManager()
+    vsd_cache = VSDObjectCache(ttl=args.cache_ttl)
+
+    if args.warmup_concurrency:
+        # before the workers start, the binds queued by the resync of a restored snapshot find the cache warm too
+        warm_up_cache(args.warmup_concurrency)
+
+    worker_pool = initialize_worker_pool(args.workers)
+    retry_scheduler = RetryScheduler(fire_retry, args.retry_attempts, args.retry_delay, args.retry_max_delay).start()
+    # the watch has its own client, the pool serves the workers, the status writers and the resyncs
+    client = EtcdClientPool(parse_hosts(etcd_host, etcd_port), args.workers + args.status_writers + 1)
 
-    wait_index = 0
+    if args.status_writers:
+        status_writer = StatusWriter(write_port_status, args.status_writers).start()
+
+    vpn_mirror = VPNTableMirror(proton_etcd_dir)
+    resync_engine = ResyncEngine(proton_etcd_dir, vpn_mirror)
+    initialize_host_registry(args.hosts_file, args.hosts_key)
+
+    if args.instance_id:
+        initialize_membership(args.instance_id, args.members_key, args.member_ttl)
+    progress = ProgressTracker()
+    state_file = args.state_file
+    wait_index = restore_local_state(state_file) if state_file else None
+
+    if not wait_index:
+        restore_bind_status()
+        wait_index = load_proton_tables()
+
+    if args.ha:
+        wait_index = wait_for_leadership(args.leader_key, args.leader_ttl, wait_index)
+
+    progress.advance(wait_index - 1)
+    set_watch_index(wait_index - 1)
+    record_processed(wait_index - 1)
+
+    if args.warm_pool_size:
+        initialize_warm_pool(args.warm_pool_size, args.warm_pool_batch)
+
+    if args.reconcile_interval:
+        reconciler = Reconciler(read_port_intent, read_vsd_state, get_busy_ports, requeue_port,
+                                args.reconcile_interval).start()
+
+    initialize_metrics(args.metrics_port)
+
+    if args.trace_activations:
+        instrumentation.add_sink(LogSink())
+
+    initialize_stats_thread()
+
+    if state_file:
+        initialize_state_thread(args.state_interval)
+
+    logging.info("ready after %.1fs, processing the events from etcd index %s" % (time.time() - started, wait_index))
 
     while True:
 
@@ -380,29 +1478,60 @@ def main():
             logging.info("watching %s" % proton_etcd_dir)
 
             if wait_index:
-                message = client.read(proton_etcd_dir, recursive=True, wait=True, waitIndex=wait_index)
+                message = client.watch(proton_etcd_dir, recursive=True, waitIndex=wait_index)
 
             else:
-                message = client.read(proton_etcd_dir, recursive=True, wait=True)
+                message = client.watch(proton_etcd_dir, recursive=True)
 
-            messages_queue.put(message)
+            set_watch_index(message.etcd_index)
+            events_total.inc(table=get_message_table(message), action=message.action)
 
-            if (message.modifiedIndex - wait_index) > 1000:
-                wait_index = 0
+            if worker_pool.depth() >= queue_high_water:
+                # the event is not recorded as seen, the resync will pick it up
+                dropped_events += 1
+                wait_index = throttle()
+                continue
 
-            else:
-                wait_index = message.modifiedIndex + 1
+            vpn_mirror.apply(message)
+            resync_engine.observe(message)
+            dispatch_message(message)
+
+            if warm_pool is not None:
+                expect_vpn_port(message)
+
+            wait_index = message.modifiedIndex + 1
+
+            if message.etcd_index - message.modifiedIndex > resync_lag:
+                logging.warning("watch is %d events behind, resyncing" % (message.etcd_index - message.modifiedIndex))
+                wait_index = resync()
 
         except etcd.EtcdWatchTimedOut:
             logging.info("timeout")
             pass
 
+        except etcd.EtcdEventIndexCleared:
+            logging.warning("events from index %s are no longer in the etcd history, resyncing" % wait_index)
+            wait_index = resync()
+
         except etcd.EtcdException:
             logging.error("Cannot connect to etcd, make sure that etcd is running. Trying in 5 seconds")
             time.sleep(5)
 
         except KeyboardInterrupt:
             logging.info("exiting on interrupt")
+
+            if status_writer is not None and not status_writer.flush(10):
+                logging.error("exiting with %d port statuses not written" % status_writer.depth())
+
+            if membership is not None:
+                membership.leave()
+
+            if leader_lock is not None:
+                leader_lock.release()
+
+            if state_file:
+                save_local_state()
+
             exit(1)
 
         except:
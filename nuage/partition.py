@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Partitioning of the ports between several shim instances.
+
+Each instance registers itself with a key under the members directory, e.g.
+/controller/nuage-shims/<instance id>, written with a TTL and refreshed while the
+instance runs, so the key of an instance that dies expires. All instances watch
+the directory and place the members on a consistent hash ring: a port belongs
+to the member following the hash of its uuid on the ring, and when a member
+joins or leaves only the ports of the ring segments it takes or gives back move.
+"""
+
+import bisect
+import hashlib
+import logging
+import threading
+import time
+
+import etcd
+
+from nuage.etcd_pool import read_dir_keys
+
+logger = logging.getLogger(__name__)
+
+default_members_key = '/controller/nuage-shims'
+
+# seconds the key of a member lives without being refreshed
+default_member_ttl = 15
+
+# points of each member on the ring, more points spread the ports more evenly
+default_vnodes = 64
+
+
+def hash_key(key):
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """consistent hash ring of the members"""
+
+    def __init__(self, members=(), vnodes=default_vnodes):
+        self.members = frozenset(members)
+
+        points = sorted((hash_key('%s-%d' % (member, i)), member) for member in self.members for i in range(vnodes))
+        self._hashes = [point[0] for point in points]
+        self._owners = [point[1] for point in points]
+
+    def owner(self, key):
+        """return the member owning key, None when the ring is empty"""
+        if not self._hashes:
+            return None
+
+        index = bisect.bisect(self._hashes, hash_key(key)) % len(self._hashes)
+
+        return self._owners[index]
+
+
+class Membership(object):
+    """membership of this instance and hash ring of all the instances"""
+
+    def __init__(self, client, instance_id, key=default_members_key, ttl=default_member_ttl, on_change=None,
+                 vnodes=default_vnodes):
+        """
+        :param on_change: function(old_ring, new_ring) called when members join or leave
+        """
+        self.client = client
+        self.instance_id = instance_id
+        self.key = key.rstrip('/')
+        self.member_key = '%s/%s' % (self.key, instance_id)
+        self.ttl = ttl
+        self.on_change = on_change
+        self.vnodes = vnodes
+
+        self.ring = HashRing((), vnodes)
+        self.etcd_index = 0
+        self.rebalances = 0
+
+    def owns(self, uuid):
+        return self.ring.owner(uuid) == self.instance_id
+
+    def join(self):
+        """register this instance and load the members"""
+        self.client.write(self.member_key, self.instance_id, ttl=self.ttl)
+        logger.info("joined %s as %s" % (self.key, self.instance_id))
+        self.load()
+
+    def leave(self):
+        try:
+            self.client.delete(self.member_key)
+
+        except etcd.EtcdKeyNotFound:
+            pass
+
+        logger.info("left %s" % self.key)
+
+    def load(self):
+        """read the members and rebuild the ring if they changed"""
+        try:
+            members, self.etcd_index = read_dir_keys(self.client, self.key)
+
+        except etcd.EtcdKeyNotFound, e:
+            members = ()
+            self.etcd_index = (e.payload or {}).get('index', self.etcd_index)
+
+        if frozenset(members) == self.ring.members:
+            return
+
+        old_ring = self.ring
+        self.ring = HashRing(members, self.vnodes)
+        self.rebalances += 1
+
+        logger.info("members: %s" % ', '.join(sorted(members)))
+
+        if self.on_change is not None:
+            self.on_change(old_ring, self.ring)
+
+    def start(self):
+        """start refreshing the key of this instance and watching the members"""
+        for target, name in ((self._refresh, 'membership-refresh'), (self._watch, 'membership-watch')):
+            thread = threading.Thread(target=target, name=name)
+            thread.setDaemon(True)
+            thread.start()
+
+        return self
+
+    def _refresh(self):
+        while True:
+            time.sleep(self.ttl / 3.0)
+
+            try:
+                self.client.write(self.member_key, None, ttl=self.ttl, refresh=True, prevExist=True)
+
+            except etcd.EtcdKeyNotFound:
+                logger.warning("key of %s expired, joining again" % self.instance_id)
+
+                try:
+                    self.client.write(self.member_key, self.instance_id, ttl=self.ttl)
+
+                except etcd.EtcdException, e:
+                    logger.error("joining again failed: %s" % str(e))
+
+            except etcd.EtcdException, e:
+                logger.error("refreshing the key of %s failed: %s" % (self.instance_id, str(e)))
+
+    def _watch(self):
+        while True:
+            try:
+                self.client.watch(self.key, recursive=True, waitIndex=self.etcd_index + 1)
+                self.load()
+
+            except etcd.EtcdWatchTimedOut:
+                pass
+
+            except etcd.EtcdEventIndexCleared:
+                self.load()
+
+            except etcd.EtcdException, e:
+                logger.error("watching %s failed: %s, retrying in 5 seconds" % (self.key, str(e)))
+                time.sleep(5)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compact port events passed from the etcd watcher to the workers.
+
+The watcher decodes each etcd event once into a PortEvent: the parts of the key,
+the action, the modified index and the decoded current and previous values. The
+workers and the event coalescing then work on plain dicts, and only the events of
+the monitored tables are queued at all.
+"""
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+port_table = 'ProtonBasePort'
+
+monitored_tables = (port_table,)
+
+
+class PortEvent(object):
+    """decoded etcd event of a Proton table entry"""
+
+    __slots__ = ('table', 'proton_name', 'uuid', 'action', 'modified_index', 'value', 'prev_value',
+                 'commit_index', 'attempt')
+
+    def __init__(self, table, proton_name, uuid, action, modified_index, value, prev_value=None):
+        self.table = table
+        self.proton_name = proton_name
+        self.uuid = uuid
+        self.action = action
+        self.modified_index = modified_index
+        self.value = value
+        self.prev_value = prev_value
+
+        # etcd index covered once the event is processed, set when it is dispatched
+        self.commit_index = None
+
+        # number of failed binds of the event, for its retries
+        self.attempt = 0
+
+    def __repr__(self):
+        return '<PortEvent %s %s/%s/%s index=%s value=%r prev_value=%r>' % (
+            self.action, self.proton_name, self.table, self.uuid, self.modified_index, self.value, self.prev_value)
+
+
+def decode_value(value):
+    """return the decoded JSON value of an etcd node, None when it has none or it is invalid"""
+    if value is None:
+        return None
+
+    try:
+        return json.loads(value)
+
+    except ValueError:
+        logger.error("invalid JSON value %r" % value)
+        return None
+
+
+def decode_event(message, tables=monitored_tables):
+    """return the PortEvent of an etcd event, None when its key is not in one of tables"""
+    path = message.key.split('/')
+
+    if len(path) < 5 or path[3] not in tables:
+        return None
+
+    prev_node = getattr(message, '_prev_node', None)
+    prev_value = decode_value(prev_node.value) if prev_node is not None else None
+
+    return PortEvent(path[3], path[1], path[4], message.action, message.modifiedIndex, decode_value(message.value),
+                     prev_value)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Periodic reconciliation of the Gluon intent with the VSD state.
+
+Events can be lost, binds can half fail and VSD objects can be edited or deleted
+behind the shim. The reconciler compares, at a regular interval, the Proton ports
+and the bind records of the shim with the VM vports and VM interfaces of the Gluon
+enterprise, fetched in pages per domain. The differences are computed with set
+operations and only the drifted ports are queued on the workers again, which
+check the port once more before binding or unbinding it.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+default_interval = 600
+default_page_size = 500
+
+drift_kinds = ('missing_vports', 'missing_vms', 'orphaned', 'detached', 'stale')
+
+
+def fetch_all(fetcher, page_size=default_page_size, filter=None):
+    """return every object of fetcher, requesting page_size objects at a time"""
+    objects = []
+    page = 0
+
+    while True:
+        # commit=False keeps the fetched objects out of the fetcher
+        batch = fetcher.get(filter=filter, page=page, page_size=page_size, commit=False) or []
+        objects.extend(batch)
+
+        if len(batch) < page_size:
+            return objects
+
+        page += 1
+
+
+def read_vsd_ports(session, enterprise_name, page_size=default_page_size):
+    """return the names of the VM vports of the enterprise and a dict of vport name to the uuid of its VM"""
+    vports = set()
+    attached = {}
+
+    enterprise = session.user.enterprises.get_first(filter='name == "%s"' % enterprise_name)
+
+    if enterprise is None:
+        logger.error("enterprise %s not found in VSD" % enterprise_name)
+        return vports, attached
+
+    for domain in fetch_all(enterprise.domains, page_size):
+        vports.update(vport.name for vport in fetch_all(domain.vports, page_size, 'type == "VM"'))
+
+        for interface in fetch_all(domain.vm_interfaces, page_size):
+            attached[interface.vport_name] = interface.vm_uuid
+
+    return vports, attached
+
+
+class Drift(object):
+    """ports whose VSD state differs from the Gluon intent, as sets of port uuids
+
+    missing_vports: ports to bind without a vport
+    missing_vms: ports to bind whose vport exists without their VM
+    orphaned: vports of ports deleted or without a host, with a VM
+    detached: vports of ports deleted or without a host, without a VM, only reported
+    stale: ports recorded as bound with neither a vport nor a reason to be bound
+    """
+
+    def __init__(self, missing_vports, missing_vms, orphaned, detached, stale):
+        self.missing_vports = missing_vports
+        self.missing_vms = missing_vms
+        self.orphaned = orphaned
+        self.detached = detached
+        self.stale = stale
+
+    def get_ports(self):
+        """return the ports to reconcile"""
+        return self.missing_vports | self.missing_vms | self.orphaned | self.stale
+
+    def counts(self):
+        return dict((kind, len(getattr(self, kind))) for kind in drift_kinds)
+
+
+def compute_drift(intent, assigned, records, vports, attached):
+    """compare the Gluon intent with the VSD state
+
+    :param intent: dict of the uuid of the ports to bind to the uuid of their VM
+    :param assigned: uuids of the ports having a host, managed or not
+    :param records: uuids of the ports recorded as bound
+    :param vports: names of the VM vports in VSD, the uuid of their port
+    :param attached: dict of vport name to the uuid of the VM attached to it
+    """
+    wanted = set(intent)
+    missing_vports = wanted - vports
+    missing_vms = set(uuid for uuid, vm_uuid in set(intent.items()) - set(attached.items())) - missing_vports
+    orphans = vports - assigned
+    orphaned = orphans & set(attached)
+
+    return Drift(missing_vports, missing_vms, orphaned, orphans - orphaned, records - wanted - vports)
+
+
+class Reconciler(object):
+    """periodic reconciliation of the ports with VSD"""
+
+    def __init__(self, read_intent, read_vsd, get_busy, requeue, interval=default_interval):
+        """
+        :param read_intent: function returning the intent, assigned and records arguments of compute_drift()
+        :param read_vsd: function returning the vports and attached arguments of compute_drift()
+        :param get_busy: function returning the uuids of the ports being processed, left to the next pass
+        :param requeue: function(uuid, vm_uuid) queuing a drifted port, vm_uuid being the VM attached to its vport
+        """
+        self.read_intent = read_intent
+        self.read_vsd = read_vsd
+        self.get_busy = get_busy
+        self.requeue = requeue
+        self.interval = interval
+
+        self.passes = 0
+        self.requeued = 0
+        self.duration = 0
+        self.drift = dict.fromkeys(drift_kinds, 0)
+
+    def start(self):
+        reconciler = threading.Thread(target=self._run, name='reconciler')
+        reconciler.setDaemon(True)
+        reconciler.start()
+
+        return self
+
+    def reconcile(self):
+        """compare the ports with VSD once and requeue the drifted ones, return the Drift"""
+        start = time.time()
+
+        # the intent is read first, a port created while VSD is read is checked again by its worker
+        intent, assigned, records = self.read_intent()
+        vports, attached = self.read_vsd()
+        drift = compute_drift(intent, assigned, records, vports, attached)
+        requeued = drift.get_ports() - self.get_busy()
+
+        for uuid in requeued:
+            self.requeue(uuid, attached.get(uuid))
+
+        self.passes += 1
+        self.requeued += len(requeued)
+        self.duration = time.time() - start
+        self.drift = drift.counts()
+
+        logger.info("reconciled %d ports with %d vports in %.1fs: %s, %d requeued" % (
+            len(assigned), len(vports), self.duration,
+            ' '.join('%s=%d' % (kind, self.drift[kind]) for kind in drift_kinds), len(requeued)))
+
+        return drift
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                self.reconcile()
+
+            except Exception, e:
+                logger.exception("reconciliation failed: %s" % str(e))
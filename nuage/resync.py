@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Snapshot based resynchronization of the shim with the Proton tables.
+
+etcd only keeps a limited history of events. When the watch falls too far behind,
+the events it missed cannot be replayed any more. The resync engine then takes one
+recursive snapshot of the Proton directory, compares the ProtonBasePort entries
+with the ones the shim already knows, turns the differences into port events and
+lets the watch resume from the etcd index of the snapshot.
+"""
+
+import logging
+import threading
+
+import etcd
+
+logger = logging.getLogger(__name__)
+
+port_table = 'ProtonBasePort'
+
+delete_actions = ('delete', 'expire', 'compareAndDelete')
+
+
+class ResyncEngine(object):
+    """known state of the Proton ports and snapshot diffing"""
+
+    def __init__(self, proton_dir, vpn_mirror):
+        self.proton_dir = proton_dir.rstrip('/')
+        self.vpn_mirror = vpn_mirror
+        self.resyncs = 0
+
+        self._lock = threading.Lock()
+        self._ports = {}
+
+    def load(self, client):
+        """cold load the ports and the VPN tables, return the etcd index of the snapshot"""
+        result = client.read(self.proton_dir, recursive=True)
+
+        with self._lock:
+            self._ports = self._read_ports(result)
+
+        self.vpn_mirror.load_snapshot(result)
+        logger.info("loaded %d ports at etcd index %s" % (len(self._ports), result.etcd_index))
+
+        return result.etcd_index
+
+    def restore(self, ports):
+        """replace the known ports with a copy saved by get_ports()"""
+        with self._lock:
+            self._ports = dict(ports)
+
+        logger.info("restored %d ports" % len(self._ports))
+
+    def observe(self, message):
+        """record the state of a port from a watch event"""
+        table, uuid = self._split_key(message.key)
+
+        if table != port_table:
+            return
+
+        with self._lock:
+            if message.action in delete_actions:
+                self._ports.pop(uuid, None)
+
+            else:
+                self._ports[uuid] = (message.key, message.modifiedIndex, message.value)
+
+    def resync(self, client):
+        """take a snapshot of the Proton tables and return (etcd index, port events) to catch up with it"""
+        result = client.read(self.proton_dir, recursive=True)
+        current = self._read_ports(result)
+        events = []
+
+        with self._lock:
+            for uuid, (key, modified_index, value) in current.items():
+                known = self._ports.get(uuid)
+
+                if known is None:
+                    events.append(self._event('set', key, modified_index, value))
+
+                elif known[1] != modified_index:
+                    events.append(self._event('update', key, modified_index, value, known[2]))
+
+            for uuid, (key, modified_index, value) in self._ports.items():
+                if uuid not in current:
+                    events.append(self._event('delete', key, result.etcd_index, value, value))
+
+            self._ports = current
+
+        self.vpn_mirror.load_snapshot(result)
+        self.resyncs += 1
+
+        logger.info("resync at etcd index %s: %d ports, %d changed" % (result.etcd_index, len(current), len(events)))
+
+        return result.etcd_index, events
+
+    def get_ports(self):
+        """return a copy of the known ports as a dict of uuid to (key, modified index, value)"""
+        with self._lock:
+            return dict(self._ports)
+
+    def get_port(self, uuid):
+        """return the (key, modified index, value) of a known port, None if it is not known"""
+        with self._lock:
+            return self._ports.get(uuid)
+
+    def _read_ports(self, result):
+        ports = {}
+
+        for node in result.leaves:
+            table, uuid = self._split_key(node.key)
+
+            if table == port_table and not node.dir:
+                ports[uuid] = (node.key, node.modifiedIndex, node.value)
+
+        return ports
+
+    def _split_key(self, key):
+        path = key[len(self.proton_dir):].split('/')
+
+        if len(path) < 3:
+            return None, None
+
+        return path[1], path[2]
+
+    def _event(self, action, key, modified_index, value, prev_value=None):
+        """build the etcd event the watch would have delivered"""
+        prev_node = None
+
+        if prev_value is not None:
+            prev_node = {'key': key, 'value': prev_value}
+
+        return etcd.EtcdResult(action, node={'key': key, 'value': value, 'modifiedIndex': modified_index},
+                               prevNode=prev_node)
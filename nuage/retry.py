@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Delayed retries of the failed binds.
+
+A failed bind is scheduled again after an exponential backoff with jitter, on a
+timer heap served by a single thread. When a retry is due, the scheduler hands
+it back to the caller, which queues it on the workers again, so a waiting retry
+never holds a worker. A retry still waiting can be cancelled, e.g. when a newer
+event of the same port arrives.
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+default_max_attempts = 8
+default_base_delay = 1
+default_max_delay = 60
+
+# fraction of the delay randomly taken off, so the retries of many ports failing together are spread
+default_jitter = 0.5
+
+
+class RetryScheduler(object):
+    """timer heap of the retries waiting, at most one per key"""
+
+    def __init__(self, fire, max_attempts=default_max_attempts, base_delay=default_base_delay,
+                 max_delay=default_max_delay, jitter=default_jitter):
+        """
+        :param fire: function(item) called from the scheduler thread when the retry of item is due
+        """
+        self.fire = fire
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+        self.scheduled = 0
+        self.fired = 0
+        self.cancelled = 0
+
+        self._condition = threading.Condition()
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+
+    def start(self):
+        scheduler = threading.Thread(target=self._run, name='retry-scheduler')
+        scheduler.setDaemon(True)
+        scheduler.start()
+
+        return self
+
+    def get_delay(self, attempt):
+        """seconds before the given retry, 1 for the first one"""
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+
+        return delay * (1 - self.jitter * random.random())
+
+    def schedule(self, key, item, attempt):
+        """schedule the retry of item, return its delay or None when the attempt is over the budget"""
+        if attempt > self.max_attempts:
+            return None
+
+        delay = self.get_delay(attempt)
+        entry = [time.time() + delay, next(self._sequence), key, item]
+
+        with self._condition:
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+            self.scheduled += 1
+            self._condition.notify()
+
+        return delay
+
+    def cancel(self, key):
+        """drop the retry of key still waiting, return True if there was one"""
+        with self._condition:
+            if self._entries.pop(key, None) is None:
+                return False
+
+            self.cancelled += 1
+            return True
+
+    def depth(self):
+        with self._condition:
+            return len(self._entries)
+
+    def get_keys(self):
+        """return the keys having a retry waiting"""
+        with self._condition:
+            return set(self._entries)
+
+    def _next_due(self):
+        """wait for the next retry due and return it"""
+        with self._condition:
+            while True:
+                # cancelled or rescheduled entries are only removed from the heap once at its top
+                while self._heap and self._entries.get(self._heap[0][2]) is not self._heap[0]:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                delay = self._heap[0][0] - time.time()
+
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                entry = heapq.heappop(self._heap)
+                del self._entries[entry[2]]
+                self.fired += 1
+
+                return entry[3]
+
+    def _run(self):
+        while True:
+            item = self._next_due()
+
+            try:
+                self.fire(item)
+
+            except Exception, e:
+                logger.exception("firing retry failed: %s" % str(e))
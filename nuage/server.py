@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Entry point of the shim server.
+
+gevent has to patch the socket, ssl and threading modules before anything uses them, while
+importing the shim already loads etcd, urllib3 and ssl and creates its locks. The runtime is
+therefore read from the command line and set up here, before the shim module is imported.
+"""
+
+import sys
+
+
+def get_runtime(argv):
+    """return the --runtime given in argv, None without it"""
+    for i, arg in enumerate(argv):
+        if arg == '--runtime' and i + 1 < len(argv):
+            return argv[i + 1]
+
+        if arg.startswith('--runtime='):
+            return arg.split('=', 1)[1]
+
+    return None
+
+
+def bootstrap(argv):
+    """set up the runtime selected in argv and return the shim module"""
+    if get_runtime(argv) == 'gevent':
+        try:
+            from gevent import monkey
+
+        except ImportError:
+            sys.stderr.write("the gevent runtime requires the gevent package\n")
+            exit(1)
+
+        monkey.patch_all()
+
+    from nuage import nuage_gluon_shim
+
+    return nuage_gluon_shim
+
+
+def main():
+    bootstrap(sys.argv[1:]).main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Asynchronous writer of the port statuses.
+
+A bind makes the port go through pending and up, and each status is written both
+to the Proton port status and to the shim's bind status in etcd. The status writer
+takes these writes off the worker's critical path: statuses are queued per port on
+a small pool of writer threads, so the writes of different ports are in flight at
+the same time. A status still waiting is replaced by a newer one of the same port,
+so only the latest status is written. A failed write is rescheduled with backoff on
+a RetryScheduler timer, the writer thread moves on to the other ports meanwhile.
+The callbacks registered with when_written() run once the statuses queued for
+their port are written or given up, e.g. to commit the etcd index of the event only
+after its statuses.
+"""
+
+import logging
+import threading
+import time
+
+from nuage.retry import RetryScheduler
+from nuage.worker_pool import ShardedWorkerPool
+
+logger = logging.getLogger(__name__)
+
+default_num_writers = 2
+default_max_attempts = 10
+default_retry_delay = 0.5
+default_max_retry_delay = 30
+
+
+class StatusWriter(object):
+    """queue of the latest status of each port, written by a pool of threads"""
+
+    def __init__(self, write, num_writers=default_num_writers, max_attempts=default_max_attempts,
+                 retry_delay=default_retry_delay, max_retry_delay=default_max_retry_delay):
+        """
+        :param write: function(proton, uuid, status) writing a status, raising an exception on failure
+        """
+        self.write = write
+        self.max_attempts = max_attempts
+
+        self.written = 0
+        self.retries = 0
+        self.failures = 0
+
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # statuses of each port queued, being written or waiting for their retry, and the latest one
+        self._outstanding = {}
+        self._latest = {}
+        self._callbacks = {}
+
+        self.pool = ShardedWorkerPool(num_writers, self._write, name='status-writer', merge=self._supersede)
+        self.retry_scheduler = RetryScheduler(self._retry, max_attempts - 1, retry_delay, max_retry_delay)
+
+    def start(self):
+        self.pool.start()
+        self.retry_scheduler.start()
+        return self
+
+    def put(self, proton, uuid, status):
+        """queue the status of a port, replacing its status still waiting to be written"""
+        update = (proton, uuid, status, 1)
+
+        with self._lock:
+            self._outstanding[uuid] = self._outstanding.get(uuid, 0) + 1
+            self._latest[uuid] = update
+
+            if self.retry_scheduler.cancel(uuid):
+                # the failed status waiting for its retry is superseded as well
+                self._outstanding[uuid] -= 1
+
+            self.pool.put(uuid, update)
+
+    def when_written(self, uuid, callback):
+        """call callback() once the statuses of the port queued so far are written or given up, now if there is none"""
+        with self._lock:
+            if self._outstanding.get(uuid):
+                self._callbacks.setdefault(uuid, []).append(callback)
+                return
+
+        callback()
+
+    def depth(self):
+        """number of statuses waiting to be written, or waiting for their retry"""
+        return self.pool.depth() + self.retry_scheduler.depth()
+
+    def superseded(self):
+        return sum(stats['merged'] for stats in self.pool.get_stats()) + self.retry_scheduler.cancelled
+
+    def flush(self, timeout):
+        """wait up to timeout seconds for the queued statuses to be written, return True if none is left"""
+        deadline = time.time() + timeout
+
+        while self.depth() and time.time() < deadline:
+            time.sleep(0.1)
+
+        return not self.depth()
+
+    def join(self):
+        """wait until every queued status is written or given up"""
+        with self._idle:
+            while self._outstanding:
+                self._idle.wait()
+
+    def _supersede(self, waiting, update):
+        # called by put(), under the lock, the waiting status will never be written
+        self._outstanding[update[1]] -= 1
+        return update
+
+    def _finish(self, uuid):
+        with self._lock:
+            count = self._outstanding.pop(uuid) - 1
+
+            if count:
+                self._outstanding[uuid] = count
+                return
+
+            self._latest.pop(uuid, None)
+            callbacks = self._callbacks.pop(uuid, [])
+
+            if not self._outstanding:
+                self._idle.notify_all()
+
+        for callback in callbacks:
+            try:
+                callback()
+
+            except Exception, e:
+                logger.exception("status callback of port %s failed: %s" % (uuid, str(e)))
+
+    def _write(self, update):
+        proton, uuid, status, attempt = update
+
+        try:
+            self.write(proton, uuid, status)
+            self.written += 1
+
+        except Exception, e:
+            if self._reschedule(update, e):
+                return
+
+        self._finish(uuid)
+
+    def _reschedule(self, update, error):
+        """schedule the retry of a failed write, return False when it is given up or superseded"""
+        proton, uuid, status, attempt = update
+        retry = (proton, uuid, status, attempt + 1)
+
+        with self._lock:
+            if self._latest.get(uuid) is not update:
+                # a newer status of the port is queued
+                return False
+
+            delay = self.retry_scheduler.schedule(uuid, retry, attempt)
+
+            if delay is not None:
+                self._latest[uuid] = retry
+                self.retries += 1
+
+        if delay is None:
+            self.failures += 1
+            logger.error("giving up writing status %s of port %s after %d attempts" % (status, uuid, attempt))
+            return False
+
+        logger.warning("writing status %s of port %s failed (%s), retrying in %.1fs" % (status, uuid, str(error), delay))
+
+        return True
+
+    def _retry(self, retry):
+        """queue a retry that is due, unless a newer status of the port was queued meanwhile"""
+        uuid = retry[1]
+
+        with self._lock:
+            if self._latest.get(uuid) is retry:
+                self.pool.put(uuid, retry)
+                return
+
+        self._finish(uuid)
@@ -42,18 +42,52 @@ run 'python vm_split_activation.py -c <config-file> -v
 
 import argparse
 import ConfigParser
+import copy
+import time
+
+from collections import OrderedDict
 
 from vspk import v3_2 as vsdk
 import logging
 
+from nuage import instrumentation
+from nuage.vsd_cache import is_not_found
+
 logger = logging.getLogger(__name__)
 
+domain_filter = 'routeDistinguisher == "%s" and routeTarget == "%s"'
+subnet_filter = 'address == "%s" and netmask == "%s"'
+
+# number of vports or VMs looked up with a single request by activate_many()
+batch_size = 50
+
+
+class NoTrace(object):
+    """step context used when the activation is not traced"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+no_trace = NoTrace()
+
 
 class NUSplitActivation:
-    def __init__(self, config):
+    def __init__(self, config, session=None, cache=None):
         for k, v in config.items():
             setattr(self, k, v)
 
+        self.cache = cache
+        self.trace = None
+        self._cached = []
+
+        if session is not None:
+            # already started session, e.g. handed out by a VSDSessionManager
+            self.session = session
+            return
+
         try:
             self.session = vsdk.NUVSDSession(username=self.username, password=self.password,
                                              enterprise=self.enterprise, api_url=self.api_url)
@@ -70,47 +104,261 @@ class NUSplitActivation:
         deactivate VM
         :return:
         """
+        self.trace = instrumentation.start_trace('deactivate', self.vport_name)
+        succeeded = False
+
         try:
-            vm = self.session.user.vms.get_first(filter='UUID== "%s"' % self.vm_uuid)
+            with self._step('vm'):
+                vm = self._call('vm', 'get', self.session.user.vms.get_first, filter='UUID== "%s"' % self.vm_uuid)
+                interfaces = self._call('vm_interface', 'get', vm.vm_interfaces.get)
+
+            with self._step('delete'):
+                for interface in interfaces:
+                    if interface.vport_name == self.vport_name:
+                        vport = vsdk.NUVPort(id=interface.vport_id)
+                        # vport.fetch()
+                        self._call('vm', 'delete', vm.delete)
+                        self._call('vport', 'delete', vport.delete)
 
-            for interface in vm.vm_interfaces.get():
-                if interface.vport_name == self.vport_name:
-                    vport = vsdk.NUVPort(id=interface.vport_id)
-                    # vport.fetch()
-                    vm.delete()
-                    vport.delete()
+            succeeded = True
 
         except Exception as e:
             logger.critical("Error on vm and vport deletion %s" % str(e));
 
+        instrumentation.finish_trace(self.trace, succeeded)
+
         return
 
-    def activate(self):
+    def activate(self, vport=None):
         """activate a VM
+
+        :param vport: vport of the VM created ahead by provision_many(), if any
         """
+        self.trace = instrumentation.start_trace('activate', self.vport_name)
+        result = None
+
         try:
-            # get enterprise
-            enterprise = self.session.user.enterprises.get_first(filter='name == "%s"' % self.enterprise_name)
+            if vport is not None:
+                # neither the subnet nor the vport have to be looked up
+                result = self._attach_vm(None, {self.vport_name: vport})
+
+            else:
+                result = self._retry_stale(self._activate)
+
+        except Exception, e:
+            logger.error("activating vm failed with exception %s" % str(e))
+
+        instrumentation.finish_trace(self.trace, result)
+
+        return result
+
+    def activate_many(self, ports):
+        """activate a list of VMs, sharing the lookups of their domains and subnets
+
+        :param ports: list of dicts overriding the port specific config (vm_*, vport_name, network_address, ...)
+        :return: dict of vport_name to the result of the activation of that port
+        """
+        results = {}
+        self.trace = instrumentation.start_trace('activate_many', '%d ports' % len(ports))
+        domains = self._group(ports)
+
+        for subnets in domains.values():
+            for group in subnets.values():
+                for sa in group:
+                    results[sa.vport_name] = False
+
+        for domain_key, subnets in domains.items():
+            for subnet_key, group in subnets.items():
+                try:
+                    subnet = group[0]._retry_stale(lambda: group[0]._resolve_subnet(group[0]._resolve_domain()))
+
+                    if subnet is None:
+                        continue
+
+                    with self._step('vport'):
+                        vports = self._get_vports(subnet, [sa.vport_name for sa in group])
+
+                    with self._step('vm'):
+                        vms = self._get_vms([sa.vm_uuid for sa in group])
+
+                except Exception, e:
+                    logger.error("activating vms in domain %s subnet %s failed with exception %s" % (
+                        str(domain_key), str(subnet_key), str(e)))
+                    continue
+
+                for sa in group:
+                    try:
+                        results[sa.vport_name] = sa._attach_vm(subnet, vports, vms)
+
+                    except Exception, e:
+                        logger.error("activating vm %s failed with exception %s" % (sa.vm_uuid, str(e)))
 
-            if enterprise is None:
-                logger.critical("Enterprise %s not found, exiting" % enterprise)
-                print "can't find enterprise"
-                return False
+        instrumentation.finish_trace(self.trace, all(results.values()))
+
+        return results
+
+    def provision_many(self, ports):
+        """create the vports of a list of ports ahead of their activation, with their domains and subnets
+
+        :param ports: list of dicts overriding the port specific config, as for activate_many()
+        :return: dict of vport_name to the vport of each provisioned port
+        """
+        vports = {}
+        self.trace = instrumentation.start_trace('provision_many', '%d ports' % len(ports))
+
+        for domain_key, subnets in self._group(ports).items():
+            for subnet_key, group in subnets.items():
+                try:
+                    subnet = group[0]._retry_stale(lambda: group[0]._resolve_subnet(group[0]._resolve_domain()))
+
+                    if subnet is None:
+                        continue
+
+                    with self._step('vport'):
+                        existing = self._get_vports(subnet, [sa.vport_name for sa in group])
+
+                        for sa in group:
+                            vports[sa.vport_name] = existing.get(sa.vport_name) or sa._create_vport(subnet)
+
+                except Exception, e:
+                    logger.error("provisioning vports in domain %s subnet %s failed with exception %s" % (
+                        str(domain_key), str(subnet_key), str(e)))
+
+        instrumentation.finish_trace(self.trace, len(vports) == len(ports))
+
+        return vports
+
+    def release_vports(self, vports):
+        """delete vports created by provision_many() and never activated, return the number deleted"""
+        deleted = 0
+
+        for vport in vports:
+            try:
+                self._call('vport', 'delete', vport.delete)
+                deleted += 1
+
+            except Exception, e:
+                logger.error("deleting vport %s failed with exception %s" % (vport.name, str(e)))
+
+        return deleted
+
+    def deactivate_many(self, ports):
+        """deactivate a list of VMs
+
+        :param ports: list of dicts with the vm_uuid and vport_name of each port
+        :return: dict of vport_name to the result of the deactivation of that port
+        """
+        results = {}
+        self.trace = instrumentation.start_trace('deactivate_many', '%d ports' % len(ports))
+        group = [self._for_port(port) for port in ports]
+
+        try:
+            with self._step('vm'):
+                vms = self._get_vms([sa.vm_uuid for sa in group])
+
+        except Exception, e:
+            logger.critical("Error on vm lookup %s" % str(e))
+            instrumentation.finish_trace(self.trace, False)
+            return dict((sa.vport_name, False) for sa in group)
+
+        for sa in group:
+            try:
+                vm = vms.get(sa.vm_uuid)
+
+                if vm is not None:
+                    with sa._step('delete'):
+                        for interface in sa._call('vm_interface', 'get', vm.vm_interfaces.get):
+                            if interface.vport_name == sa.vport_name:
+                                vport = vsdk.NUVPort(id=interface.vport_id)
+                                sa._call('vm', 'delete', vm.delete)
+                                sa._call('vport', 'delete', vport.delete)
+
+                results[sa.vport_name] = True
+
+            except Exception, e:
+                logger.critical("Error on vm and vport deletion %s" % str(e))
+                results[sa.vport_name] = False
+
+        instrumentation.finish_trace(self.trace, all(results.values()))
+
+        return results
+
+    def _activate(self):
+        subnet = self._resolve_subnet(self._resolve_domain())
+
+        if subnet is None:
+            return False
 
-            # get domains
-            enterprise.domains.fetch()
+        return self._attach_vm(subnet)
 
-            domain = next((domain for domain in enterprise.domains if
-                           domain.route_distinguisher == self.route_distinguisher and domain.route_target == self.route_target),
-                          None)
+    def _retry_stale(self, function):
+        """call function, retrying it once without cached objects if one of them is gone from VSD"""
+        self._cached = []
+
+        try:
+            return function()
+
+        except Exception, e:
+            if self.cache is None or not is_not_found(e):
+                raise
+
+            # one of the cached objects was deleted in VSD, forget them and retry once
+            logger.info("cached VSD object not found (%s), retrying activation" % str(e))
+            self._evict_cached()
+            self._cached = []
+
+            return function()
+
+    def _group(self, ports):
+        """return the activations of ports grouped by domain, then by subnet"""
+        domains = OrderedDict()
+
+        for port in ports:
+            sa = self._for_port(port)
+            subnets = domains.setdefault((sa.route_distinguisher, sa.route_target), OrderedDict())
+            subnets.setdefault((sa.zone_name, sa.network_address, sa.netmask), []).append(sa)
+
+        return domains
+
+    def _for_port(self, port):
+        """return a copy of this activation with the config of port applied"""
+        sa = copy.copy(self)
+
+        for k, v in port.items():
+            setattr(sa, k, v)
+
+        sa._cached = []
+
+        return sa
+
+    def _resolve_domain(self):
+        """return the domain of the VPN, creating it if needed, or None if the enterprise does not exist"""
+        # get enterprise
+        with self._step('enterprise'):
+            enterprise = self._lookup('enterprise', self.enterprise_name,
+                                      lambda: self._call('enterprise', 'get', self.session.user.enterprises.get_first,
+                                                         filter='name == "%s"' % self.enterprise_name))
+
+        if enterprise is None:
+            logger.critical("Enterprise %s not found, exiting" % enterprise)
+            print "can't find enterprise"
+            return None
+
+        # get domains
+        with self._step('domain'):
+            domain = self._lookup('domain', (enterprise.id, self.route_distinguisher, self.route_target),
+                                  lambda: self._find_domain(enterprise))
 
             if domain is None:
                 logger.info("Domain %s not found, creating domain" % self.domain_name)
 
-                domain_template = enterprise.domain_templates.get_first(filter='name == "%s"' % self.domain_template_name)
+                domain_template = self._lookup('domain_template', (enterprise.id, self.domain_template_name),
+                                               lambda: self._call('domain_template', 'get',
+                                                                  enterprise.domain_templates.get_first,
+                                                                  filter='name == "%s"' % self.domain_template_name))
                 domain = vsdk.NUDomain(name=self.domain_name,
                                        template_id=domain_template.id)
-                enterprise.create_child(domain)
+                self._call('domain', 'create', enterprise.create_child, domain)
 
                 # update domain with the right values
                 domain.tunnel_type = self.tunnel_type
@@ -119,44 +367,74 @@ class NUSplitActivation:
                 domain.back_haul_route_target = '20000:20000'
                 domain.back_haul_route_distinguisher = '20000:20000'
                 domain.back_haul_vnid = '25000'
-                domain.save()
+                self._call('domain', 'save', domain.save)
+
+                self._remember('domain', (enterprise.id, self.route_distinguisher, self.route_target), domain)
+
+        return domain
+
+    def _resolve_subnet(self, domain):
+        """return the subnet of the VM in domain, creating the zone and subnet if needed"""
+        if domain is None:
+            return None
 
-            # get zone
-            zone = domain.zones.get_first(filter='name == "%s"' % self.zone_name)
+        # get zone
+        with self._step('zone'):
+            zone = self._lookup('zone', (domain.id, self.zone_name),
+                                lambda: self._call('zone', 'get', domain.zones.get_first,
+                                                   filter='name == "%s"' % self.zone_name))
 
             if zone is None:
                 logger.info("Zone %s not found, creating zone" % self.zone_name)
 
                 zone = vsdk.NUZone(name=self.zone_name)
-                domain.create_child(zone)
+                self._call('zone', 'create', domain.create_child, zone)
 
-            zone.subnets.fetch()
+                self._remember('zone', (domain.id, self.zone_name), zone)
 
-            subnet = next((subnet for subnet in zone.subnets if
-                           subnet.address == self.network_address and subnet.netmask == self.netmask), None)
-            # get subnet
-            # subnet = zone.subnets.get_first(filter='address == "%s"' % self.network_address)
+        # get subnet
+        with self._step('subnet'):
+            subnet = self._lookup('subnet', (zone.id, self.network_address, self.netmask),
+                                  lambda: self._find_subnet(zone))
 
             if subnet is None:
                 logger.info("Subnet %s not found, creating subnet" % self.subnet_name)
 
                 subnet = vsdk.NUSubnet(name=self.subnet_name, address=self.network_address,
                                        netmask=self.netmask)
-                zone.create_child(subnet)
+                self._call('subnet', 'create', zone.create_child, subnet)
+
+                self._remember('subnet', (zone.id, self.network_address, self.netmask), subnet)
+
+        return subnet
+
+    def _attach_vm(self, subnet, vports=None, vms=None):
+        """create the vport and the VM in subnet if they do not exist yet
+
+        vports and vms are optional dicts of already fetched objects, keyed by vport name and VM uuid
+        """
+        # get vport
+        with self._step('vport'):
+            if vports is None:
+                vport = self._call('vport', 'get', subnet.vports.get_first, filter='name == "%s"' % self.vport_name)
 
-            # get vport
-            vport = subnet.vports.get_first(filter='name == "%s"' % self.vport_name)
+            else:
+                vport = vports.get(self.vport_name)
 
             if vport is None:
-                # create vport
-                logger.info("Vport %s is not found, creating Vport" % self.vport_name)
+                vport = self._create_vport(subnet)
+
+                if vports is not None:
+                    vports[self.vport_name] = vport
 
-                vport = vsdk.NUVPort(name=self.vport_name, address_spoofing='INHERITED', type='VM',
-                                     description='Automatically created, do not edit.')
-                subnet.create_child(vport)
+        # get vm
+        with self._step('vm'):
+            if vms is None:
+                vm = self._call('vm', 'get', self.session.user.fetcher_for_rest_name('vm').get,
+                                filter='UUID == "%s"' % self.vm_uuid, commit=False)
 
-            # get vm
-            vm = self.session.user.fetcher_for_rest_name('vm').get('uuid=="%s"' % self.vm_uuid)
+            else:
+                vm = vms.get(self.vm_uuid)
 
             if not vm:
                 logger.info("VM %s is not found, creating VM" % self.vm_name)
@@ -168,12 +446,99 @@ class NUSplitActivation:
                     'IPAddress': self.vm_ip
                 }])
 
-                self.session.user.create_child(vm)
+                self._call('vm', 'create', self.session.user.create_child, vm)
 
-            return True
+                if vms is not None:
+                    vms[self.vm_uuid] = vm
 
-        except Exception, e:
-            logger.error("activating vm failed with exception %s" % str(e))
+        return True
+
+    def _create_vport(self, subnet):
+        logger.info("Vport %s is not found, creating Vport" % self.vport_name)
+
+        vport = vsdk.NUVPort(name=self.vport_name, address_spoofing='INHERITED', type='VM',
+                             description='Automatically created, do not edit.')
+        self._call('vport', 'create', subnet.create_child, vport)
+
+        return vport
+
+    def _get_vports(self, subnet, names):
+        """fetch the existing vports of subnet with the given names, in batches of batch_size
+
+        The cached subnets are shared by the workers, commit=False keeps the fetched vports out of their fetchers.
+        """
+        vports = {}
+
+        for i in range(0, len(names), batch_size):
+            names_filter = ' or '.join('name == "%s"' % name for name in names[i:i + batch_size])
+
+            for vport in self._call('vport', 'get', subnet.vports.get, filter=names_filter,
+                                     commit=False) or []:
+                vports[vport.name] = vport
+
+        return vports
+
+    def _get_vms(self, uuids):
+        """fetch the existing VMs with the given uuids, in batches of batch_size"""
+        vms = {}
+
+        for i in range(0, len(uuids), batch_size):
+            uuids_filter = ' or '.join('UUID == "%s"' % uuid for uuid in uuids[i:i + batch_size])
+
+            for vm in self._call('vm', 'get', self.session.user.vms.get, filter=uuids_filter,
+                                  commit=False) or []:
+                vms[vm.uuid] = vm
+
+        return vms
+
+    def _find_domain(self, enterprise):
+        # let VSD do the matching instead of downloading every domain of the enterprise
+        return self._call('domain', 'get', enterprise.domains.get_first,
+                          filter=domain_filter % (self.route_distinguisher, self.route_target))
+
+    def _find_subnet(self, zone):
+        return self._call('subnet', 'get', zone.subnets.get_first,
+                          filter=subnet_filter % (self.network_address, self.netmask))
+
+    def _step(self, name):
+        """return the context timing the step name of the activation trace"""
+        if self.trace is None:
+            return no_trace
+
+        return self.trace.step(name)
+
+    def _call(self, object_type, operation, function, *args, **kwargs):
+        """make a VSD request, recording its duration in the activation trace"""
+        if self.trace is None:
+            return function(*args, **kwargs)
+
+        start = time.time()
+        failed = True
+
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+
+        finally:
+            self.trace.record_call(object_type, operation, time.time() - start, failed)
+
+    def _lookup(self, kind, key, loader):
+        """look up a VSD object through the cache, if there is one"""
+        if self.cache is None:
+            return loader()
+
+        self._cached.append((kind, key))
+        return self.cache.lookup(kind, key, loader)
+
+    def _remember(self, kind, key, value):
+        if self.cache is not None:
+            self._cached.append((kind, key))
+            self.cache.put(kind, key, value)
+
+    def _evict_cached(self):
+        for kind, key in self._cached:
+            self.cache.evict(kind, key)
 
     def activate_by_name(self):
         """activate vm. Uses names to identify domain, subnet, and vm
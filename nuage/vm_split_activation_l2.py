@@ -46,12 +46,19 @@ import ConfigParser
 from vspk import v3_2 as vsdk
 import logging
 
+from nuage.vm_split_activation import domain_filter
+
 
 class NUSplitActivationL2:
-    def __init__(self, config):
+    def __init__(self, config, session=None):
         for k, v in config.items():
             setattr(self, k, v)
 
+        if session is not None:
+            # already started session, e.g. handed out by a VSDSessionManager
+            self.session = session
+            return
+
         self.session = vsdk.NUVSDSession(username=self.username, password=self.password,
                                          enterprise=self.enterprise, api_url=self.api_url)
 
@@ -83,10 +90,7 @@ class NUSplitActivationL2:
             return False
 
         # get domains
-        enterprise.l2_domains.fetch()
-
-        domain = next((domain for domain in enterprise.l2_domains if
-                       domain.route_distinguisher == self.route_distinguisher and domain.route_target == self.route_target), None)
+        domain = enterprise.l2_domains.get_first(filter=domain_filter % (self.route_distinguisher, self.route_target))
 
         if domain is None:
             logging.info("Domain %s not found, creating domain" % self.domain_name)
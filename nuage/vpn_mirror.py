@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+In-memory mirror of the Proton VPN tables.
+
+The mirror is cold-loaded with one recursive read of the Proton directory and
+then kept up to date with the events of the shim's watch, so the VPN of a port
+is resolved without any etcd round trip.
+"""
+
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+vpn_tables = ('VPNPort', 'VpnInstance', 'VpnAfConfig')
+
+delete_actions = ('delete', 'expire', 'compareAndDelete')
+
+
+class VPNTableMirror(object):
+    """copy of the VPNPort, VpnInstance and VpnAfConfig tables of a Proton"""
+
+    def __init__(self, proton_dir):
+        self.proton_dir = proton_dir.rstrip('/')
+        self.ready = False
+        self.etcd_index = 0
+
+        self._lock = threading.Lock()
+        self._tables = dict((table, {}) for table in vpn_tables)
+
+    def load(self, client):
+        """cold load the tables, return the etcd index the mirror is consistent with"""
+        self.load_snapshot(client.read(self.proton_dir, recursive=True))
+        logger.info("loaded VPN tables at etcd index %s: %s" % (self.etcd_index, ', '.join(
+            '%s=%d' % (table, len(self._tables[table])) for table in vpn_tables)))
+
+        return self.etcd_index
+
+    def load_snapshot(self, result):
+        """replace the tables with the content of a recursive read of the Proton directory"""
+        tables = dict((table, {}) for table in vpn_tables)
+
+        for node in result.leaves:
+            table, key = self._split_key(node.key)
+
+            if table in tables and not node.dir:
+                value = self._decode(node.key, node.value)
+
+                if value:
+                    tables[table][key] = value
+
+        with self._lock:
+            self._tables = tables
+            self.etcd_index = result.etcd_index
+            self.ready = True
+
+    def restore(self, tables, etcd_index):
+        """replace the tables with a copy saved by get_tables()"""
+        tables = dict((table, dict(tables.get(table, {}))) for table in vpn_tables)
+
+        with self._lock:
+            self._tables = tables
+            self.etcd_index = etcd_index
+            self.ready = True
+
+    def get_tables(self):
+        """return a copy of the tables as a dict of table to dict of key to decoded value"""
+        with self._lock:
+            return dict((table, dict(entries)) for table, entries in self._tables.items())
+
+    def apply(self, message):
+        """update the mirror from a watch event, return False if the table is not mirrored"""
+        table, key = self._split_key(message.key)
+
+        if table not in vpn_tables:
+            return False
+
+        if message.action in delete_actions:
+            value = None
+
+        else:
+            value = self._decode(message.key, message.value)
+
+        with self._lock:
+            if value:
+                self._tables[table][key] = value
+
+            else:
+                self._tables[table].pop(key, None)
+
+        return True
+
+    def get(self, table, key):
+        with self._lock:
+            return self._tables[table].get(key)
+
+    def get_vpn_info(self, uuid):
+        """return the same VPN info as nuage_gluon_shim.get_vpn_info(), or False if it is not known"""
+        vpn_info = {}
+
+        vpn_port = self.get('VPNPort', uuid)
+
+        if not vpn_port:
+            return False
+
+        vpn_instance = self.get('VpnInstance', vpn_port['vpn_instance'])
+
+        if not vpn_instance:
+            logger.error("vpn instance is empty for %s" % vpn_port['vpn_instance'])
+            return False
+
+        vpn_info['route_distinguisher'] = vpn_instance['route_distinguishers']
+        vpn_info['name'] = vpn_instance['vpn_instance_name']
+
+        vpn_afconfig = self.get('VpnAfConfig', vpn_instance['ipv4_family'])
+
+        if vpn_afconfig:
+            vpn_info['route_target'] = vpn_afconfig['vrf_rt_value']
+
+        else:
+            logger.error("vpnafconfig is empty for uuid %s" % uuid)
+
+        return vpn_info
+
+    def _split_key(self, key):
+        path = key[len(self.proton_dir):].split('/')
+
+        if len(path) < 3:
+            return None, None
+
+        return path[1], path[2]
+
+    def _decode(self, key, value):
+        if not value:
+            return None
+
+        try:
+            return json.loads(value)
+
+        except ValueError:
+            logger.error("ignoring invalid value of %s: %s" % (key, value))
+            return None
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Cache of the VSD objects looked up on every activation.
+
+Enterprises, domain templates, domains, zones and subnets almost never change,
+so they are kept in a TTL/LRU cache per object kind. A cached object that turns
+out to be deleted in VSD is evicted by the caller when a request on it fails
+with a 404, see is_not_found().
+"""
+
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+default_ttl = 600
+default_max_size = 4096
+
+object_kinds = ('enterprise', 'domain_template', 'domain', 'zone', 'subnet')
+
+
+def is_not_found(exception):
+    """return True if exception is a bambou HTTP error with a 404 status"""
+    response = getattr(getattr(exception, 'connection', None), 'response', None)
+    return getattr(response, 'status_code', None) == 404
+
+
+class TTLCache(object):
+    """thread safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl=default_ttl, max_size=default_max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+
+            # re-insert to mark the entry as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class VSDObjectCache(object):
+    """one TTLCache per kind of VSD object"""
+
+    def __init__(self, ttl=default_ttl, max_size=default_max_size):
+        self.caches = dict((kind, TTLCache(ttl, max_size)) for kind in object_kinds)
+
+    def get(self, kind, key):
+        return self.caches[kind].get(key)
+
+    def put(self, kind, key, value):
+        self.caches[kind].put(key, value)
+
+    def evict(self, kind, key):
+        logger.info("evicting %s %s from cache" % (kind, str(key)))
+        self.caches[kind].evict(key)
+
+    def lookup(self, kind, key, loader):
+        """return the cached object, calling loader() and caching its result on a miss"""
+        value = self.get(kind, key)
+
+        if value is None:
+            value = loader()
+
+            if value is not None:
+                self.put(kind, key, value)
+
+        return value
+
+    def clear(self):
+        for cache in self.caches.values():
+            cache.clear()
+
+    def get_stats(self):
+        """return hit, miss and size counters per object kind"""
+        return dict((kind, {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache)})
+                    for kind, cache in self.caches.items())
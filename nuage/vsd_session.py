@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Authenticated VSD sessions, shared by the shim workers.
+
+bambou sends every request with its current session, which some versions keep
+per process rather than per thread, so starting a session in one worker switches
+it for all of them. The workers therefore share a single logged-in session per
+(api_url, enterprise, username), and creating a NUSplitActivation no longer
+costs an authentication round trip. When the API key of the session expires, a
+new session is logged in under a lock and replaces it: the key of the old one is
+never cleared under the requests still using it.
+"""
+
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+
+from vspk import v3_2 as vsdk
+
+logger = logging.getLogger(__name__)
+
+# re-authenticate sessions older than this when VSD does not report the API key expiry
+default_max_age = 3600
+
+# renew the API key this many seconds before it expires
+expiry_margin = 60
+
+
+class VSDSessionManager(object):
+    """share one authenticated VSD session per user between the worker threads"""
+
+    def __init__(self, max_age=default_max_age):
+        self.max_age = max_age
+        self.logins = 0
+        self.reuses = 0
+
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._started = {}
+
+    @contextmanager
+    def session(self, api_url, enterprise, username, password):
+        """context manager returning the started session of the user"""
+        yield self.acquire(api_url, enterprise, username, password)
+
+    def acquire(self, api_url, enterprise, username, password):
+        """return the started session of the user, logging in a new one if there is none or its API key expired"""
+        key = (api_url, enterprise, username)
+
+        with self._lock:
+            session = self._sessions.get(key)
+
+            if session is None or self._expired(key, session):
+                if session is not None:
+                    logger.info("API key of session for %s@%s expired, re-authenticating" % (username, enterprise))
+
+                session = vsdk.NUVSDSession(username=username, password=password,
+                                            enterprise=enterprise, api_url=api_url)
+                logger.info("starting session username: %s, enterprise: %s, api_url: %s" % (
+                    username, enterprise, api_url))
+                session.start()
+
+                self._sessions[key] = session
+                self._started[key] = time.time()
+                self.logins += 1
+
+                return session
+
+            self.reuses += 1
+
+        # the session is already authenticated, start() only makes it the current one, of this thread with the
+        # bambou versions keeping it per thread
+        session.start()
+
+        return session
+
+    def _expired(self, key, session):
+        now = time.time()
+        user = getattr(session, 'user', None)
+        expiry = getattr(user, 'api_key_expiry', None)
+
+        if expiry:
+            # VSD reports the expiry in milliseconds since epoch
+            return now + expiry_margin >= expiry / 1000.0
+
+        return now - self._started.get(key, 0) >= self.max_age
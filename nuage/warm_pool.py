@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Warm pool of vports created ahead of the binds.
+
+Gluon creates a port in Proton before binding it to a host. The ports waiting
+for a bind are expected by the pool, and a background thread creates their
+subnets and vports in batches, up to the size of the pool. The bind of such a
+port claims its vport without any VSD request and only creates the VM. A pooled
+vport is released, i.e. deleted, when its port is deleted before being bound.
+"""
+
+import logging
+import threading
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# small batches, a bind of a port in the batch being provisioned waits for it
+default_batch_size = 10
+
+
+class WarmPool(object):
+    """vports created ahead of the binds of the expected ports"""
+
+    def __init__(self, provision, release, size, batch_size=default_batch_size):
+        """
+        :param provision: function(items) creating the vports of a list of (key, item), returning a dict of key to
+                          (location, vport), location being whatever identifies the subnet of the vport
+        :param release: function(vports) deleting vports never claimed, returning the number deleted
+        :param size: maximum number of vports in the pool
+        """
+        self.provision = provision
+        self.release = release
+        self.size = size
+        self.batch_size = batch_size
+
+        self.provisioned = 0
+        self.released = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._condition = threading.Condition()
+        self._expected = OrderedDict()
+        self._provisioning = set()
+        self._pooled = {}
+        self._releasing = []
+
+    def start(self):
+        provisioner = threading.Thread(target=self._run, name='warm-pool')
+        provisioner.setDaemon(True)
+        provisioner.start()
+
+        return self
+
+    def expect(self, key, item):
+        """provision the vport of item ahead of its bind"""
+        with self._condition:
+            if key in self._pooled or key in self._provisioning:
+                return
+
+            self._expected[key] = item
+            self._condition.notify_all()
+
+    def forget(self, key):
+        """the expected item of key will not be bound, release its vport"""
+        with self._condition:
+            self._expected.pop(key, None)
+            self._provisioning.discard(key)
+            self._discard(key)
+
+    def claim(self, key, location):
+        """return the pooled vport of key if it is in location, None otherwise"""
+        with self._condition:
+            self._expected.pop(key, None)
+
+            # a bind racing with the batch provisioning its vport could create the vport a second time
+            while key in self._provisioning:
+                self._condition.wait()
+
+            pooled = self._pooled.pop(key, None)
+
+            if pooled is not None and pooled[0] == location:
+                self.hits += 1
+
+                # room for the next expected item
+                self._condition.notify_all()
+
+                return pooled[1]
+
+            if pooled is not None:
+                # the port moved to another subnet since its vport was provisioned
+                self._releasing.append(pooled[1])
+                self._condition.notify_all()
+
+            self.misses += 1
+            return None
+
+    def depth(self):
+        with self._condition:
+            return len(self._pooled)
+
+    def expected(self):
+        with self._condition:
+            return len(self._expected)
+
+    def get_keys(self):
+        """return the keys of the pooled vports"""
+        with self._condition:
+            return set(self._pooled) | self._provisioning
+
+    def _discard(self, key):
+        pooled = self._pooled.pop(key, None)
+
+        if pooled is not None:
+            self._releasing.append(pooled[1])
+            self._condition.notify_all()
+
+    def _next_batch(self):
+        """wait for vports to release or room in the pool for expected items, return both"""
+        with self._condition:
+            while True:
+                room = min(self.size - len(self._pooled), self.batch_size)
+
+                if self._releasing or (self._expected and room > 0):
+                    break
+
+                self._condition.wait()
+
+            releasing, self._releasing = self._releasing, []
+            batch = []
+
+            while self._expected and len(batch) < room:
+                batch.append(self._expected.popitem(last=False))
+
+            self._provisioning.update(key for key, item in batch)
+
+            return batch, releasing
+
+    def _store(self, batch, vports):
+        """pool the vports of the batch still expected, release the others"""
+        with self._condition:
+            for key, item in batch:
+                if key not in vports:
+                    self._provisioning.discard(key)
+
+                elif key in self._provisioning:
+                    self._provisioning.remove(key)
+                    self._pooled[key] = vports[key]
+                    self.provisioned += 1
+
+                else:
+                    # forgotten while it was provisioned
+                    self._releasing.append(vports[key][1])
+
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            batch, releasing = self._next_batch()
+            vports = {}
+
+            try:
+                if releasing:
+                    self.released += self.release(releasing)
+
+                if batch:
+                    vports = self.provision(batch)
+                    logger.info("provisioned %d vports of %d expected ports" % (len(vports), len(batch)))
+
+            except Exception, e:
+                logger.exception("provisioning the warm pool failed: %s" % str(e))
+
+            finally:
+                self._store(batch, vports)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, Nokia
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its contributors
+#       may be used to endorse or promote products derived from this software without
+#       specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Sharded pool of worker threads for processing etcd messages.
+
+Every item is queued together with a shard key (the port uuid). Items with the
+same key always land on the same worker, so events for one port are handled in
+order while different ports are handled in parallel. Items of a key still waiting
+in the queue can be merged, see CoalescingQueue.
+"""
+
+import logging
+import threading
+import time
+import zlib
+
+from nuage.coalescer import CoalescingQueue
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerStats(object):
+    """throughput counters of a single worker"""
+
+    def __init__(self, index):
+        self.index = index
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+
+    def record(self, elapsed, failed=False):
+        self.processed += 1
+        self.busy_time += elapsed
+
+        if failed:
+            self.errors += 1
+
+
+class ShardedWorkerPool(object):
+    """pool of worker threads, each one owning its own queue"""
+
+    def __init__(self, num_workers, handler, name='worker', merge=None):
+        if num_workers < 1:
+            raise ValueError("number of workers must be at least 1, got %s" % num_workers)
+
+        self.num_workers = num_workers
+        self.handler = handler
+        self.name = name
+        self.merge = merge
+
+        self.queues = []
+        self.stats = []
+        self.threads = []
+
+    def start(self):
+        """create the queues and start one daemon thread per worker"""
+
+        for i in range(self.num_workers):
+            messages_queue = CoalescingQueue(self.merge)
+            stats = WorkerStats(i)
+
+            worker = threading.Thread(target=self._run, args=(messages_queue, stats),
+                                      name='%s-%d' % (self.name, i))
+            worker.setDaemon(True)
+
+            self.queues.append(messages_queue)
+            self.stats.append(stats)
+            self.threads.append(worker)
+
+            worker.start()
+
+        logger.info("started %d %s threads" % (self.num_workers, self.name))
+
+        return self
+
+    def shard_for(self, key):
+        """return the index of the worker responsible for key"""
+        if not key:
+            return 0
+
+        return (zlib.crc32(key) & 0xffffffff) % self.num_workers
+
+    def put(self, key, item):
+        self.queues[self.shard_for(key)].put(key, item)
+
+    def depth(self):
+        """total number of items waiting in all queues"""
+        return sum(q.qsize() for q in self.queues)
+
+    def oldest_age(self):
+        """age in seconds of the oldest item waiting in any queue"""
+        return max(q.oldest_age() for q in self.queues)
+
+    def join(self):
+        """block until every queued item has been processed"""
+        for q in self.queues:
+            q.join()
+
+    def get_stats(self):
+        """return a list of per-worker queue depth and throughput counters"""
+        return [{'worker': s.index,
+                 'depth': self.queues[s.index].qsize(),
+                 'merged': self.queues[s.index].merged,
+                 'oldest_age': self.queues[s.index].oldest_age(),
+                 'processed': s.processed,
+                 'errors': s.errors,
+                 'busy_time': s.busy_time} for s in self.stats]
+
+    def log_stats(self):
+        for s in self.get_stats():
+            logger.info("%s %d: depth=%d oldest=%.1fs processed=%d merged=%d errors=%d busy=%.3fs" % (
+                self.name, s['worker'], s['depth'], s['oldest_age'], s['processed'], s['merged'], s['errors'],
+                s['busy_time']))
+
+    def _run(self, messages_queue, stats):
+        logger.info("processing queue")
+
+        while True:
+            item = messages_queue.get()
+            start = time.time()
+            failed = False
+
+            try:
+                self.handler(item)
+
+            except Exception, e:
+                failed = True
+                logger.exception("processing %s failed: %s" % (item, str(e)))
+
+            finally:
+                stats.record(time.time() - start, failed)
+                messages_queue.task_done()
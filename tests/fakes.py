@@ -0,0 +1,409 @@
+"""
+In-process fakes of etcd and VSD, to run the shim without either of them.
+
+FakeEtcdClient keeps the keys in a dict and implements the part of etcd.Client
+used by the shim. FakeVSD is a tree of VSD objects with the fetchers, filters and
+create_child/save/delete calls used by NUSplitActivation. Install it with
+install_fake_vsd(), which replaces the vspk module used by vm_split_activation.
+PortChurn writes the Gluon entries of new ports and returns their watch events.
+"""
+
+import itertools
+import json
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+
+import etcd
+
+from nuage import vm_split_activation
+from nuage.port_event import decode_event
+
+proton_dir = '/net-l3vpn/proton'
+
+clause_pattern = re.compile(r'(\w+)\s*==\s*"([^"]*)"')
+
+# fetcher of the parent holding each kind of object
+fetcher_names = {
+    'NUEnterprise': 'enterprises',
+    'NUDomainTemplate': 'domain_templates',
+    'NUDomain': 'domains',
+    'NUZone': 'zones',
+    'NUSubnet': 'subnets',
+    'NUVPort': 'vports',
+    'NUVM': 'vms',
+    'NUVMInterface': 'vm_interfaces',
+}
+
+# fetchers of the objects of a whole domain, whatever their parent
+domain_fetchers = {
+    'vports': 'NUVPort',
+    'vm_interfaces': 'NUVMInterface',
+}
+
+object_fetchers = {
+    'NUMe': ('enterprises', 'vms'),
+    'NUEnterprise': ('domains', 'domain_templates'),
+    'NUDomainTemplate': (),
+    'NUDomain': ('zones',),
+    'NUZone': ('subnets',),
+    'NUSubnet': ('vports',),
+    'NUVPort': (),
+    'NUVM': ('vm_interfaces',),
+    'NUVMInterface': (),
+}
+
+
+class FakeEtcdClient(object):
+    """dict backed etcd client"""
+
+    def __init__(self):
+        self.etcd_index = 0
+        self.nodes = {}
+        self.writes = 0
+        # watch events of every change, in etcd index order
+        self.history = []
+        self._changed = threading.Condition()
+
+    def write(self, key, value, **kwargs):
+        if kwargs.get('prevExist') is False and key in self.nodes:
+            raise etcd.EtcdAlreadyExist('Key already exists : %s' % key, payload={'index': self.etcd_index})
+
+        if 'prevIndex' in kwargs:
+            if key not in self.nodes:
+                raise etcd.EtcdKeyNotFound('Key not found : %s' % key, payload={'index': self.etcd_index})
+
+            if self.nodes[key][1] != kwargs['prevIndex']:
+                raise etcd.EtcdCompareFailed('Compare failed : %s' % key, payload={'index': self.etcd_index})
+
+        prev_value = self.nodes.get(key, (None, 0))[0]
+        self.etcd_index += 1
+        self.writes += 1
+        self.nodes[key] = (value, self.etcd_index)
+        self._record(self.event('update' if prev_value is not None else 'set', key, value, prev_value))
+
+        return self.get(key)
+
+    def delete(self, key, **kwargs):
+        if key not in self.nodes:
+            raise etcd.EtcdKeyNotFound('Key not found : %s' % key, payload={'index': self.etcd_index})
+
+        if 'prevIndex' in kwargs and self.nodes[key][1] != kwargs['prevIndex']:
+            raise etcd.EtcdCompareFailed('Compare failed : %s' % key, payload={'index': self.etcd_index})
+
+        self.etcd_index += 1
+        self.writes += 1
+        value, modified_index = self.nodes.pop(key)
+
+        return self._record(self.event('delete', key, None, value))
+
+    def watch(self, key, recursive=False, waitIndex=None, timeout=None, **kwargs):
+        """return the first change of key, or under it if recursive, from waitIndex, blocking until there is one"""
+        wait_index = waitIndex or self.etcd_index + 1
+        prefix = key.rstrip('/') + '/'
+        deadline = time.time() + timeout if timeout else None
+
+        with self._changed:
+            while True:
+                for result in self.history:
+                    if result.modifiedIndex >= wait_index and (
+                            result.key == key or recursive and result.key.startswith(prefix)):
+                        return result
+
+                if deadline is not None and time.time() >= deadline:
+                    raise etcd.EtcdWatchTimedOut('Watch timed out : %s' % key)
+
+                self._changed.wait(deadline - time.time() if deadline is not None else 1)
+
+    def _record(self, result):
+        with self._changed:
+            self.history.append(result)
+            self._changed.notify_all()
+
+        return result
+
+    def get(self, key):
+        if key not in self.nodes:
+            raise etcd.EtcdKeyNotFound('Key not found : %s' % key, payload={'index': self.etcd_index})
+
+        value, modified_index = self.nodes[key]
+        result = etcd.EtcdResult('get', node={'key': key, 'value': value, 'modifiedIndex': modified_index})
+        result.etcd_index = self.etcd_index
+
+        return result
+
+    def read(self, key, recursive=False, **kwargs):
+        if key in self.nodes:
+            return self.get(key)
+
+        prefix = key.rstrip('/') + '/'
+        nodes = [{'key': k, 'value': value, 'modifiedIndex': modified_index}
+                 for k, (value, modified_index) in sorted(self.nodes.items()) if k.startswith(prefix)]
+
+        if not nodes:
+            raise etcd.EtcdKeyNotFound('Key not found : %s' % key, payload={'index': self.etcd_index})
+
+        result = etcd.EtcdResult('get', node={'key': key.rstrip('/'), 'dir': True, 'nodes': nodes})
+        result.etcd_index = self.etcd_index
+
+        return result
+
+    def event(self, action, key, value, prev_value=None):
+        """return the watch event of the last change of key"""
+        prev_node = None
+
+        if prev_value is not None:
+            prev_node = {'key': key, 'value': prev_value}
+
+        result = etcd.EtcdResult(action, node={'key': key, 'value': value, 'modifiedIndex': self.etcd_index},
+                                 prevNode=prev_node)
+        result.etcd_index = self.etcd_index
+
+        return result
+
+    def write_event(self, key, value):
+        """write key and return the watch event of the write"""
+        prev_value = self.nodes.get(key, (None, 0))[0]
+        self.write(key, value)
+
+        return self.event('update' if prev_value is not None else 'set', key, value, prev_value)
+
+
+def write_vpn(client, port_uuid, vpn_name='vpn-1', route_distinguisher='100:1', route_target='100:1'):
+    """write the VPNPort, VpnInstance and VpnAfConfig entries of a port"""
+    client.write('%s/VpnAfConfig/af-%s' % (proton_dir, vpn_name),
+                 '{"vrf_rt_value": "%s", "vrf_rt_type": "both"}' % route_target)
+    client.write('%s/VpnInstance/%s' % (proton_dir, vpn_name),
+                 '{"vpn_instance_name": "%s", "route_distinguishers": "%s", "ipv4_family": "af-%s"}' % (
+                     vpn_name, route_distinguisher, vpn_name))
+    client.write('%s/VPNPort/%s' % (proton_dir, port_uuid), '{"id": "%s", "vpn_instance": "%s"}' % (port_uuid, vpn_name))
+
+
+def port_config(vpn, port):
+    """return the NUSplitActivation config of a port, in subnet port % 2 of the domain of vpn"""
+    return {'enterprise_name': 'Gluon', 'domain_name': 'vpn-%d' % vpn, 'domain_template_name': 'GluonDomainTemplate',
+            'route_distinguisher': '100:%d' % vpn, 'route_target': '100:%d' % vpn, 'tunnel_type': 'GRE',
+            'zone_name': 'Zone0', 'subnet_name': 'Subnet%d' % port, 'network_address': '10.%d.%d.0' % (vpn, port % 2),
+            'netmask': '255.255.255.0', 'vport_name': 'port-%d-%d' % (vpn, port), 'vm_uuid': 'vm-%d-%d' % (vpn, port),
+            'vm_name': 'vm-%d-%d' % (vpn, port), 'vm_ip': '10.%d.%d.%d' % (vpn, port % 2, port + 2), 'vm_mac': ''}
+
+
+def attribute_name(rest_name):
+    """return the python attribute of a REST attribute name, e.g. routeDistinguisher -> route_distinguisher"""
+    return re.sub('([a-z])([A-Z])', r'\1_\2', rest_name).lower()
+
+
+def matches(obj, filter):
+    if not filter:
+        return True
+
+    for alternative in filter.split(' or '):
+        if all(getattr(obj, attribute_name(name), None) == value for name, value in clause_pattern.findall(alternative)):
+            return True
+
+    return False
+
+
+class FakeFetcher(object):
+    def __init__(self, vsd):
+        self.vsd = vsd
+        self.objects = []
+
+    def get(self, filter=None, page=None, page_size=None, commit=True):
+        self.vsd.request()
+
+        self.vsd.filters.append(filter)
+
+        if commit:
+            # bambou would replace the children of the parent object with the fetched ones
+            self.vsd.commits += 1
+
+        objects = [obj for obj in self.objects if matches(obj, filter)]
+
+        if page is None:
+            return objects
+
+        return objects[page * page_size:(page + 1) * page_size]
+
+    def get_first(self, filter=None):
+        objects = self.get(filter, commit=False)
+        return objects[0] if objects else None
+
+
+class FakeDomainFetcher(FakeFetcher):
+    """fetcher of the objects of a kind anywhere under a domain"""
+
+    def __init__(self, vsd, domain, kind):
+        FakeFetcher.__init__(self, vsd)
+        self.domain = domain
+        self.kind = kind
+
+    @property
+    def objects(self):
+        return [obj for obj in self.vsd.objects.values()
+                if obj.__class__.__name__ == self.kind and self.domain in self.vsd.ancestors(obj)]
+
+    @objects.setter
+    def objects(self, objects):
+        pass
+
+
+class FakeObject(object):
+    vsd = None
+    fetchers = ()
+
+    def __init__(self, **attributes):
+        self.id = None
+        self.parent = None
+        self.__dict__.update(attributes)
+
+        for name in self.fetchers:
+            setattr(self, name, FakeFetcher(self.vsd))
+
+        if self.__class__.__name__ == 'NUDomain':
+            for name, kind in domain_fetchers.items():
+                setattr(self, name, FakeDomainFetcher(self.vsd, self, kind))
+
+    def create_child(self, child):
+        self.vsd.create(self, child)
+
+    def save(self):
+        self.vsd.request()
+
+    def delete(self):
+        self.vsd.delete(self.id)
+
+
+class FakeVSD(object):
+    """VSD object tree, usable both as the vspk module and as a started session
+
+    :param latency: seconds each request takes, to emulate a remote VSD
+    """
+
+    def __init__(self, enterprise_name='Gluon', domain_template_name='GluonDomainTemplate', latency=0):
+        self.latency = latency
+        self.requests = 0
+        self.commits = 0
+        self.filters = []
+        self.objects = {}
+        self._ids = itertools.count(1)
+
+        for name, fetchers in object_fetchers.items():
+            setattr(self, name, type(name, (FakeObject,), {'vsd': self, 'fetchers': fetchers}))
+
+        self.user = self.NUMe()
+        self.user.fetcher_for_rest_name = lambda rest_name: self.user.vms
+
+        enterprise = self.NUEnterprise(name=enterprise_name)
+        self.user.create_child(enterprise)
+        enterprise.create_child(self.NUDomainTemplate(name=domain_template_name))
+
+        self.requests = 0
+
+    def request(self):
+        self.requests += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+    def create(self, parent, child):
+        self.request()
+        self._add(parent, child)
+
+        # VSD creates the interfaces of a VM with it
+        for interface in getattr(child, 'interfaces', None) or []:
+            vport = self.objects.get(interface['VPortID'])
+            self._add(child, self.NUVMInterface(name=interface['name'], mac=interface['MAC'],
+                                                ip_address=interface['IPAddress'], vport_id=interface['VPortID'],
+                                                vport_name=vport.name if vport is not None else None,
+                                                vm_uuid=getattr(child, 'uuid', None)))
+
+    def _add(self, parent, child):
+        child.id = 'fake-%d' % next(self._ids)
+        child.parent = parent
+        self.objects[child.id] = child
+        getattr(parent, fetcher_names[child.__class__.__name__]).objects.append(child)
+
+    def delete(self, id):
+        self.request()
+        obj = self.objects.pop(id, None)
+
+        if obj is not None:
+            getattr(obj.parent, fetcher_names[obj.__class__.__name__]).objects.remove(obj)
+
+            # VSD deletes the interfaces of a VM with it
+            for child in [child for child in self.objects.values() if child.parent is obj]:
+                self.objects.pop(child.id)
+
+    def ancestors(self, obj):
+        """return the parents of obj, those of its vport for a VM interface"""
+        if obj.__class__.__name__ == 'NUVMInterface':
+            obj = self.objects.get(obj.vport_id)
+
+        parents = []
+
+        while obj is not None:
+            obj = obj.parent
+            parents.append(obj)
+
+        return parents
+
+    def count(self, kind):
+        return len([obj for obj in self.objects.values() if obj.__class__.__name__ == kind])
+
+
+class FakeSessionManager(object):
+    """VSDSessionManager handing out the fake VSD as session"""
+
+    def __init__(self, vsd):
+        self.vsd = vsd
+
+    @contextmanager
+    def session(self, api_url, enterprise, username, password):
+        yield self.vsd
+
+
+@contextmanager
+def install_fake_vsd(vsd):
+    """use vsd in place of the vspk module of vm_split_activation"""
+    vsdk = vm_split_activation.vsdk
+    vm_split_activation.vsdk = vsd
+
+    try:
+        yield vsd
+
+    finally:
+        vm_split_activation.vsdk = vsdk
+
+
+class PortChurn(object):
+    """generate the Gluon events of new ports"""
+
+    def __init__(self, client):
+        self.client = client
+        self.ports = 0
+
+    def new_port(self):
+        self.ports += 1
+        uuid = 'port-%06d' % self.ports
+        write_vpn(self.client, uuid)
+
+        return uuid
+
+    def bind_message(self, uuid, host_id='cbserver5'):
+        value = json.dumps({'id': uuid, 'device_id': 'vm-' + uuid, 'host_id': host_id, 'subnet_prefix': '24',
+                            'ipaddress': '10.0.%d.%d' % (self.ports / 250, self.ports % 250 + 2),
+                            'mac_address': 'fa:16:3e:00:%02x:%02x' % (self.ports / 256 % 256, self.ports % 256)})
+
+        return self.client.write_event('%s/ProtonBasePort/%s' % (proton_dir, uuid), value)
+
+    def bind(self, uuid, host_id='cbserver5'):
+        return decode_event(self.bind_message(uuid, host_id))
+
+    def delete_message(self, uuid):
+        return self.client.delete('%s/ProtonBasePort/%s' % (proton_dir, uuid))
+
+    def delete(self, uuid):
+        return decode_event(self.delete_message(uuid))
@@ -0,0 +1,533 @@
+"""
+Trace-replay load generator measuring the end-to-end throughput of the shim.
+
+A trace is a JSON lines file of etcd writes and deletes with their time offset in
+seconds, e.g. {"t": 0.25, "op": "write", "key": "/net-l3vpn/proton/...", "value": "..."}.
+Traces are either generated or recorded from a live Gluon:
+
+    python -m tests.load_replay generate --ports 1000 --rate 50 -o churn.trace
+    python -m tests.load_replay record --duration 600 -o gluon.trace
+
+and replayed into a local etcd, optionally running the shim in-process against a
+mock VSD:
+
+    python -m tests.load_replay replay churn.trace --run-shim --vsd-latency 0.02 --speed 2
+
+or against several shim processes sharing the ports, each one running against its
+own mock VSD:
+
+    python -m tests.load_replay replay churn.trace --shims 3
+
+The failover command times the takeover of an active/standby pair of shims when
+the leader is killed:
+
+    python -m tests.load_replay failover --leader-ttl 6
+
+The replay measures the time from each bind (ProtonBasePort write with a host id)
+to the shim writing "up" under <proton>/controller/port/<uuid>, and reports the
+p50/p99 latencies and the sustained ports per second.
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid as uuid_module
+
+import etcd
+
+proton_dir = '/net-l3vpn/proton'
+status_dir = '/net-l3vpn/controller/port'
+bind_host_id = 'cbserver5'
+
+
+def port_key(uuid):
+    return '%s/ProtonBasePort/%s' % (proton_dir, uuid)
+
+
+def port_value(uuid, index, host_id):
+    return json.dumps({
+        'id': uuid,
+        'device_id': str(uuid_module.UUID(int=index + 1)),
+        'device_owner': 'compute:None',
+        'host_id': host_id,
+        'ipaddress': '10.%d.%d.%d' % (index / 62500 % 256, index / 250 % 250, index % 250 + 2),
+        'mac_address': 'fa:16:3e:%02x:%02x:%02x' % (index / 65536 % 256, index / 256 % 256, index % 256),
+        'subnet_prefix': '24',
+        'vif_type': 'unbound',
+    })
+
+
+def generate_trace(ports, rate, lifetime, vpns, unbind_fraction, seed=None, bind_delay=0.02):
+    """return the operations of a Gluon like port churn sorted by time
+
+    Ports arrive at rate ports per second. Each port is created without a host, bound to a
+    VPN and a host bind_delay seconds later, and unbound after about lifetime seconds. Some of
+    them are unbound by clearing their host id first, the others are deleted directly.
+    """
+    rng = random.Random(seed)
+    operations = []
+
+    for i in range(vpns):
+        name = 'vpn-%d' % i
+        operations.append((0, 'write', '%s/VpnAfConfig/af-%s' % (proton_dir, name),
+                           json.dumps({'vrf_rt_value': '%d:%d' % (1000 + i, 1000 + i), 'vrf_rt_type': 'both'})))
+        operations.append((0, 'write', '%s/VpnInstance/%s' % (proton_dir, name),
+                           json.dumps({'vpn_instance_name': name, 'route_distinguishers': '%d:%d' % (1000 + i, 1000 + i),
+                                       'ipv4_family': 'af-' + name})))
+
+    for i in range(ports):
+        uuid = str(uuid_module.UUID(int=rng.getrandbits(128)))
+        start = float(i) / rate
+        end = start + bind_delay + rng.expovariate(1.0 / lifetime)
+
+        operations.append((start, 'write', port_key(uuid), port_value(uuid, i, '')))
+        operations.append((start + 0.01, 'write', '%s/VPNPort/%s' % (proton_dir, uuid),
+                           json.dumps({'id': uuid, 'vpn_instance': 'vpn-%d' % rng.randrange(vpns)})))
+        operations.append((start + bind_delay, 'write', port_key(uuid), port_value(uuid, i, bind_host_id)))
+
+        if rng.random() < unbind_fraction:
+            operations.append((end, 'write', port_key(uuid), port_value(uuid, i, '')))
+
+        operations.append((end + 0.01, 'delete', port_key(uuid), None))
+        operations.append((end + 0.02, 'delete', '%s/VPNPort/%s' % (proton_dir, uuid), None))
+
+    operations.sort(key=lambda operation: operation[0])
+
+    return [{'t': round(t, 6), 'op': op, 'key': key, 'value': value} for t, op, key, value in operations]
+
+
+def save_trace(operations, output):
+    for operation in operations:
+        output.write(json.dumps(operation) + '\n')
+
+
+def load_trace(trace_file):
+    with open(trace_file) as trace:
+        return [json.loads(line) for line in trace if line.strip()]
+
+
+def record_trace(client, duration, directory=proton_dir):
+    """watch directory for duration seconds and return its changes as a trace"""
+    operations = []
+    start = time.time()
+    wait_index = client.read('/').etcd_index + 1
+
+    while time.time() - start < duration:
+        try:
+            message = client.read(directory, recursive=True, wait=True, waitIndex=wait_index,
+                                  timeout=max(1, duration - (time.time() - start)))
+
+        except etcd.EtcdWatchTimedOut:
+            continue
+
+        wait_index = message.modifiedIndex + 1
+
+        if message.dir:
+            continue
+
+        op = 'delete' if message.action in ('delete', 'expire', 'compareAndDelete') else 'write'
+        operations.append({'t': round(time.time() - start, 6), 'op': op, 'key': message.key,
+                           'value': message.value if op == 'write' else None})
+
+    return operations
+
+
+def percentile(values, fraction):
+    """nearest rank percentile of sorted values"""
+    if not values:
+        return float('nan')
+
+    return values[min(len(values) - 1, max(0, int(math.ceil(fraction * len(values))) - 1))]
+
+
+class StatusWatcher(threading.Thread):
+    """watch the port statuses written by the shim and time the binds"""
+
+    def __init__(self, client, wait_index):
+        super(StatusWatcher, self).__init__(name='status-watcher')
+        self.setDaemon(True)
+
+        self.client = client
+        self.wait_index = wait_index
+        self.lock = threading.Lock()
+        self.bind_times = {}
+        self.latencies = []
+        self.first_bind = None
+        self.last_up = None
+
+    def bound(self, uuid):
+        """record the write of a bind of uuid"""
+        now = time.time()
+
+        with self.lock:
+            self.bind_times[uuid] = now
+
+            if self.first_bind is None:
+                self.first_bind = now
+
+    def pending(self):
+        with self.lock:
+            return len(self.bind_times)
+
+    def run(self):
+        while True:
+            try:
+                message = self.client.read(status_dir, recursive=True, wait=True, waitIndex=self.wait_index)
+                self.wait_index = message.modifiedIndex + 1
+
+            except etcd.EtcdWatchTimedOut:
+                continue
+
+            except etcd.EtcdEventIndexCleared:
+                logging.error("status watch fell behind, some binds will not be timed")
+                self.wait_index = self.client.read('/').etcd_index + 1
+                continue
+
+            if message.dir or message.value is None:
+                continue
+
+            try:
+                status = json.loads(message.value).get('status')
+
+            except ValueError:
+                continue
+
+            if status != 'up':
+                continue
+
+            now = time.time()
+
+            with self.lock:
+                start = self.bind_times.pop(message.key.split('/')[-1], None)
+
+                if start is not None:
+                    self.latencies.append(now - start)
+                    self.last_up = now
+
+
+def is_bind(operation):
+    if operation['op'] != 'write' or '/ProtonBasePort/' not in operation['key']:
+        return False
+
+    try:
+        return bool(json.loads(operation['value']).get('host_id'))
+
+    except (TypeError, ValueError):
+        return False
+
+
+def replay(client, operations, speed, watcher):
+    """write the operations into etcd, speed times faster than recorded, 0 for as fast as possible"""
+    start = time.time()
+
+    for count, operation in enumerate(operations):
+        if speed:
+            delay = start + operation['t'] / speed - time.time()
+
+            if delay > 0:
+                time.sleep(delay)
+
+        if is_bind(operation):
+            watcher.bound(operation['key'].split('/')[-1])
+
+        try:
+            if operation['op'] == 'delete':
+                client.delete(operation['key'])
+
+            else:
+                client.write(operation['key'], operation['value'])
+
+        except etcd.EtcdKeyNotFound:
+            pass
+
+        if count and count % 1000 == 0:
+            logging.info("replayed %d of %d operations" % (count, len(operations)))
+
+    return time.time() - start
+
+
+def run_shim(etcd_host, etcd_port, workers, vsd_latency, shim_args=(), foreground=False):
+    """start the shim in a daemon thread, or run it in this thread with foreground, talking to a mock VSD"""
+    from nuage import server, vm_split_activation
+    from tests.fakes import FakeSessionManager, FakeVSD
+
+    shim = server.bootstrap(list(shim_args))
+
+    vsd = FakeVSD(latency=vsd_latency)
+    vm_split_activation.vsdk = vsd
+    shim.VSDSessionManager = lambda: FakeSessionManager(vsd)
+
+    sys.argv = ['nuage-shim-server', '-H', etcd_host, '-p', str(etcd_port), '-w', str(workers)] + list(shim_args)
+
+    if foreground:
+        shim.main()
+        return vsd
+
+    thread = threading.Thread(target=shim.main, name='shim')
+    thread.setDaemon(True)
+    thread.start()
+
+    return vsd
+
+
+def start_shim(etcd_host, etcd_port, workers, vsd_latency, options=()):
+    """start a shim process against a mock VSD, options are the ones of the shim command"""
+    command = [sys.executable, '-m', 'tests.load_replay', '-H', etcd_host, '-p', str(etcd_port), 'shim',
+               '--workers', str(workers), '--vsd-latency', str(vsd_latency)] + list(options)
+
+    # the report is printed on stdout, keep it apart from the output of the shims
+    return subprocess.Popen(command, stdout=sys.stderr)
+
+
+def start_shims(count, etcd_host, etcd_port, workers, vsd_latency):
+    """start count shim processes sharing the ports, return the processes"""
+    return [start_shim(etcd_host, etcd_port, workers, vsd_latency, ['--instance-id', 'shim-%d' % index])
+            for index in range(count)]
+
+
+def stop_shims(processes):
+    for process in processes:
+        process.send_signal(signal.SIGINT)
+
+    for process in processes:
+        process.wait()
+
+
+def bind_ports(client, watcher, count, first):
+    """create and bind count ports, numbered from first"""
+    client.write('%s/VpnAfConfig/af-vpn-0' % proton_dir, json.dumps({'vrf_rt_value': '1000:1000', 'vrf_rt_type': 'both'}))
+    client.write('%s/VpnInstance/vpn-0' % proton_dir, json.dumps({'vpn_instance_name': 'vpn-0',
+                                                                 'route_distinguishers': '1000:1000',
+                                                                 'ipv4_family': 'af-vpn-0'}))
+
+    for index in range(first, first + count):
+        uuid = str(uuid_module.UUID(int=index + 1))
+        client.write('%s/VPNPort/%s' % (proton_dir, uuid), json.dumps({'id': uuid, 'vpn_instance': 'vpn-0'}))
+        watcher.bound(uuid)
+        client.write(port_key(uuid), port_value(uuid, index, bind_host_id))
+
+
+def wait_for_binds(watcher, timeout):
+    deadline = time.time() + timeout
+
+    while watcher.pending() and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def measure_failover(client, etcd_host, etcd_port, workers, vsd_latency, leader_ttl, ports, graceful):
+    """start an active/standby pair, stop the leader and time until the standby has bound new ports"""
+    options = ['--ha', '--leader-ttl', str(leader_ttl)]
+    processes = dict((process.pid, process) for process in [
+        start_shim(etcd_host, etcd_port, workers, vsd_latency, options) for i in range(2)])
+
+    try:
+        deadline = time.time() + 30
+        leader = None
+
+        while leader is None and time.time() < deadline:
+            try:
+                leader = json.loads(client.get('/controller/nuage-leader').value)['leader']
+
+            except etcd.EtcdKeyNotFound:
+                time.sleep(0.1)
+
+        if leader is None:
+            print 'no leader elected after 30s'
+            return
+
+        # let the standby load the tables and start following the leader
+        time.sleep(2)
+        watcher = StatusWatcher(etcd.Client(host=etcd_host, port=etcd_port, read_timeout=3600),
+                                client.read('/').etcd_index + 1)
+        watcher.start()
+        bind_ports(client, watcher, ports, 0)
+        wait_for_binds(watcher, 30)
+        print 'leader %s bound %d ports, p50=%.3fs' % (leader, len(watcher.latencies),
+                                                       percentile(sorted(watcher.latencies), 0.5))
+
+        leader_process = processes.pop(int(leader.rsplit('-', 1)[1]))
+        stopped = time.time()
+
+        if graceful:
+            leader_process.send_signal(signal.SIGINT)
+
+        else:
+            leader_process.kill()
+
+        leader_process.wait()
+
+        watcher.latencies = []
+        bind_ports(client, watcher, ports, ports)
+        wait_for_binds(watcher, leader_ttl + 30)
+
+        if not watcher.latencies:
+            print 'the standby bound no port'
+            return
+
+        first_up = stopped + min(watcher.latencies)
+        print 'leader %s: standby bound its first port %.3fs after, %d of %d ports after %.3fs' % (
+            'stopped' if graceful else 'killed', first_up - stopped, len(watcher.latencies), ports,
+            watcher.last_up - stopped)
+
+    finally:
+        stop_shims(processes.values())
+
+
+def report(watcher, operations, replay_time, drain_time):
+    latencies = sorted(watcher.latencies)
+    binds = len([operation for operation in operations if is_bind(operation)])
+
+    print 'operations replayed: %d in %.1fs' % (len(operations), replay_time)
+    print 'binds: %d, up: %d, not up after %.0fs: %d' % (binds, len(latencies), drain_time, watcher.pending())
+
+    if not latencies:
+        return
+
+    print 'bind to up latency: p50=%.3fs p90=%.3fs p99=%.3fs max=%.3fs' % (
+        percentile(latencies, 0.5), percentile(latencies, 0.9), percentile(latencies, 0.99), latencies[-1])
+
+    elapsed = watcher.last_up - watcher.first_bind
+
+    if elapsed > 0:
+        print 'sustained: %.1f ports/s' % (len(latencies) / elapsed)
+
+
+def getargs():
+    parser = argparse.ArgumentParser(description='Generate, record and replay Gluon port churn')
+    parser.add_argument('-H', '--host-name', help='etcd hostname or ip, default to localhost', dest='etcd_host',
+                        default='localhost')
+    parser.add_argument('-p', '--port', help='etcd port number, default to 2379', dest='etcd_port', type=int,
+                        default=2379)
+    subparsers = parser.add_subparsers(dest='command')
+
+    generate = subparsers.add_parser('generate', help='generate a synthetic trace')
+    generate.add_argument('--ports', type=int, default=1000, help='number of ports, default to 1000')
+    generate.add_argument('--rate', type=float, default=50, help='new ports per second, default to 50')
+    generate.add_argument('--lifetime', type=float, default=60, help='mean seconds a port is bound, default to 60')
+    generate.add_argument('--vpns', type=int, default=10, help='number of VPNs, default to 10')
+    generate.add_argument('--unbind-fraction', type=float, default=0.5, dest='unbind_fraction',
+                          help='fraction of the ports unbound before being deleted, default to 0.5')
+    generate.add_argument('--bind-delay', type=float, default=0.02, dest='bind_delay',
+                          help='seconds between the creation of a port and its bind, default to 0.02')
+    generate.add_argument('--seed', type=int, help='random seed, for reproducible traces')
+    generate.add_argument('-o', '--output', help='trace file, default to stdout')
+
+    record = subparsers.add_parser('record', help='record the Proton writes of a live Gluon')
+    record.add_argument('--duration', type=float, default=600, help='seconds to record, default to 600')
+    record.add_argument('-o', '--output', help='trace file, default to stdout')
+
+    replay_parser = subparsers.add_parser('replay', help='replay a trace and time the binds')
+    replay_parser.add_argument('trace', help='trace file')
+    replay_parser.add_argument('--speed', type=float, default=1.0,
+                               help='replay speed relative to the trace, 0 for as fast as possible, default to 1')
+    replay_parser.add_argument('--drain', type=float, default=60,
+                               help='seconds to wait for the pending binds after the replay, default to 60')
+    replay_parser.add_argument('--run-shim', action='store_true', dest='run_shim',
+                               help='run the shim in-process against a mock VSD')
+    replay_parser.add_argument('--shims', type=int, default=0,
+                               help='run this number of shim processes sharing the ports, against mock VSDs')
+    replay_parser.add_argument('--workers', type=int, default=4,
+                               help='workers of each shim with --run-shim or --shims, default to 4')
+    replay_parser.add_argument('--vsd-latency', type=float, default=0.01, dest='vsd_latency',
+                               help='seconds per mock VSD request with --run-shim or --shims, default to 0.01')
+    replay_parser.add_argument('--warm-pool-size', dest='warm_pool_size',
+                               help='vports provisioned ahead by the shim of --run-shim, default to none')
+
+    shim_parser = subparsers.add_parser('shim', help='run a shim against a mock VSD')
+    shim_parser.add_argument('--workers', type=int, default=4, help='shim workers, default to 4')
+    shim_parser.add_argument('--vsd-latency', type=float, default=0.01, dest='vsd_latency',
+                             help='seconds per mock VSD request, default to 0.01')
+    shim_parser.add_argument('--instance-id', dest='instance_id', help='share the ports with the other instances')
+    shim_parser.add_argument('--ha', action='store_true', help='active/standby mode')
+    shim_parser.add_argument('--leader-ttl', dest='leader_ttl', help='seconds of the leader lock')
+
+    failover = subparsers.add_parser('failover', help='time the takeover of an active/standby pair of shims')
+    failover.add_argument('--leader-ttl', type=int, default=6, dest='leader_ttl',
+                          help='seconds of the leader lock, default to 6')
+    failover.add_argument('--ports', type=int, default=20, help='ports bound before and after the failover, '
+                          'default to 20')
+    failover.add_argument('--graceful', action='store_true', help='interrupt the leader instead of killing it')
+    failover.add_argument('--workers', type=int, default=4, help='workers of each shim, default to 4')
+    failover.add_argument('--vsd-latency', type=float, default=0.01, dest='vsd_latency',
+                          help='seconds per mock VSD request, default to 0.01')
+
+    return parser.parse_args()
+
+
+def main():
+    args = getargs()
+    client = etcd.Client(host=args.etcd_host, port=args.etcd_port)
+
+    if args.command in ('generate', 'record'):
+        if args.command == 'generate':
+            operations = generate_trace(args.ports, args.rate, args.lifetime, args.vpns, args.unbind_fraction, args.seed,
+                                        args.bind_delay)
+
+        else:
+            operations = record_trace(client, args.duration)
+
+        if args.output:
+            with open(args.output, 'w') as output:
+                save_trace(operations, output)
+
+        else:
+            save_trace(operations, sys.stdout)
+
+        return
+
+    if args.command == 'failover':
+        measure_failover(client, args.etcd_host, args.etcd_port, args.workers, args.vsd_latency, args.leader_ttl,
+                         args.ports, args.graceful)
+        return
+
+    if args.command == 'shim':
+        shim_args = ['--instance-id', args.instance_id] if args.instance_id else []
+
+        if args.ha:
+            shim_args.append('--ha')
+
+        if args.leader_ttl:
+            shim_args += ['--leader-ttl', args.leader_ttl]
+
+        run_shim(args.etcd_host, args.etcd_port, args.workers, args.vsd_latency, shim_args, foreground=True)
+        return
+
+    operations = load_trace(args.trace)
+    processes = []
+    shim_args = ['--warm-pool-size', args.warm_pool_size] if args.warm_pool_size else []
+
+    if args.run_shim:
+        run_shim(args.etcd_host, args.etcd_port, args.workers, args.vsd_latency, shim_args)
+
+    if args.shims:
+        processes = start_shims(args.shims, args.etcd_host, args.etcd_port, args.workers, args.vsd_latency)
+
+    if args.run_shim or args.shims:
+        # let the shims load the tables and start watching
+        time.sleep(2)
+
+    watch_client = etcd.Client(host=args.etcd_host, port=args.etcd_port, read_timeout=3600)
+    watcher = StatusWatcher(watch_client, client.read('/').etcd_index + 1)
+    watcher.start()
+
+    replay_time = replay(client, operations, args.speed, watcher)
+
+    deadline = time.time() + args.drain
+
+    while watcher.pending() and time.time() < deadline:
+        time.sleep(0.5)
+
+    report(watcher, operations, replay_time, args.drain)
+    stop_shims(processes)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
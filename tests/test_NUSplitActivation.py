@@ -1,8 +1,128 @@
 from unittest import TestCase
 
 from nuage.vm_split_activation import NUSplitActivation
+from nuage.vsd_cache import VSDObjectCache
+from tests.fakes import FakeVSD, install_fake_vsd, port_config
 
 
 class TestNUSplitActivation(TestCase):
+    def find(self, vsd, kind):
+        return [obj for obj in vsd.objects.values() if obj.__class__.__name__ == kind]
+
     def test_activate(self):
-        self.fail()
\ No newline at end of file
+        vsd = FakeVSD()
+
+        with install_fake_vsd(vsd):
+            self.assertTrue(NUSplitActivation(port_config(1, 0), vsd).activate())
+
+        domain, = self.find(vsd, 'NUDomain')
+        subnet, = self.find(vsd, 'NUSubnet')
+        vport, = self.find(vsd, 'NUVPort')
+        vm, = self.find(vsd, 'NUVM')
+        interface, = self.find(vsd, 'NUVMInterface')
+
+        self.assertEqual(('vpn-1', '100:1', '100:1'), (domain.name, domain.route_distinguisher, domain.route_target))
+        self.assertEqual(('10.1.0.0', '255.255.255.0'), (subnet.address, subnet.netmask))
+        self.assertIn(domain, vsd.ancestors(subnet))
+        self.assertEqual(('port-1-0', subnet), (vport.name, vport.parent))
+        self.assertEqual(('vm-1-0', 'vm-1-0'), (vm.name, vm.uuid))
+        self.assertEqual((vport.id, '10.1.0.2'), (interface.vport_id, interface.ip_address))
+
+    def test_activate_twice(self):
+        vsd = FakeVSD()
+
+        with install_fake_vsd(vsd):
+            self.assertTrue(NUSplitActivation(port_config(1, 0), vsd).activate())
+            self.assertTrue(NUSplitActivation(port_config(1, 0), vsd).activate())
+
+        self.assertEqual((1, 1), (vsd.count('NUVPort'), vsd.count('NUVM')))
+
+
+class TestLookupFilters(TestCase):
+    def test_domain_and_subnet_are_matched_by_vsd(self):
+        vsd = FakeVSD()
+
+        with install_fake_vsd(vsd):
+            self.assertTrue(NUSplitActivation(port_config(1, 0), vsd).activate())
+            vsd.filters = []
+            self.assertTrue(NUSplitActivation(port_config(1, 2), vsd).activate())
+
+        self.assertIn('routeDistinguisher == "100:1" and routeTarget == "100:1"', vsd.filters)
+        self.assertIn('address == "10.1.0.0" and netmask == "255.255.255.0"', vsd.filters)
+        # found, not created again
+        self.assertEqual((1, 1), (vsd.count('NUDomain'), vsd.count('NUSubnet')))
+
+
+class TestActivateMany(TestCase):
+    def setUp(self):
+        self.vsd = FakeVSD()
+        self.cache = VSDObjectCache()
+        # 2 VPNs of 4 ports, in 2 subnets each
+        self.ports = [port_config(vpn, port) for vpn in range(2) for port in range(4)]
+
+    def activate_many(self, ports):
+        with install_fake_vsd(self.vsd):
+            return NUSplitActivation(port_config(0, 0), self.vsd, self.cache).activate_many(ports)
+
+    def deactivate_many(self, ports):
+        with install_fake_vsd(self.vsd):
+            return NUSplitActivation(port_config(0, 0), self.vsd, self.cache).deactivate_many(ports)
+
+    def fail_create(self, name):
+        create = self.vsd.create
+
+        def failing_create(parent, child):
+            if child.name == name:
+                raise Exception('create of %s failed' % name)
+
+            create(parent, child)
+
+        self.vsd.create = failing_create
+
+    def test_ports_are_activated_per_domain_and_subnet(self):
+        results = self.activate_many(self.ports)
+
+        self.assertEqual(dict((port['vport_name'], True) for port in self.ports), results)
+        self.assertEqual((2, 4, 8, 8), (self.vsd.count('NUDomain'), self.vsd.count('NUSubnet'),
+                                        self.vsd.count('NUVPort'), self.vsd.count('NUVM')))
+
+        # activated again, only the vports and the VMs of each subnet are fetched, at once
+        self.vsd.requests = 0
+        self.assertTrue(all(self.activate_many(self.ports).values()))
+        self.assertEqual(4 * 2, self.vsd.requests)
+        # the fetched vports and VMs are not committed to the fetchers of the cached subnets
+        self.assertEqual(0, self.vsd.commits)
+
+    def test_failed_port_does_not_fail_its_subnet(self):
+        self.fail_create('vm-0-1')
+
+        results = self.activate_many(self.ports)
+
+        self.assertEqual(['port-0-1'], [name for name, result in results.items() if not result])
+        # port-0-3 is in the subnet of port-0-1
+        self.assertTrue(results['port-0-3'])
+        self.assertEqual(7, self.vsd.count('NUVM'))
+
+    def test_ports_are_deactivated(self):
+        self.activate_many(self.ports)
+        self.vsd.requests = 0
+
+        results = self.deactivate_many(self.ports[:3])
+
+        self.assertEqual({'port-0-0': True, 'port-0-1': True, 'port-0-2': True}, results)
+        self.assertEqual((5, 5), (self.vsd.count('NUVPort'), self.vsd.count('NUVM')))
+        # the VMs at once, then the interfaces of each VM, the VM and its vport
+        self.assertEqual(1 + 3 * 3, self.vsd.requests)
+
+    def test_failed_port_does_not_fail_the_deactivation_of_the_others(self):
+        self.activate_many(self.ports)
+        vm = self.vsd.user.vms.get_first('UUID == "vm-0-1"')
+        vm.delete = lambda: self.fail_delete()
+
+        results = self.deactivate_many(self.ports[:3])
+
+        self.assertEqual({'port-0-0': True, 'port-0-1': False, 'port-0-2': True}, results)
+        self.assertEqual(6, self.vsd.count('NUVM'))
+
+    def fail_delete(self):
+        raise Exception('delete failed')
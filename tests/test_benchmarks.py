@@ -0,0 +1,125 @@
+"""
+Microbenchmarks of the shim hot path, run against the in-process etcd and VSD fakes.
+
+Requires pytest-benchmark, the tests are skipped without it:
+
+    pytest tests/test_benchmarks.py --benchmark-only
+    pytest tests/test_benchmarks.py --benchmark-autosave --benchmark-compare
+"""
+
+import logging
+import threading
+
+import pytest
+
+from nuage import nuage_gluon_shim as shim
+from nuage.port_event import decode_event
+from nuage.vsd_cache import VSDObjectCache
+from tests.fakes import FakeEtcdClient, FakeSessionManager, FakeVSD, PortChurn, install_fake_vsd, proton_dir
+
+pytest.importorskip('pytest_benchmark')
+
+rounds = 200
+
+
+@pytest.fixture
+def quiet():
+    """the shim logs every message, keep the logging cost out of the measurements"""
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def shim_env(monkeypatch, quiet):
+    client = FakeEtcdClient()
+    vsd = FakeVSD()
+
+    monkeypatch.setattr(shim, 'client', client)
+    monkeypatch.setattr(shim, 'vsd_sessions', FakeSessionManager(vsd))
+    monkeypatch.setattr(shim, 'vsd_cache', VSDObjectCache())
+    monkeypatch.setattr(shim, 'vsd_calls', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(shim, 'vpn_mirror', None)
+    monkeypatch.setattr(shim, 'vm_status', {})
+
+    with install_fake_vsd(vsd):
+        yield client, vsd
+
+
+def test_compute_netmask(benchmark, quiet):
+    assert benchmark(shim.compute_netmask, '24') == '255.255.255.0'
+
+
+def test_compute_network_addr(benchmark):
+    assert benchmark(shim.compute_network_addr, '10.1.2.3', '24') == '10.1.2.0'
+
+
+def test_get_vpn_info(benchmark, shim_env):
+    client, vsd = shim_env
+    uuid = PortChurn(client).new_port()
+
+    assert benchmark(shim.get_vpn_info, client, uuid)['route_target'] == '100:1'
+
+
+def test_decode_event(benchmark, shim_env):
+    client, vsd = shim_env
+    churn = PortChurn(client)
+    message = churn.bind_message(churn.new_port())
+
+    assert benchmark(decode_event, message).value['host_id'] == 'cbserver5'
+
+
+def test_decode_event_unmonitored_table(benchmark, shim_env):
+    client, vsd = shim_env
+    churn = PortChurn(client)
+    uuid = churn.new_port()
+    message = client.event('set', '%s/VPNPort/%s' % (proton_dir, uuid), client.get('%s/VPNPort/%s' % (
+        proton_dir, uuid)).value)
+
+    assert benchmark(decode_event, message) is None
+
+
+def test_process_base_port_model_unknown_host(benchmark, shim_env):
+    client, vsd = shim_env
+    churn = PortChurn(client)
+    uuid = churn.new_port()
+    event = churn.bind(uuid, 'unknown-host')
+
+    benchmark(shim.process_base_port_model, event)
+
+    assert vsd.requests == 0
+
+
+def test_bind_throughput(benchmark, shim_env):
+    client, vsd = shim_env
+    churn = PortChurn(client)
+
+    def setup():
+        # the fake VSD scans all its objects on each request, remove the VM and the vport of the previous round so
+        # that every round binds against the same VSD
+        for obj in vsd.objects.values():
+            if obj.__class__.__name__ in ('NUVM', 'NUVPort') and obj.id in vsd.objects:
+                obj.delete()
+
+        return (churn.bind(churn.new_port()),), {}
+
+    benchmark.pedantic(shim.process_message, setup=setup, rounds=rounds)
+
+    assert (vsd.count('NUVM'), vsd.count('NUVPort')) == (1, 1)
+    assert shim.vm_status.values() == ['up'] * churn.ports
+
+
+def test_unbind_throughput(benchmark, shim_env):
+    client, vsd = shim_env
+    churn = PortChurn(client)
+
+    def setup():
+        uuid = churn.new_port()
+        shim.process_message(churn.bind(uuid))
+
+        return (churn.delete(uuid),), {}
+
+    benchmark.pedantic(shim.process_message, setup=setup, rounds=rounds)
+
+    assert vsd.count('NUVPort') == 0
+    assert shim.vm_status == {}
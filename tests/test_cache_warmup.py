@@ -0,0 +1,47 @@
+import unittest
+
+from nuage.cache_warmup import CacheWarmup
+from nuage.vm_split_activation import NUSplitActivation
+from nuage.vsd_cache import VSDObjectCache
+from tests.fakes import FakeSessionManager, FakeVSD, install_fake_vsd, port_config
+
+
+class TestCacheWarmup(unittest.TestCase):
+    def setUp(self):
+        self.vsd = FakeVSD()
+        self.sessions = FakeSessionManager(self.vsd)
+
+        with install_fake_vsd(self.vsd):
+            for vpn in range(3):
+                for port in range(2):
+                    NUSplitActivation(port_config(vpn, port), self.vsd).activate()
+
+    def activate_requests(self, cache):
+        """return the number of VSD requests of the activation of a new port in an existing subnet"""
+        self.vsd.requests = 0
+
+        with install_fake_vsd(self.vsd):
+            self.assertTrue(NUSplitActivation(port_config(1, 4), self.vsd, cache).activate())
+
+        return self.vsd.requests
+
+    def test_activation_after_warmup_only_creates_the_port(self):
+        cache = VSDObjectCache()
+        warmup = CacheWarmup(cache, lambda: self.sessions.session(None, None, None, None), concurrency=2)
+
+        # the enterprise, its template, 3 domains with a zone of 2 subnets each
+        self.assertEqual(1 + 1 + 3 * (1 + 1 + 2), warmup.run('Gluon'))
+        self.assertEqual(0, warmup.failures)
+
+        # vport and VM, looked up and created
+        self.assertEqual(4, self.activate_requests(cache))
+        self.assertTrue(self.activate_requests(VSDObjectCache()) > 4)
+
+    def test_unknown_enterprise(self):
+        warmup = CacheWarmup(VSDObjectCache(), lambda: self.sessions.session(None, None, None, None))
+
+        self.assertEqual(0, warmup.run('Other'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from nuage.coalescer import CoalescingQueue
+from nuage.nuage_gluon_shim import coalesce_events
+from nuage.port_event import PortEvent
+
+
+def port_event(action, host_id, prev_host_id=None):
+    prev_value = None
+
+    if prev_host_id is not None:
+        prev_value = {'host_id': prev_host_id}
+
+    return PortEvent('ProtonBasePort', 'net-l3vpn', '4d3b364c-f871-407a-8426-0eaed602862f', action, 1,
+                     {'host_id': host_id}, prev_value)
+
+
+class TestCoalescingQueue(unittest.TestCase):
+    def test_without_merge_items_are_kept(self):
+        q = CoalescingQueue()
+        q.put('a', 1)
+        q.put('a', 2)
+
+        self.assertEqual(2, q.qsize())
+        self.assertEqual([1, 2], [q.get(), q.get()])
+
+    def test_merged_item_keeps_its_place(self):
+        q = CoalescingQueue(lambda waiting, new: new)
+        q.put('a', 1)
+        q.put('b', 2)
+        q.put('a', 3)
+
+        self.assertEqual(1, q.merged)
+        self.assertEqual([3, 2], [q.get(), q.get()])
+
+    def test_items_are_not_merged_once_taken(self):
+        q = CoalescingQueue(lambda waiting, new: new)
+        q.put('a', 1)
+        self.assertEqual(1, q.get())
+        q.put('a', 2)
+
+        self.assertEqual(0, q.merged)
+        self.assertEqual(2, q.get())
+
+    def test_unmergeable_items_stay_in_order(self):
+        q = CoalescingQueue(lambda waiting, new: None)
+        q.put('a', 1)
+        q.put('a', 2)
+
+        self.assertEqual([1, 2], [q.get(), q.get()])
+
+
+class TestCoalesceEvents(unittest.TestCase):
+    def test_updates_are_merged(self):
+        merged = coalesce_events(port_event('set', ''), port_event('update', 'cbserver5', ''))
+
+        self.assertEqual('cbserver5', merged.value['host_id'])
+        self.assertIsNone(merged.prev_value)
+
+    def test_merged_event_keeps_the_first_previous_value(self):
+        merged = coalesce_events(port_event('update', 'cbserver5', 'node-1'), port_event('update', '', 'cbserver5'))
+
+        self.assertEqual('node-1', merged.prev_value['host_id'])
+
+    def test_deletes_are_not_merged(self):
+        self.assertIsNone(coalesce_events(port_event('delete', 'cbserver5'), port_event('set', 'cbserver5')))
+        self.assertIsNone(coalesce_events(port_event('set', 'cbserver5'), port_event('delete', 'cbserver5')))
+
+    def test_retry_does_not_replace_a_waiting_event(self):
+        retry = port_event('update', 'cbserver5')
+        retry.attempt = 1
+
+        self.assertIsNone(coalesce_events(port_event('update', 'cbserver5'), retry))
+        self.assertEqual(0, coalesce_events(retry, port_event('update', 'cbserver5')).attempt)
+
+    def test_unbind_is_not_merged_away(self):
+        self.assertIsNone(coalesce_events(port_event('update', '', 'cbserver5'), port_event('update', 'cbserver5', '')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+
+import etcd
+
+from nuage import etcd_pool
+from nuage.etcd_pool import EtcdClientPool, parse_hosts
+
+down = set()
+
+
+class FakeClient(object):
+    def __init__(self, host, port, read_timeout, per_host_pool_size):
+        self.member = (host, port)
+        self.read_timeout = read_timeout
+        self.requests = 0
+
+    def get(self, key):
+        self.requests += 1
+
+        if self.member in down:
+            raise etcd.EtcdConnectionFailed('Connection to etcd failed')
+
+        return self.member
+
+    def read(self, key, wait=False, **kwargs):
+        if wait and self.member not in down:
+            raise etcd.EtcdWatchTimedOut('Watch timed out')
+
+        return self.get(key)
+
+
+class TestEtcdClientPool(unittest.TestCase):
+    def setUp(self):
+        self.orig_client = etcd_pool.etcd.Client
+        etcd_pool.etcd.Client = FakeClient
+        down.clear()
+
+    def tearDown(self):
+        etcd_pool.etcd.Client = self.orig_client
+
+    def test_parse_hosts(self):
+        self.assertEqual([('localhost', 2379)], parse_hosts('localhost'))
+        self.assertEqual([('etcd-1', 4001), ('etcd-2', 2379)], parse_hosts('etcd-1, etcd-2:2379', 4001))
+        self.assertRaises(ValueError, parse_hosts, ',')
+
+    def test_client_is_kept_alive(self):
+        pool = EtcdClientPool([('etcd-1', 2379)], 2)
+
+        with pool.client() as first:
+            pass
+
+        with pool.client() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(1, pool.created)
+        self.assertEqual(0, pool.in_use())
+
+    def test_watch_has_its_own_client(self):
+        pool = EtcdClientPool([('etcd-1', 2379)], 1, read_timeout=10, watch_timeout=3600)
+
+        self.assertRaises(etcd.EtcdWatchTimedOut, pool.watch, '/proton', recursive=True)
+        self.assertEqual(3600, pool._watch.client.read_timeout)
+        self.assertEqual(0, pool.created)
+
+    def test_fail_over_to_next_member(self):
+        pool = EtcdClientPool([('etcd-1', 2379), ('etcd-2', 2379)], 2)
+        self.assertEqual(('etcd-1', 2379), pool.get('/key'))
+
+        down.add(('etcd-1', 2379))
+        self.assertEqual(('etcd-2', 2379), pool.get('/key'))
+        self.assertEqual(('etcd-2', 2379), pool.get_member())
+        self.assertEqual(1, pool.failovers)
+        self.assertEqual(1, pool.created)
+
+    def test_all_members_down(self):
+        pool = EtcdClientPool([('etcd-1', 2379), ('etcd-2', 2379)], 2)
+        down.update(pool.members)
+
+        self.assertRaises(etcd.EtcdConnectionFailed, pool.get, '/key')
+        self.assertRaises(etcd.EtcdConnectionFailed, pool.watch, '/proton')
+        self.assertEqual(0, pool.in_use())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nuage.host_registry import HostDirWatcher, HostFileWatcher, HostRegistry, read_hosts_file
+from tests.fakes import FakeEtcdClient
+
+hosts_key = '/controller/nuage-hosts'
+
+
+class TestHostRegistry(unittest.TestCase):
+    def setUp(self):
+        self.changes = []
+        self.registry = HostRegistry(('cbserver5',))
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def on_change(self, added, removed):
+        self.changes.append((added, removed))
+
+    def test_update(self):
+        added, removed = self.registry.update(['node-1', 'node-2'])
+
+        self.assertEqual((set(['node-1', 'node-2']), set(['cbserver5'])), (added, removed))
+        self.assertIn('node-1', self.registry)
+        self.assertNotIn('cbserver5', self.registry)
+
+    def test_read_hosts_file(self):
+        path = os.path.join(self.dir, 'hosts')
+
+        with open(path, 'w') as f:
+            f.write('# compute nodes\ncbserver5\n\n  node-1  # rack 2\n')
+
+        self.assertEqual(set(['cbserver5', 'node-1']), read_hosts_file(path))
+
+    def test_file_is_reloaded_when_it_changes(self):
+        path = os.path.join(self.dir, 'hosts')
+
+        with open(path, 'w') as f:
+            f.write('cbserver5\n')
+
+        watcher = HostFileWatcher(self.registry, path, self.on_change)
+        watcher.load()
+        self.assertEqual([], self.changes)
+
+        with open(path, 'a') as f:
+            f.write('node-1\n')
+
+        os.utime(path, (0, 0))
+        watcher.load()
+        watcher.load()
+
+        self.assertEqual([(set(['node-1']), set())], self.changes)
+
+    def test_etcd_directory(self):
+        client = FakeEtcdClient()
+        watcher = HostDirWatcher(self.registry, client, hosts_key, self.on_change)
+
+        watcher.load()
+        self.assertIn('cbserver5', self.registry)
+
+        client.write(hosts_key + '/node-1', '')
+        watcher.load()
+
+        self.assertEqual([(set(['node-1']), set(['cbserver5']))], self.changes)
+        self.assertEqual(client.etcd_index, watcher.etcd_index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+from nuage import instrumentation
+from nuage.instrumentation import ActivationTrace, CallbackSink, MetricsSink
+from nuage.metrics import MetricsRegistry
+from nuage.vm_split_activation import NUSplitActivation
+from tests.fakes import FakeVSD, install_fake_vsd, port_config
+
+
+class FakeFetcher(object):
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_first(self, filter=None):
+        return self.objects[0] if self.objects else None
+
+    def get(self, filter=None):
+        return self.objects
+
+
+class FakeVM(object):
+    def __init__(self):
+        self.vm_interfaces = FakeFetcher([])
+
+
+class FakeUser(object):
+    def __init__(self):
+        self.vms = FakeFetcher([FakeVM()])
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.user = FakeUser()
+
+
+class TestActivationTrace(unittest.TestCase):
+    def test_requests_are_counted_per_step(self):
+        trace = ActivationTrace('activate', 'port-1')
+
+        with trace.step('domain'):
+            trace.record_call('domain', 'get', 0.1, False)
+            trace.record_call('domain', 'create', 0.2, False)
+
+        with trace.step('vm'):
+            trace.record_call('vm', 'get', 0.1, True)
+
+        trace.finish(True)
+
+        self.assertEqual(['domain', 'vm'], [name for name, seconds, calls in trace.get_step_totals()])
+        self.assertEqual([2, 1], [calls for name, seconds, calls in trace.get_step_totals()])
+
+    def test_metrics_sink(self):
+        registry = MetricsRegistry()
+        trace = ActivationTrace('activate', 'port-1')
+
+        with trace.step('vport'):
+            trace.record_call('vport', 'create', 0.3, False)
+
+        trace.finish(True)
+        MetricsSink(registry).emit(trace)
+        output = registry.render()
+
+        self.assertIn('nuage_shim_vsd_requests_total{object_type="vport",operation="create",result="ok"} 1.0', output)
+        self.assertIn('nuage_shim_activation_step_duration_seconds_count{activation="activate",step="vport"} 1.0',
+                      output)
+
+
+class TestActivationInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.traces = []
+        self.sink = instrumentation.add_sink(CallbackSink(self.traces.append))
+
+    def tearDown(self):
+        if self.sink in instrumentation.sinks:
+            instrumentation.remove_sink(self.sink)
+
+    def test_deactivate_is_traced(self):
+        sa = NUSplitActivation({'vm_uuid': 'vm-1', 'vport_name': 'port-1'}, FakeSession())
+        sa.deactivate()
+
+        self.assertEqual(1, len(self.traces))
+        self.assertEqual(('deactivate', 'port-1', True), (self.traces[0].name, self.traces[0].port,
+                                                          self.traces[0].succeeded))
+        self.assertEqual([('vm', 'vm', 'get'), ('vm', 'vm_interface', 'get')],
+                         [call[:3] for call in self.traces[0].calls])
+
+    def test_activate_many_records_the_ports_in_its_trace(self):
+        vsd = FakeVSD()
+
+        with install_fake_vsd(vsd):
+            sa = NUSplitActivation(port_config(0, 0), vsd)
+            sa.activate_many([port_config(0, port) for port in range(2)])
+            sa.activate_many([port_config(1, port) for port in range(3)])
+
+        self.assertEqual(['activate_many', 'activate_many'], [trace.name for trace in self.traces])
+        self.assertEqual([2, 3], [[call[:3] for call in trace.calls].count(('vm', 'vm', 'create'))
+                                  for trace in self.traces])
+        self.assertEqual([2, 3], [[call[:3] for call in trace.calls].count(('vport', 'vport', 'create'))
+                                  for trace in self.traces])
+
+    def test_nothing_is_traced_without_sinks(self):
+        instrumentation.remove_sink(self.sink)
+
+        self.assertIsNone(instrumentation.start_trace('activate'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import unittest
+
+from nuage.leader import LeaderLock
+from tests.fakes import FakeEtcdClient
+
+leader_key = '/controller/nuage-leader'
+
+
+class TestLeaderLock(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeEtcdClient()
+        self.index = 10
+        self.lost = []
+        self.lock = LeaderLock(self.client, leader_key, 'shim-a', get_index=lambda: self.index,
+                               on_lost=lambda: self.lost.append(True))
+
+    def test_acquire_free_lock(self):
+        self.lock.acquire()
+
+        self.assertTrue(self.lock.is_leader())
+        self.assertEqual({'leader': 'shim-a', 'etcd_index': 10}, json.loads(self.client.get(leader_key).value))
+
+    def test_refresh_publishes_the_committed_index(self):
+        self.lock.acquire()
+        self.index = 42
+
+        self.assertTrue(self.lock.refresh())
+        self.assertEqual(42, json.loads(self.client.get(leader_key).value)['etcd_index'])
+        self.assertEqual(42, self.lock.leader_index)
+
+    def test_lock_taken_over(self):
+        self.lock.acquire()
+        self.client.write(leader_key, json.dumps({'leader': 'shim-b', 'etcd_index': 50}))
+
+        self.assertFalse(self.lock.refresh())
+        self.assertFalse(self.lock.is_leader())
+        self.assertEqual([True], self.lost)
+
+    def test_release(self):
+        self.lock.acquire()
+        self.index = 43
+        self.lock.release()
+
+        self.assertNotIn(leader_key, self.client.nodes)
+        self.assertFalse(self.lock.is_leader())
+
+    def test_standby_reads_the_leader_index(self):
+        self.lock._observe(json.dumps({'leader': 'shim-b', 'etcd_index': 50}))
+
+        self.assertEqual(('shim-b', 50), (self.lock.leader, self.lock.leader_index))
+        self.assertFalse(self.lock.is_leader())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nuage.local_state import ProgressTracker, load_state, save_state
+
+
+class TestProgressTracker(unittest.TestCase):
+    def test_committed_index_waits_for_the_oldest_pending_event(self):
+        progress = ProgressTracker(10)
+        progress.add(11, 'a')
+        progress.add(12, 'b')
+        progress.add(13, 'c')
+
+        self.assertEqual(10, progress.committed())
+
+        progress.done(12, 'b')
+        self.assertEqual(10, progress.committed())
+        self.assertEqual(set(['a', 'c']), progress.get_pending_keys())
+        self.assertEqual((True, False), (progress.has_pending('a'), progress.has_pending('b')))
+
+        progress.done(11, 'a')
+        self.assertEqual(12, progress.committed())
+
+        progress.done(13, 'c')
+        self.assertEqual(13, progress.committed())
+
+    def test_advance_without_pending_events(self):
+        progress = ProgressTracker(10)
+        progress.advance(20)
+
+        self.assertEqual(20, progress.committed())
+
+
+class TestStateSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        ports = {'a': ('/net-l3vpn/proton/ProtonBasePort/a', 5, '{"host_id": "cbserver5"}'),
+                 'b': ('/net-l3vpn/proton/ProtonBasePort/b', 12, '{"host_id": ""}'),
+                 'c': ('/net-l3vpn/proton/ProtonBasePort/c', 8, '{"host_id": "cbserver5"}')}
+        tables = {'VPNPort': {'a': {'vpn_instance': 'vpn-1'}}, 'VpnInstance': {}, 'VpnAfConfig': {}}
+
+        save_state(self.path, 10, {'a': 'up', 'c': 'up'}, ports, tables, pending=set(['c']))
+        state = load_state(self.path)
+
+        self.assertEqual(10, state['etcd_index'])
+        self.assertEqual({'a': 'up', 'c': 'up'}, state['vm_status'])
+        self.assertEqual(tables, state['vpn_tables'])
+        self.assertEqual(5, state['ports']['a'][1])
+        # modified after the committed index and still pending
+        self.assertEqual(0, state['ports']['b'][1])
+        self.assertEqual(0, state['ports']['c'][1])
+        self.assertEqual([], [name for name in os.listdir(self.directory) if name != 'state.json'])
+
+    def test_missing_or_corrupt_snapshot(self):
+        self.assertIsNone(load_state(self.path))
+
+        with open(self.path, 'w') as state_file:
+            state_file.write('{"version": 1, "etcd_in')
+
+        self.assertIsNone(load_state(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
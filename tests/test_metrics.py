@@ -0,0 +1,59 @@
+import unittest
+import urllib2
+
+from nuage.metrics import MetricsRegistry, start_http_server
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_with_labels(self):
+        events = self.registry.counter('events_total', 'events received', ('table', 'action'))
+        events.inc(table='ProtonBasePort', action='set')
+        events.inc(table='ProtonBasePort', action='set')
+        events.inc(table='VPNPort', action='delete')
+
+        self.assertEqual('# HELP events_total events received\n'
+                         '# TYPE events_total counter\n'
+                         'events_total{table="ProtonBasePort",action="set"} 2.0\n'
+                         'events_total{table="VPNPort",action="delete"} 1.0\n', self.registry.render())
+
+    def test_gauge_callback(self):
+        self.registry.gauge('queue_depth', 'waiting events', callback=lambda: 7)
+
+        self.assertIn('queue_depth 7.0\n', self.registry.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = self.registry.histogram('bind_seconds', 'bind latency', ('operation',), buckets=(0.1, 1))
+        latency.observe(0.05, operation='bind')
+        latency.observe(0.5, operation='bind')
+        latency.observe(3, operation='bind')
+
+        output = self.registry.render()
+
+        self.assertIn('bind_seconds_bucket{operation="bind",le="0.1"} 1.0\n', output)
+        self.assertIn('bind_seconds_bucket{operation="bind",le="1.0"} 2.0\n', output)
+        self.assertIn('bind_seconds_bucket{operation="bind",le="+Inf"} 3.0\n', output)
+        self.assertIn('bind_seconds_sum{operation="bind"} 3.55\n', output)
+        self.assertIn('bind_seconds_count{operation="bind"} 3.0\n', output)
+
+    def test_label_values_are_escaped(self):
+        self.registry.counter('errors_total', 'errors', ('message',)).inc(message='say "hi"')
+
+        self.assertIn('errors_total{message="say \\"hi\\""} 1.0\n', self.registry.render())
+
+    def test_http_server(self):
+        self.registry.gauge('up', 'shim is running', callback=lambda: 1)
+        server = start_http_server(self.registry, 0, '127.0.0.1')
+
+        try:
+            body = urllib2.urlopen('http://127.0.0.1:%d/metrics' % server.server_address[1]).read()
+            self.assertIn('up 1.0\n', body)
+
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
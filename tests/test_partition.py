@@ -0,0 +1,58 @@
+import unittest
+
+from nuage.partition import HashRing, Membership
+from tests.fakes import FakeEtcdClient
+
+members_key = '/controller/nuage-shims'
+uuids = ['port-%04d' % i for i in range(1000)]
+
+
+class TestHashRing(unittest.TestCase):
+    def test_empty_ring(self):
+        self.assertIsNone(HashRing().owner('port-0001'))
+
+    def test_ports_are_spread(self):
+        ring = HashRing(['shim-0', 'shim-1', 'shim-2'])
+        owned = {}
+
+        for uuid in uuids:
+            owned[ring.owner(uuid)] = owned.get(ring.owner(uuid), 0) + 1
+
+        self.assertEqual(set(['shim-0', 'shim-1', 'shim-2']), set(owned))
+        self.assertTrue(min(owned.values()) > 200, owned)
+
+    def test_only_the_ports_of_the_new_member_move(self):
+        before = HashRing(['shim-0', 'shim-1', 'shim-2'])
+        after = HashRing(['shim-0', 'shim-1', 'shim-2', 'shim-3'])
+        moved = [uuid for uuid in uuids if before.owner(uuid) != after.owner(uuid)]
+
+        self.assertTrue(moved)
+        self.assertEqual(set(['shim-3']), set(after.owner(uuid) for uuid in moved))
+
+
+class TestMembership(unittest.TestCase):
+    def test_members_join_and_leave(self):
+        client = FakeEtcdClient()
+        changes = []
+        membership = Membership(client, 'shim-0', members_key, on_change=lambda old, new: changes.append(new.members))
+
+        membership.join()
+        self.assertTrue(all(membership.owns(uuid) for uuid in uuids))
+
+        client.write(members_key + '/shim-1', 'shim-1')
+        membership.load()
+        membership.load()
+        self.assertFalse(all(membership.owns(uuid) for uuid in uuids))
+
+        client.delete(members_key + '/shim-1')
+        membership.load()
+
+        self.assertEqual([frozenset(['shim-0']), frozenset(['shim-0', 'shim-1']), frozenset(['shim-0'])], changes)
+        self.assertEqual(3, membership.rebalances)
+
+        membership.leave()
+        self.assertNotIn(members_key + '/shim-0', client.nodes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import json
+import unittest
+
+import etcd
+
+from nuage.port_event import PortEvent, decode_event
+
+port_key = '/net-l3vpn/proton/ProtonBasePort/4d3b364c-f871-407a-8426-0eaed602862f'
+
+
+class TestDecodeEvent(unittest.TestCase):
+    def test_values_are_decoded(self):
+        message = etcd.EtcdResult('update', node={'key': port_key, 'value': json.dumps({'host_id': 'cbserver5'}),
+                                                  'modifiedIndex': 12},
+                                  prevNode={'key': port_key, 'value': json.dumps({'host_id': ''})})
+        event = decode_event(message)
+
+        self.assertEqual(('ProtonBasePort', 'net-l3vpn', '4d3b364c-f871-407a-8426-0eaed602862f', 'update', 12),
+                         (event.table, event.proton_name, event.uuid, event.action, event.modified_index))
+        self.assertEqual({'host_id': 'cbserver5'}, event.value)
+        self.assertEqual({'host_id': ''}, event.prev_value)
+
+    def test_delete_has_only_the_previous_value(self):
+        message = etcd.EtcdResult('delete', node={'key': port_key, 'modifiedIndex': 13},
+                                  prevNode={'key': port_key, 'value': json.dumps({'id': 'port'})})
+        event = decode_event(message)
+
+        self.assertIsNone(event.value)
+        self.assertEqual({'id': 'port'}, event.prev_value)
+
+    def test_invalid_value(self):
+        event = decode_event(etcd.EtcdResult('set', node={'key': port_key, 'value': '{', 'modifiedIndex': 14}))
+
+        self.assertIsNone(event.value)
+        self.assertIsNone(event.prev_value)
+
+    def test_unmonitored_tables_are_dropped(self):
+        for key in ('/net-l3vpn/proton/VPNPort/4d3b364c', '/net-l3vpn/proton/ProtonBasePort'):
+            self.assertIsNone(decode_event(etcd.EtcdResult('set', node={'key': key, 'value': '{}'})))
+
+    def test_slots(self):
+        event = PortEvent('ProtonBasePort', 'net-l3vpn', 'uuid', 'set', 1, {})
+        self.assertRaises(AttributeError, setattr, event, 'key', port_key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+from nuage.reconciler import Reconciler, compute_drift, read_vsd_ports
+from tests.fakes import FakeVSD
+
+
+def add_port(vsd, subnet, uuid, vm_uuid=None):
+    vport = vsd.NUVPort(name=uuid, type='VM')
+    subnet.create_child(vport)
+
+    if vm_uuid is not None:
+        vsd.user.create_child(vsd.NUVM(name=vm_uuid, uuid=vm_uuid, interfaces=[
+            {'name': vm_uuid, 'VPortID': vport.id, 'MAC': '', 'IPAddress': ''}]))
+
+
+def add_subnet(vsd, domain_name):
+    domain = vsd.NUDomain(name=domain_name)
+    vsd.user.enterprises.get_first().create_child(domain)
+    zone = vsd.NUZone(name='Zone0')
+    domain.create_child(zone)
+    subnet = vsd.NUSubnet(name='Subnet0')
+    zone.create_child(subnet)
+
+    return subnet
+
+
+class TestReadVSDPorts(unittest.TestCase):
+    def test_vports_and_vms_of_every_domain_are_read_in_pages(self):
+        vsd = FakeVSD()
+        subnets = [add_subnet(vsd, 'vpn-1'), add_subnet(vsd, 'vpn-2')]
+
+        for i in range(7):
+            add_port(vsd, subnets[i % 2], 'port-%d' % i, 'vm-%d' % i if i != 3 else None)
+
+        subnets[0].create_child(vsd.NUVPort(name='bridge', type='BRIDGE'))
+        vsd.requests = 0
+
+        vports, attached = read_vsd_ports(vsd, 'Gluon', page_size=2)
+
+        self.assertEqual(set('port-%d' % i for i in range(7)), vports)
+        self.assertEqual(dict(('port-%d' % i, 'vm-%d' % i) for i in range(7) if i != 3), attached)
+        # the enterprise, then 2 domains, 4 vports and 4 VMs, 3 vports and 2 VMs, 2 per page until a short page
+        self.assertEqual(1 + 2 + (3 + 3) + (2 + 2), vsd.requests)
+
+    def test_unknown_enterprise_has_no_vports(self):
+        self.assertEqual((set(), {}), read_vsd_ports(FakeVSD(), 'Other'))
+
+
+class TestComputeDrift(unittest.TestCase):
+    def test_drift(self):
+        intent = {'bound': 'vm-1', 'no-vport': 'vm-2', 'no-vm': 'vm-3', 'other-vm': 'vm-4'}
+        assigned = set(intent) | set(['unmanaged'])
+        records = set(['bound', 'no-vport', 'lost'])
+        vports = set(['bound', 'no-vm', 'other-vm', 'unmanaged', 'deleted', 'deleted-detached'])
+        attached = {'bound': 'vm-1', 'other-vm': 'vm-9', 'unmanaged': 'vm-5', 'deleted': 'vm-6'}
+
+        drift = compute_drift(intent, assigned, records, vports, attached)
+
+        self.assertEqual(set(['no-vport']), drift.missing_vports)
+        self.assertEqual(set(['no-vm', 'other-vm']), drift.missing_vms)
+        self.assertEqual(set(['deleted']), drift.orphaned)
+        self.assertEqual(set(['deleted-detached']), drift.detached)
+        self.assertEqual(set(['lost']), drift.stale)
+        self.assertEqual(set(['no-vport', 'no-vm', 'other-vm', 'deleted', 'lost']), drift.get_ports())
+
+    def test_no_drift(self):
+        drift = compute_drift({'a': 'vm-a'}, set(['a']), set(['a']), set(['a']), {'a': 'vm-a'})
+
+        self.assertEqual(set(), drift.get_ports())
+        self.assertEqual([0] * 5, drift.counts().values())
+
+
+class TestReconciler(unittest.TestCase):
+    def test_drifted_ports_are_requeued_unless_busy(self):
+        requeued = []
+
+        reconciler = Reconciler(lambda: ({'a': 'vm-a', 'b': 'vm-b', 'c': 'vm-c'}, set(['a', 'b', 'c']), set(['a'])),
+                                lambda: (set(['a', 'old']), {'a': 'vm-a', 'old': 'vm-old'}),
+                                lambda: set(['c']),
+                                lambda uuid, vm_uuid: requeued.append((uuid, vm_uuid)))
+        reconciler.reconcile()
+
+        self.assertEqual([('b', None), ('old', 'vm-old')], sorted(requeued))
+        self.assertEqual(2, reconciler.drift['missing_vports'])
+        self.assertEqual(1, reconciler.drift['orphaned'])
+        self.assertEqual((1, 2), (reconciler.passes, reconciler.requeued))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import unittest
+
+import etcd
+
+from nuage.resync import ResyncEngine
+from nuage.vpn_mirror import VPNTableMirror
+
+proton_dir = '/net-l3vpn/proton'
+
+
+def port_node(uuid, host_id, modified_index):
+    return {'key': '%s/ProtonBasePort/%s' % (proton_dir, uuid), 'modifiedIndex': modified_index,
+            'value': json.dumps({'id': uuid, 'host_id': host_id, 'device_id': 'vm-' + uuid})}
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.ports = []
+        self.etcd_index = 0
+
+    def read(self, key, recursive=False):
+        result = etcd.EtcdResult(action='get', node={
+            'key': proton_dir, 'dir': True, 'nodes': [
+                {'key': proton_dir + '/ProtonBasePort', 'dir': True, 'nodes': self.ports}]})
+        result.etcd_index = self.etcd_index
+
+        return result
+
+
+class TestResyncEngine(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.ports = [port_node('a', 'cbserver5', 10), port_node('b', '', 11), port_node('c', '', 12)]
+        self.client.etcd_index = 12
+
+        self.engine = ResyncEngine(proton_dir, VPNTableMirror(proton_dir))
+        self.assertEqual(12, self.engine.load(self.client))
+
+    def test_nothing_changed(self):
+        etcd_index, events = self.engine.resync(self.client)
+
+        self.assertEqual(12, etcd_index)
+        self.assertEqual([], events)
+
+    def test_only_changed_ports_are_returned(self):
+        self.client.ports = [port_node('a', 'cbserver5', 10), port_node('b', 'cbserver5', 20),
+                             port_node('d', 'cbserver5', 21)]
+        self.client.etcd_index = 25
+
+        etcd_index, events = self.engine.resync(self.client)
+        events = dict((event.key.split('/')[-1], event) for event in events)
+
+        self.assertEqual(25, etcd_index)
+        self.assertEqual(['b', 'c', 'd'], sorted(events.keys()))
+
+        self.assertEqual('update', events['b'].action)
+        self.assertEqual('', json.loads(events['b']._prev_node.value)['host_id'])
+        self.assertEqual('cbserver5', json.loads(events['b'].value)['host_id'])
+
+        self.assertEqual('delete', events['c'].action)
+        self.assertEqual('c', json.loads(events['c'].value)['id'])
+
+        self.assertEqual('set', events['d'].action)
+        self.assertEqual(1, self.engine.resyncs)
+
+    def test_watch_events_update_the_known_ports(self):
+        event = etcd.EtcdResult('set', node=port_node('b', 'cbserver5', 20))
+        self.engine.observe(event)
+        self.client.ports = [port_node('a', 'cbserver5', 10), port_node('b', 'cbserver5', 20),
+                             port_node('c', '', 12)]
+
+        self.assertEqual([], self.engine.resync(self.client)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+import time
+import unittest
+
+from nuage.retry import RetryScheduler
+
+
+class TestRetryScheduler(unittest.TestCase):
+    def setUp(self):
+        self.fired = []
+        self.done = threading.Event()
+
+    def fire(self, item):
+        self.fired.append(item)
+
+        if len(self.fired) == 2:
+            self.done.set()
+
+    def test_retries_fire_in_due_order(self):
+        scheduler = RetryScheduler(self.fire, base_delay=0.01, jitter=0).start()
+        scheduler.schedule('port-a', 'a', 3)
+        scheduler.schedule('port-b', 'b', 1)
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(['b', 'a'], self.fired)
+        self.assertEqual(0, scheduler.depth())
+        self.assertEqual(2, scheduler.fired)
+
+    def test_cancelled_retry_does_not_fire(self):
+        scheduler = RetryScheduler(self.fire, base_delay=0.05, jitter=0).start()
+        scheduler.schedule('port-a', 'a', 1)
+        scheduler.schedule('port-b', 'b', 1)
+
+        self.assertTrue(scheduler.cancel('port-a'))
+        self.assertFalse(scheduler.cancel('port-a'))
+        self.assertEqual(set(['port-b']), scheduler.get_keys())
+
+        time.sleep(0.2)
+        self.assertEqual(['b'], self.fired)
+
+    def test_rescheduled_key_fires_once(self):
+        scheduler = RetryScheduler(self.fire, base_delay=0.01, jitter=0).start()
+        scheduler.schedule('port-a', 'first', 1)
+        scheduler.schedule('port-a', 'second', 2)
+
+        time.sleep(0.2)
+        self.assertEqual(['second'], self.fired)
+
+    def test_backoff_is_bounded(self):
+        scheduler = RetryScheduler(self.fire, base_delay=1, max_delay=60, jitter=0.5)
+
+        for attempt in range(1, 12):
+            ceiling = min(2 ** (attempt - 1), 60)
+            delay = scheduler.get_delay(attempt)
+
+            self.assertTrue(ceiling / 2.0 <= delay <= ceiling, (attempt, delay))
+
+    def test_attempts_over_the_budget_are_refused(self):
+        scheduler = RetryScheduler(self.fire, max_attempts=2)
+
+        self.assertIsNotNone(scheduler.schedule('port-a', 'a', 2))
+        self.assertIsNone(scheduler.schedule('port-a', 'a', 3))
+        self.assertEqual(1, scheduler.scheduled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from nuage.server import get_runtime
+
+try:
+    import gevent
+
+except ImportError:
+    gevent = None
+
+# run in a child process, the gevent patching cannot be undone
+gevent_smoke_test = '''
+import socket
+import threading
+
+from gevent import monkey
+
+from nuage import server
+
+shim = server.bootstrap(['-H', 'etcd-1', '--runtime', 'gevent', '-w', '256'])
+shim.initialize_runtime('gevent')
+
+assert monkey.is_module_patched('socket') and monkey.is_module_patched('ssl')
+assert monkey.is_module_patched('threading')
+assert type(shim.processed_lock).__module__.startswith('gevent'), type(shim.processed_lock)
+assert socket.socket.__module__.startswith('gevent'), socket.socket
+print 'ok'
+'''
+
+unpatched_test = '''
+from nuage import nuage_gluon_shim as shim
+
+shim.initialize_runtime('gevent')
+'''
+
+
+class TestServer(unittest.TestCase):
+    def run_python(self, source):
+        process = subprocess.Popen([sys.executable, '-c', source], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        output = process.communicate()[0]
+
+        return process.returncode, output
+
+    def test_get_runtime(self):
+        self.assertEqual('gevent', get_runtime(['-H', 'etcd-1', '--runtime', 'gevent']))
+        self.assertEqual('gevent', get_runtime(['--runtime=gevent', '-w', '256']))
+        self.assertEqual(None, get_runtime(['-H', 'etcd-1']))
+
+    @unittest.skipIf(gevent is None, 'gevent is not installed')
+    def test_gevent_runtime_is_set_up_before_the_shim_is_imported(self):
+        returncode, output = self.run_python(gevent_smoke_test)
+
+        self.assertEqual((0, 'ok'), (returncode, output.strip().splitlines()[-1]), output)
+
+    @unittest.skipIf(gevent is None, 'gevent is not installed')
+    def test_gevent_runtime_requires_the_entry_point(self):
+        returncode, output = self.run_python(unpatched_test)
+
+        self.assertEqual(1, returncode, output)
+        self.assertIn('set up by nuage-shim-server', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,514 @@
+import json
+import threading
+import time
+import unittest
+
+import etcd
+
+from nuage import nuage_gluon_shim as shim
+from nuage.coalescer import CoalescingQueue
+from nuage.local_state import ProgressTracker
+from nuage.partition import Membership
+from nuage.reconciler import Reconciler
+from nuage.resync import ResyncEngine
+from nuage.retry import RetryScheduler
+from nuage.status_writer import StatusWriter
+from nuage.vpn_mirror import VPNTableMirror
+from nuage.vsd_cache import VSDObjectCache
+from nuage.warm_pool import WarmPool
+from tests.fakes import FakeEtcdClient, FakeSessionManager, FakeVSD, PortChurn, install_fake_vsd, proton_dir
+
+patched_globals = ('client', 'worker_pool', 'vsd_sessions', 'vsd_cache', 'vpn_mirror', 'resync_engine', 'vsd_calls',
+                   'progress', 'status_writer', 'membership', 'retry_scheduler', 'warm_pool', 'vm_status',
+                   'bind_errors', 'queue_high_water', 'throttled', 'leader_lock', 'leadership_lost',
+                   'standby_watch_timeout')
+
+
+class ShimTestCase(unittest.TestCase):
+    """run the shim against the etcd and VSD fakes, the events are processed on demand from a single queue"""
+
+    def setUp(self):
+        self.saved = dict((name, getattr(shim, name)) for name in patched_globals)
+        self.client = FakeEtcdClient()
+        self.vsd = FakeVSD()
+        self.churn = PortChurn(self.client)
+        self.queue = CoalescingQueue(shim.coalesce_events)
+        self.vsd_down = False
+
+        create = self.vsd.create
+
+        def failing_create(parent, child):
+            if self.vsd_down:
+                raise Exception('VSD is down')
+
+            create(parent, child)
+
+        self.vsd.create = failing_create
+
+        shim.client = self.client
+        shim.worker_pool = self.queue
+        shim.vsd_sessions = FakeSessionManager(self.vsd)
+        shim.vsd_cache = VSDObjectCache()
+        shim.vpn_mirror = None
+        shim.resync_engine = ResyncEngine(proton_dir, None)
+        shim.vsd_calls = threading.BoundedSemaphore(1)
+        shim.progress = ProgressTracker()
+        shim.status_writer = None
+        shim.membership = None
+        shim.retry_scheduler = RetryScheduler(shim.fire_retry, max_attempts=2, base_delay=0, jitter=0)
+        shim.warm_pool = None
+        shim.vm_status = {}
+        shim.bind_errors = 0
+
+        installed = install_fake_vsd(self.vsd)
+        installed.__enter__()
+        self.addCleanup(installed.__exit__, None, None, None)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(shim, name, value)
+
+    def dispatch(self, message):
+        shim.resync_engine.observe(message)
+        shim.dispatch_message(message)
+
+    def process(self):
+        while self.queue.qsize():
+            shim.handle_message(self.queue.get())
+
+    def fire_retries(self):
+        """queue the waiting retries as if they were due"""
+        while shim.retry_scheduler.depth():
+            shim.fire_retry(shim.retry_scheduler._next_due())
+
+    def get_statuses(self, uuid):
+        """return the bind status of the port in memory, in etcd and the Proton port status"""
+        statuses = [shim.vm_status.get(uuid)]
+
+        for key in (shim.etcd_nuage_path + uuid, 'net-l3vpn/controller/port/' + uuid):
+            try:
+                statuses.append(json.loads(self.client.get(key).value)['status'])
+
+            except etcd.EtcdKeyNotFound:
+                statuses.append(None)
+
+        return tuple(statuses)
+
+
+class TestBindRetries(ShimTestCase):
+    def fail_bind(self):
+        """return a new port whose bind failed, with its retry waiting"""
+        uuid = self.churn.new_port()
+        self.vsd_down = True
+        self.dispatch(self.churn.bind_message(uuid))
+        self.process()
+        self.vsd_down = False
+
+        self.assertEqual(set([uuid]), shim.retry_scheduler.get_keys())
+        self.assertEqual(('pending', 'pending', 'pending'), self.get_statuses(uuid))
+
+        return uuid
+
+    def test_failed_bind_is_rescheduled(self):
+        uuid = self.fail_bind()
+
+        self.fire_retries()
+        self.process()
+
+        self.assertEqual(('up', 'up', 'up'), self.get_statuses(uuid))
+        self.assertEqual(1, self.vsd.count('NUVM'))
+        self.assertEqual(set(), shim.progress.get_pending_keys())
+
+    def test_newer_update_cancels_the_waiting_retry(self):
+        uuid = self.fail_bind()
+
+        self.dispatch(self.churn.bind_message(uuid, 'node-23.opnfvericsson.ca'))
+
+        self.assertEqual((0, 1), (shim.retry_scheduler.depth(), shim.retry_scheduler.cancelled))
+
+        self.process()
+
+        self.assertEqual(('up', 'up', 'up'), self.get_statuses(uuid))
+        self.assertEqual(0, shim.retry_scheduler.fired)
+
+    def test_fired_retry_does_not_replace_a_newer_update(self):
+        uuid = self.fail_bind()
+        # the retry is due just before the update is dispatched
+        retry = shim.retry_scheduler._next_due()
+        self.dispatch(self.churn.bind_message(uuid, 'node-23.opnfvericsson.ca'))
+        shim.fire_retry(retry)
+
+        self.assertEqual(1, self.queue.qsize())
+        self.assertEqual('node-23.opnfvericsson.ca', self.queue.get().value['host_id'])
+
+    def test_retry_never_replaces_a_waiting_event(self):
+        uuid = self.fail_bind()
+        retry = shim.retry_scheduler._next_due()
+        self.dispatch(self.churn.bind_message(uuid, 'node-23.opnfvericsson.ca'))
+        self.queue.put(uuid, retry)
+
+        self.assertEqual(2, self.queue.qsize())
+        self.assertEqual('node-23.opnfvericsson.ca', self.queue.get().value['host_id'])
+
+    def test_error_once_the_attempts_are_spent(self):
+        uuid = self.fail_bind()
+        self.vsd_down = True
+
+        for attempt in range(2):
+            self.fire_retries()
+            self.process()
+
+        self.assertEqual(('error', 'error', 'error'), self.get_statuses(uuid))
+        self.assertEqual((0, 1), (shim.retry_scheduler.depth(), shim.bind_errors))
+
+        # a newer update binds the port again
+        self.vsd_down = False
+        self.dispatch(self.churn.bind_message(uuid))
+        self.process()
+
+        self.assertEqual(('up', 'up', 'up'), self.get_statuses(uuid))
+
+    def fail_all_attempts(self):
+        """return a new port left with the error status once its bind attempts are spent"""
+        uuid = self.fail_bind()
+        self.vsd_down = True
+
+        for attempt in range(2):
+            self.fire_retries()
+            self.process()
+
+        self.vsd_down = False
+        self.assertEqual(('error', 'error', 'error'), self.get_statuses(uuid))
+
+        return uuid
+
+    def test_error_is_cleared_when_the_host_id_is_cleared(self):
+        uuid = self.fail_all_attempts()
+
+        self.dispatch(self.churn.bind_message(uuid, ''))
+        self.process()
+
+        self.assertEqual((None, None, 'unbound'), self.get_statuses(uuid))
+
+    def test_error_is_cleared_when_the_port_moves_to_an_unmanaged_host(self):
+        uuid = self.fail_all_attempts()
+
+        self.dispatch(self.churn.bind_message(uuid, 'unknown-host'))
+        self.process()
+
+        self.assertEqual((None, None, 'unbound'), self.get_statuses(uuid))
+        self.assertEqual(0, self.vsd.count('NUVM'))
+
+    def test_delete_while_the_retry_is_waiting(self):
+        uuid = self.fail_bind()
+
+        self.dispatch(self.churn.delete_message(uuid))
+        self.process()
+        self.fire_retries()
+        self.process()
+
+        self.assertEqual((None, None, 'unbound'), self.get_statuses(uuid))
+        self.assertEqual((0, 0), (self.vsd.count('NUVM'), shim.retry_scheduler.fired))
+
+    def test_delete_after_the_retry_fired(self):
+        uuid = self.fail_bind()
+
+        self.fire_retries()
+        self.dispatch(self.churn.delete_message(uuid))
+        self.assertEqual(2, self.queue.qsize())
+        self.process()
+
+        self.assertEqual((None, None, 'unbound'), self.get_statuses(uuid))
+        self.assertEqual((0, 0), (self.vsd.count('NUVM'), self.vsd.count('NUVPort')))
+
+    def test_retry_failing_before_a_delete_is_not_rescheduled(self):
+        uuid = self.fail_bind()
+
+        self.fire_retries()
+        self.dispatch(self.churn.delete_message(uuid))
+        self.vsd_down = True
+        self.process()
+
+        self.assertEqual((None, None, 'unbound'), self.get_statuses(uuid))
+        self.assertEqual(0, shim.retry_scheduler.depth())
+
+
+class TestThrottle(ShimTestCase):
+    def setUp(self):
+        ShimTestCase.setUp(self)
+        shim.queue_high_water = 4
+        shim.vpn_mirror = VPNTableMirror(proton_dir)
+        shim.resync_engine = ResyncEngine(proton_dir, shim.vpn_mirror)
+        self.queue.depth = self.queue.qsize
+        self.uuids = [self.churn.new_port() for i in range(6)]
+
+        # the watch queued the binds up to the high water mark, the next ones were dropped
+        for uuid in self.uuids[:4]:
+            self.dispatch(self.churn.bind_message(uuid))
+
+        for uuid in self.uuids[4:]:
+            self.churn.bind_message(uuid)
+
+    def throttle(self):
+        """run throttle() in a thread, return the list receiving the index it returns"""
+        result = []
+        thread = threading.Thread(target=lambda: result.append(shim.throttle()))
+        thread.setDaemon(True)
+        thread.start()
+
+        return thread, result
+
+    def test_watch_resumes_once_half_of_the_queue_is_drained(self):
+        thread, result = self.throttle()
+
+        shim.handle_message(self.queue.get())
+        thread.join(1.5)
+        self.assertTrue(thread.is_alive())
+
+        shim.handle_message(self.queue.get())
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+        self.assertEqual([self.client.etcd_index + 1], result)
+        self.assertEqual(1, shim.throttled)
+
+    def test_dropped_events_are_resynced(self):
+        thread, result = self.throttle()
+
+        self.process()
+        thread.join(5)
+        self.process()
+
+        self.assertEqual(['up'] * 6, [shim.vm_status.get(uuid) for uuid in self.uuids])
+        self.assertEqual(6, self.vsd.count('NUVM'))
+
+    def test_resync_is_not_bounded_by_the_high_water_mark(self):
+        shim.queue_high_water = 1
+        thread, result = self.throttle()
+
+        self.process()
+        thread.join(5)
+
+        # only the watch is throttled, the 2 dropped binds are queued over the high water mark
+        self.assertEqual(2, self.queue.qsize())
+
+
+class TestTakeover(ShimTestCase):
+    leader_key = '/controller/nuage-leader'
+
+    def setUp(self):
+        ShimTestCase.setUp(self)
+        shim.vpn_mirror = VPNTableMirror(proton_dir)
+        shim.resync_engine = ResyncEngine(proton_dir, shim.vpn_mirror)
+        shim.standby_watch_timeout = 0.1
+        shim.leadership_lost = lambda: None
+
+        self.uuid = self.churn.new_port()
+        self.write_status('port-0', 'up')
+        self.client.write(self.leader_key, json.dumps({'leader': 'shim-b', 'etcd_index': 0}))
+
+    def write_status(self, uuid, status):
+        self.client.write(shim.etcd_nuage_path + uuid, json.dumps({'status': status}))
+
+    def wait_for(self, condition):
+        for i in range(500):
+            if condition():
+                return
+
+            time.sleep(0.01)
+
+        self.fail('timed out')
+
+    def test_followers_are_stopped_before_taking_over(self):
+        wait_index = shim.load_proton_tables()
+        standby = threading.Thread(target=shim.wait_for_leadership, args=(self.leader_key, 3600, wait_index))
+        standby.setDaemon(True)
+        standby.start()
+
+        # the standby follows the ports and the statuses written by the leader
+        self.churn.bind_message(self.uuid)
+        self.write_status(self.uuid, 'up')
+        self.wait_for(lambda: shim.vm_status.get(self.uuid) == 'up')
+        self.wait_for(lambda: json.loads(shim.resync_engine.get_ports()[self.uuid][2])['host_id'] == 'cbserver5')
+
+        self.client.delete(self.leader_key)
+        standby.join(5)
+
+        self.assertFalse(standby.is_alive())
+        self.assertEqual([], [thread.name for thread in threading.enumerate() if thread.name.startswith('follow_')])
+
+        # the changes after the takeover are left to the watch of the new leader
+        self.write_status(self.uuid, 'pending')
+        self.client.delete('%s/ProtonBasePort/%s' % (proton_dir, self.uuid))
+        time.sleep(0.3)
+
+        self.assertEqual('up', shim.vm_status[self.uuid])
+        self.assertIn(self.uuid, shim.resync_engine.get_ports())
+
+
+class TestStatusCommit(ShimTestCase):
+    def setUp(self):
+        ShimTestCase.setUp(self)
+        self.release = threading.Event()
+
+        def write(proton, uuid, status):
+            self.release.wait(5)
+            shim.write_port_status(proton, uuid, status)
+
+        shim.status_writer = StatusWriter(write, num_writers=1).start()
+
+    def tearDown(self):
+        self.release.set()
+        ShimTestCase.tearDown(self)
+
+    def test_index_is_committed_once_the_statuses_are_written(self):
+        uuid = self.churn.new_port()
+        message = self.churn.bind_message(uuid)
+        shim.progress.advance(message.modifiedIndex - 1)
+        self.dispatch(message)
+        self.process()
+
+        # the event is processed, its statuses are not written yet
+        self.assertEqual('up', shim.vm_status[uuid])
+        self.assertFalse(shim.progress.has_pending(uuid))
+        self.assertEqual(message.modifiedIndex - 1, shim.progress.committed())
+
+        self.release.set()
+        shim.status_writer.join()
+
+        self.assertEqual(('up', 'up', 'up'), self.get_statuses(uuid))
+        self.assertEqual(message.modifiedIndex, shim.progress.committed())
+
+
+class TestReconcile(ShimTestCase):
+    def setUp(self):
+        ShimTestCase.setUp(self)
+        self.reconciler = Reconciler(shim.read_port_intent, shim.read_vsd_state, shim.get_busy_ports,
+                                     shim.requeue_port)
+
+    def bind(self):
+        uuid = self.churn.new_port()
+        self.dispatch(self.churn.bind_message(uuid))
+        self.process()
+
+        self.assertEqual('up', shim.vm_status[uuid])
+
+        return uuid
+
+    def delete_from_vsd(self, kind, name):
+        for obj in self.vsd.objects.values():
+            if obj.__class__.__name__ == kind and obj.name == name:
+                obj.delete()
+
+    def test_port_missing_its_vm_is_bound_again(self):
+        uuid = self.bind()
+        self.delete_from_vsd('NUVM', 'vm-' + uuid)
+
+        self.assertEqual(set([uuid]), self.reconciler.reconcile().missing_vms)
+        event = self.queue.get()
+        self.assertEqual('reconcile', event.action)
+        shim.handle_message(event)
+
+        self.assertEqual(('up', 'up', 'up'), self.get_statuses(uuid))
+        self.assertEqual(1, self.vsd.count('NUVM'))
+        self.assertEqual(set(), self.reconciler.reconcile().get_ports())
+
+    def test_vport_of_a_deleted_port_is_unbound(self):
+        uuid = self.bind()
+        # the delete was missed by the shim
+        shim.resync_engine.observe(self.churn.delete_message(uuid))
+
+        self.assertEqual(set([uuid]), self.reconciler.reconcile().orphaned)
+        event = self.queue.get()
+        self.assertEqual({'id': uuid, 'device_id': 'vm-' + uuid}, event.prev_value)
+        shim.handle_message(event)
+
+        self.assertEqual((0, 0), (self.vsd.count('NUVM'), self.vsd.count('NUVPort')))
+        self.assertEqual((None, None, 'unbound'), self.get_statuses(uuid))
+
+    def test_stale_record_of_a_port_moved_to_an_unmanaged_host_is_cleared(self):
+        uuid = self.bind()
+        self.dispatch(self.churn.bind_message(uuid, 'unknown-host'))
+        self.process()
+        self.delete_from_vsd('NUVPort', uuid)
+
+        self.assertEqual(set([uuid]), self.reconciler.reconcile().stale)
+        self.process()
+
+        self.assertEqual((None, None, 'unbound'), self.get_statuses(uuid))
+        self.assertEqual(set(), self.reconciler.reconcile().get_ports())
+        self.assertEqual(1, self.reconciler.requeued)
+
+    def test_pending_port_is_skipped(self):
+        uuid = self.bind()
+        self.delete_from_vsd('NUVM', 'vm-' + uuid)
+        shim.vm_status[uuid] = 'pending'
+
+        self.assertEqual(set([uuid]), self.reconciler.reconcile().missing_vms)
+        self.assertEqual((0, 0), (self.reconciler.requeued, self.queue.qsize()))
+
+        # requeued before the port became pending
+        shim.requeue_port(uuid, None)
+        self.process()
+
+        self.assertEqual(0, self.vsd.count('NUVM'))
+        self.assertEqual('pending', shim.vm_status[uuid])
+
+
+class TestWarmPool(ShimTestCase):
+    def setUp(self):
+        ShimTestCase.setUp(self)
+        shim.warm_pool = WarmPool(shim.provision_vports, shim.release_vports, size=10).start()
+
+    def create_ports(self, count):
+        """return new ports not bound yet, once their vports are pooled"""
+        uuids = [self.churn.new_port() for i in range(count)]
+
+        for uuid in uuids:
+            self.dispatch(self.churn.bind_message(uuid, ''))
+
+        self.process()
+        self.wait_for(lambda: shim.warm_pool.provisioned == count)
+
+        return uuids
+
+    def wait_for(self, condition):
+        for i in range(500):
+            if condition():
+                return
+
+            time.sleep(0.01)
+
+        self.fail('timed out')
+
+    def test_vport_of_a_port_bound_to_an_unmanaged_host_is_released(self):
+        managed, unmanaged = self.create_ports(2)
+
+        self.dispatch(self.churn.bind_message(managed))
+        self.dispatch(self.churn.bind_message(unmanaged, 'unknown-host'))
+        self.process()
+        self.wait_for(lambda: shim.warm_pool.released == 1)
+
+        self.assertEqual((1, 0), (shim.warm_pool.hits, shim.warm_pool.depth()))
+        self.assertEqual(['up'], shim.vm_status.values())
+        self.assertEqual(set([managed]), set(vport.name for vport in self.vsd.objects.values()
+                                             if vport.__class__.__name__ == 'NUVPort'))
+
+    def test_vports_of_the_ports_moved_to_another_instance_are_released(self):
+        shim.membership = Membership(self.client, 'shim-0', on_change=shim.rebalance_ports)
+        shim.membership.join()
+        uuids = self.create_ports(8)
+
+        self.client.write(shim.membership.key + '/shim-1', 'shim-1')
+        shim.membership.load()
+        kept = set(uuid for uuid in uuids if shim.membership.owns(uuid))
+        self.assertTrue(0 < len(kept) < len(uuids))
+
+        self.wait_for(lambda: shim.warm_pool.released == len(uuids) - len(kept))
+
+        self.assertEqual(kept, shim.warm_pool.get_keys())
+        self.assertEqual(len(kept), self.vsd.count('NUVPort'))
+
+
+if __name__ == '__main__':
+    unittest.main()
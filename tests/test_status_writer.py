@@ -0,0 +1,119 @@
+import threading
+import time
+import unittest
+
+from nuage.status_writer import StatusWriter
+
+
+class TestStatusWriter(unittest.TestCase):
+    def test_waiting_status_is_superseded(self):
+        written = []
+        blocked = threading.Event()
+        release = threading.Event()
+
+        def write(proton, uuid, status):
+            if uuid == 'port-a' and not blocked.is_set():
+                blocked.set()
+                release.wait(5)
+            written.append((uuid, status))
+
+        writer = StatusWriter(write, num_writers=1).start()
+        writer.put('net-l3vpn', 'port-a', 'pending')
+        blocked.wait(5)
+
+        # port-a pending is being written, its next statuses wait and collapse
+        writer.put('net-l3vpn', 'port-a', 'up')
+        writer.put('net-l3vpn', 'port-a', 'unbound')
+        writer.put('net-l3vpn', 'port-b', 'up')
+        release.set()
+        writer.join()
+
+        self.assertEqual([('port-a', 'pending'), ('port-a', 'unbound'), ('port-b', 'up')], written)
+        self.assertEqual(1, writer.superseded())
+        self.assertEqual(3, writer.written)
+
+    def test_callback_runs_once_the_statuses_of_the_port_are_written(self):
+        release = threading.Event()
+        written = []
+        done = []
+
+        def write(proton, uuid, status):
+            release.wait(5)
+            written.append((uuid, status))
+
+        writer = StatusWriter(write, num_writers=1).start()
+        writer.put('net-l3vpn', 'port-a', 'pending')
+        writer.put('net-l3vpn', 'port-a', 'up')
+        writer.when_written('port-a', lambda: done.append(list(written)))
+        writer.when_written('port-b', lambda: done.append('port-b'))
+
+        # port-b has nothing queued
+        self.assertEqual(['port-b'], done)
+
+        release.set()
+        writer.join()
+
+        self.assertEqual(['port-b', written], done)
+        self.assertEqual(('port-a', 'up'), written[-1])
+
+    def test_failed_write_is_retried(self):
+        attempts = []
+
+        def write(proton, uuid, status):
+            attempts.append(status)
+            if len(attempts) < 3:
+                raise Exception('etcd unavailable')
+
+        writer = StatusWriter(write, num_writers=1, retry_delay=0.01).start()
+        writer.put('net-l3vpn', 'port-a', 'up')
+        writer.join()
+
+        self.assertEqual(['up'] * 3, attempts)
+        self.assertEqual((1, 2, 0), (writer.written, writer.retries, writer.failures))
+
+    def test_failing_port_does_not_hold_its_writer(self):
+        written = []
+
+        def write(proton, uuid, status):
+            if (uuid, status) == ('port-a', 'up'):
+                raise Exception('etcd unavailable')
+
+            written.append(uuid)
+
+        writer = StatusWriter(write, num_writers=1, retry_delay=60).start()
+        writer.put('net-l3vpn', 'port-a', 'up')
+        writer.put('net-l3vpn', 'port-b', 'up')
+        writer.when_written('port-b', lambda: written.append('port-b written'))
+
+        for i in range(500):
+            if writer.retries:
+                break
+
+            time.sleep(0.01)
+
+        writer.pool.join()
+
+        self.assertEqual(['port-b', 'port-b written'], written)
+        self.assertEqual((1, 1), (writer.depth(), writer.retries))
+
+        # a newer status of the port replaces its retry
+        writer.put('net-l3vpn', 'port-a', 'unbound')
+        writer.join()
+
+        self.assertEqual(['port-b', 'port-b written', 'port-a'], written)
+        self.assertEqual((0, 1), (writer.depth(), writer.superseded()))
+
+    def test_gives_up_after_max_attempts(self):
+        def write(proton, uuid, status):
+            raise Exception('etcd unavailable')
+
+        writer = StatusWriter(write, num_writers=1, max_attempts=3, retry_delay=0.01).start()
+        writer.put('net-l3vpn', 'port-a', 'up')
+        writer.join()
+
+        self.assertEqual((0, 2, 1), (writer.written, writer.retries, writer.failures))
+        self.assertTrue(writer.flush(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import json
+import unittest
+
+import etcd
+
+from nuage.vpn_mirror import VPNTableMirror
+
+proton_dir = '/net-l3vpn/proton'
+port_uuid = '4d3b364c-f871-407a-8426-0eaed602862f'
+
+
+def node(table, key, value):
+    return {'key': '%s/%s/%s' % (proton_dir, table, key), 'value': json.dumps(value), 'modifiedIndex': 5}
+
+
+def snapshot():
+    result = etcd.EtcdResult(action='get', node={
+        'key': proton_dir, 'dir': True, 'nodes': [
+            {'key': proton_dir + '/VPNPort', 'dir': True, 'nodes': [
+                node('VPNPort', port_uuid, {'id': port_uuid, 'vpn_instance': 'vpn1'})]},
+            {'key': proton_dir + '/VpnInstance', 'dir': True, 'nodes': [
+                node('VpnInstance', 'vpn1', {'vpn_instance_name': 'blue', 'route_distinguishers': '100:1',
+                                             'ipv4_family': 'af1'})]},
+            {'key': proton_dir + '/VpnAfConfig', 'dir': True, 'nodes': [
+                node('VpnAfConfig', 'af1', {'vrf_rt_value': '100:2'})]},
+            {'key': proton_dir + '/ProtonBasePort', 'dir': True, 'nodes': [
+                node('ProtonBasePort', port_uuid, {'id': port_uuid, 'host_id': ''})]},
+        ]})
+    result.etcd_index = 42
+
+    return result
+
+
+class TestVPNTableMirror(unittest.TestCase):
+    def test_snapshot_resolves_vpn_info(self):
+        mirror = VPNTableMirror(proton_dir)
+        mirror.load_snapshot(snapshot())
+
+        self.assertTrue(mirror.ready)
+        self.assertEqual(42, mirror.etcd_index)
+        self.assertEqual({'name': 'blue', 'route_distinguisher': '100:1', 'route_target': '100:2'},
+                         mirror.get_vpn_info(port_uuid))
+        self.assertFalse(mirror.get_vpn_info('unknown'))
+
+    def test_watch_events_update_the_mirror(self):
+        mirror = VPNTableMirror(proton_dir)
+        mirror.load_snapshot(snapshot())
+
+        update = etcd.EtcdResult(action='set', node=node('VpnAfConfig', 'af1', {'vrf_rt_value': '100:3'}))
+        self.assertTrue(mirror.apply(update))
+        self.assertEqual('100:3', mirror.get_vpn_info(port_uuid)['route_target'])
+
+        delete = etcd.EtcdResult(action='delete', node={'key': '%s/VPNPort/%s' % (proton_dir, port_uuid)})
+        self.assertTrue(mirror.apply(delete))
+        self.assertFalse(mirror.get_vpn_info(port_uuid))
+
+    def test_other_tables_are_ignored(self):
+        mirror = VPNTableMirror(proton_dir)
+        event = etcd.EtcdResult(action='set', node=node('ProtonBasePort', port_uuid, {'host_id': 'cbserver5'}))
+
+        self.assertFalse(mirror.apply(event))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from nuage.vsd_cache import TTLCache, VSDObjectCache, is_not_found
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeConnection(object):
+    def __init__(self, status_code):
+        self.response = FakeResponse(status_code)
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, status_code):
+        self.connection = FakeConnection(status_code)
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = TTLCache()
+        self.assertIsNone(cache.get('a'))
+
+        cache.put('a', 1)
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_expired_entries_are_misses(self):
+        cache = TTLCache(ttl=-1)
+        cache.put('a', 1)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, len(cache))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+
+
+class TestVSDObjectCache(unittest.TestCase):
+    def test_lookup_calls_loader_once(self):
+        cache = VSDObjectCache()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return 'domain'
+
+        self.assertEqual('domain', cache.lookup('domain', ('ent', '1:1', '2:2'), loader))
+        self.assertEqual('domain', cache.lookup('domain', ('ent', '1:1', '2:2'), loader))
+        self.assertEqual(1, len(calls))
+        self.assertEqual({'hits': 1, 'misses': 1, 'size': 1}, cache.get_stats()['domain'])
+
+    def test_missing_objects_are_not_cached(self):
+        cache = VSDObjectCache()
+        self.assertIsNone(cache.lookup('zone', ('domain', 'Zone0'), lambda: None))
+        self.assertEqual(0, cache.get_stats()['zone']['size'])
+
+    def test_is_not_found(self):
+        self.assertTrue(is_not_found(FakeHTTPError(404)))
+        self.assertFalse(is_not_found(FakeHTTPError(500)))
+        self.assertFalse(is_not_found(ValueError()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import threading
+import time
+import unittest
+
+from bambou import NURESTSession
+
+from nuage import vsd_session
+from nuage.vsd_session import VSDSessionManager
+
+
+class FakeMe(object):
+    """root object of a session, its fetch() logs in without a VSD"""
+    logins = 0
+
+    def __init__(self, api_key_expiry=None):
+        self.api_key = None
+        self.api_key_expiry = api_key_expiry
+
+    def fetch(self):
+        FakeMe.logins += 1
+        self.api_key = 'key-%d' % FakeMe.logins
+
+
+class OfflineSession(vsd_session.vsdk.NUVSDSession):
+    """real NUVSDSession, authenticated by a FakeMe"""
+    api_key_expiry = None
+
+    def create_root_object(self):
+        return FakeMe(OfflineSession.api_key_expiry)
+
+
+class TestVSDSessionManager(unittest.TestCase):
+    def setUp(self):
+        self.orig_session = vsd_session.vsdk.NUVSDSession
+        vsd_session.vsdk.NUVSDSession = OfflineSession
+        OfflineSession.api_key_expiry = None
+        self.manager = VSDSessionManager()
+
+    def tearDown(self):
+        vsd_session.vsdk.NUVSDSession = self.orig_session
+
+    def acquire(self):
+        return self.manager.acquire('https://vsd:8443', 'csp', 'csproot', 'csproot')
+
+    def test_session_is_reused(self):
+        with self.manager.session('https://vsd:8443', 'csp', 'csproot', 'csproot') as first:
+            pass
+
+        with self.manager.session('https://vsd:8443', 'csp', 'csproot', 'csproot') as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual((1, 1), (self.manager.logins, self.manager.reuses))
+
+    def test_session_is_shared_and_current_in_every_thread(self):
+        session = self.acquire()
+        current = []
+
+        def worker():
+            self.acquire()
+            current.append(NURESTSession.get_current_session())
+
+        threads = [threading.Thread(target=worker) for i in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([session] * 4, current)
+        self.assertIs(session, NURESTSession.get_current_session())
+        self.assertEqual(1, self.manager.logins)
+
+    def test_expired_session_is_replaced_without_clearing_its_key(self):
+        self.manager.max_age = 0
+        first = self.acquire()
+        key = first.login_controller.api_key
+
+        second = self.acquire()
+
+        self.assertIsNot(first, second)
+        self.assertIs(second, NURESTSession.get_current_session())
+        # requests still running with the expired session keep their key
+        self.assertEqual(key, first.login_controller.api_key)
+        self.assertNotEqual(key, second.login_controller.api_key)
+        self.assertEqual(2, self.manager.logins)
+
+    def test_api_key_expiry_reported_by_vsd(self):
+        OfflineSession.api_key_expiry = (time.time() + 3600) * 1000
+        first = self.acquire()
+        self.assertIs(first, self.acquire())
+
+        first.user.api_key_expiry = (time.time() + 30) * 1000
+        self.assertIsNot(first, self.acquire())
+
+
+if __name__ == '__main__':
+    unittest.main()
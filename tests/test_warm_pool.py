@@ -0,0 +1,112 @@
+import threading
+import unittest
+
+from nuage.vm_split_activation import NUSplitActivation
+from nuage.warm_pool import WarmPool
+from tests.fakes import FakeVSD, install_fake_vsd
+
+
+class TestWarmPool(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.released = []
+        self.provisioned = threading.Event()
+
+    def provision(self, items):
+        self.batches.append([key for key, item in items])
+        self.provisioned.set()
+
+        return dict((key, (item, 'vport-' + key)) for key, item in items)
+
+    def release(self, vports):
+        self.released.extend(vports)
+        return len(vports)
+
+    def wait_provisioned(self, pool, count):
+        for i in range(100):
+            if pool.provisioned >= count:
+                return
+
+            self.provisioned.wait(0.05)
+            self.provisioned.clear()
+
+        self.fail('%d vports provisioned, expected %d' % (pool.provisioned, count))
+
+    def test_expected_items_are_provisioned_in_batches_up_to_the_size(self):
+        pool = WarmPool(self.provision, self.release, size=3, batch_size=2)
+
+        for key in 'abcd':
+            pool.expect(key, 'subnet-1')
+
+        pool.start()
+        self.wait_provisioned(pool, 3)
+
+        self.assertEqual([['a', 'b'], ['c']], self.batches)
+        self.assertEqual((3, 1), (pool.depth(), pool.expected()))
+
+        # a claim makes room for the last one
+        self.assertEqual('vport-a', pool.claim('a', 'subnet-1'))
+        self.wait_provisioned(pool, 4)
+        self.assertEqual(['d'], self.batches[-1])
+
+    def test_claim_of_another_location_releases_the_vport(self):
+        pool = WarmPool(self.provision, self.release, size=2).start()
+        pool.expect('a', 'subnet-1')
+        self.wait_provisioned(pool, 1)
+
+        self.assertIsNone(pool.claim('a', 'subnet-2'))
+        self.assertIsNone(pool.claim('b', 'subnet-1'))
+        self.assertEqual((0, 2), (pool.hits, pool.misses))
+
+        for i in range(100):
+            if self.released:
+                break
+            self.provisioned.wait(0.01)
+
+        self.assertEqual(['vport-a'], self.released)
+
+    def test_forgotten_item_is_released(self):
+        pool = WarmPool(self.provision, self.release, size=2).start()
+        pool.expect('a', 'subnet-1')
+        self.wait_provisioned(pool, 1)
+        pool.forget('a')
+
+        for i in range(100):
+            if self.released:
+                break
+            self.provisioned.wait(0.01)
+
+        self.assertEqual(['vport-a'], self.released)
+        self.assertEqual(set(), pool.get_keys())
+
+
+class TestProvisionMany(unittest.TestCase):
+    def test_activation_uses_the_provisioned_vport(self):
+        vsd = FakeVSD()
+        config = {'enterprise_name': 'Gluon', 'domain_name': 'vpn-1', 'domain_template_name': 'GluonDomainTemplate',
+                  'route_distinguisher': '100:1', 'route_target': '100:1', 'tunnel_type': 'GRE',
+                  'zone_name': 'Zone0', 'subnet_name': 'Subnet0', 'network_address': '10.0.0.0',
+                  'netmask': '255.255.255.0'}
+        ports = [{'vport_name': 'port-%d' % i, 'vm_uuid': 'vm-%d' % i, 'vm_name': 'vm-%d' % i, 'vm_ip': '10.0.0.%d' % i,
+                  'vm_mac': ''} for i in range(3)]
+
+        with install_fake_vsd(vsd):
+            sa = NUSplitActivation(config, vsd)
+            vports = sa.provision_many(ports)
+
+            self.assertEqual(['port-0', 'port-1', 'port-2'], sorted(vports))
+            self.assertEqual((3, 0), (vsd.count('NUVPort'), vsd.count('NUVM')))
+
+            vsd.requests = 0
+            self.assertTrue(sa._for_port(ports[0]).activate(vports['port-0']))
+
+            # only the VM is looked up and created
+            self.assertEqual(2, vsd.requests)
+            self.assertEqual((3, 1), (vsd.count('NUVPort'), vsd.count('NUVM')))
+
+            self.assertEqual(2, sa.release_vports([vports['port-1'], vports['port-2']]))
+            self.assertEqual(1, vsd.count('NUVPort'))
+
+
+if __name__ == '__main__':
+    unittest.main()
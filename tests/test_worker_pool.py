@@ -0,0 +1,50 @@
+import threading
+import unittest
+
+from nuage.worker_pool import ShardedWorkerPool
+
+
+class TestShardedWorkerPool(unittest.TestCase):
+    def test_same_key_same_worker(self):
+        pool = ShardedWorkerPool(8, None)
+        uuid = '4d3b364c-f871-407a-8426-0eaed602862f'
+        self.assertEqual(pool.shard_for(uuid), pool.shard_for(uuid))
+        self.assertEqual(0, pool.shard_for(None))
+
+    def test_events_of_a_port_are_processed_in_order(self):
+        processed = {}
+        lock = threading.Lock()
+
+        def handler(item):
+            key, seq = item
+            with lock:
+                processed.setdefault(key, []).append(seq)
+
+        pool = ShardedWorkerPool(4, handler).start()
+
+        for seq in range(50):
+            for key in ('port-a', 'port-b', 'port-c'):
+                pool.put(key, (key, seq))
+
+        pool.join()
+
+        for key in ('port-a', 'port-b', 'port-c'):
+            self.assertEqual(range(50), processed[key])
+
+        stats = pool.get_stats()
+        self.assertEqual(150, sum(s['processed'] for s in stats))
+        self.assertEqual(0, pool.depth())
+
+    def test_handler_errors_are_counted(self):
+        def handler(item):
+            raise RuntimeError(item)
+
+        pool = ShardedWorkerPool(1, handler).start()
+        pool.put('port-a', 'boom')
+        pool.join()
+
+        self.assertEqual(1, pool.get_stats()[0]['errors'])
+
+
+if __name__ == '__main__':
+    unittest.main()